@@ -19,7 +19,10 @@ const LLMMessageSchemaShape = {
 
 export const LLMMessageSchema = z.object(LLMMessageSchemaShape);
 
-export const GetMessagesResponseSchema = DefaultResponseSchema.extend({ data: z.array(LLMMessageSchema) });
+export const GetMessagesResponseSchema = DefaultResponseSchema.extend({
+  data: z.array(LLMMessageSchema),
+  cursor: z.uuidv4().nullish(),
+});
 
 export const CreateMessageResponseSchema = DefaultResponseSchema.extend(LLMMessageSchemaShape).extend({
   room_id: z.uuidv4(),
@@ -0,0 +1,90 @@
+"""
+Moves the old turns of long chat rooms into their compressed archive, so the
+room rows every request reads and rewrites only carry recent history. Rooms
+are compacted one at a time, each locked in its own transaction.
+
+    python -m agents_play.compact_chats [--after-days 30] [--batch-size 200]
+"""
+
+import argparse
+import uuid
+from datetime import timedelta
+
+from common.datetime_utils import datetime_now_with_timezone
+from database.database import get_database
+from llm.conf import settings
+from llm.models import ChatRoom, ChatRoomArchive
+from sqlmodel import Session, col, select, tuple_
+
+
+def compact(after_days: float, batch_size: int) -> tuple[int, int]:
+    archive_before = datetime_now_with_timezone() - timedelta(days=after_days)
+    # Rooms shorter than this can't have enough to archive
+    min_room_messages = (
+        settings.llm_archive_keep_recent_messages + settings.llm_archive_min_messages
+    )
+
+    rooms_compacted = messages_archived = 0
+    after: tuple[uuid.UUID, uuid.UUID] | None = None
+    engine = get_database().engine
+    while True:
+        query = (
+            select(col(ChatRoom.owner_id), col(ChatRoom.id))
+            .where(col(ChatRoom.message_count) >= min_room_messages)
+            .order_by(col(ChatRoom.owner_id), col(ChatRoom.id))
+            .limit(batch_size)
+        )
+        if after is not None:
+            query = query.where(
+                tuple_(col(ChatRoom.owner_id), col(ChatRoom.id)) > after
+            )
+        with Session(engine) as session:
+            room_keys = session.exec(query).all()
+        if not room_keys:
+            return rooms_compacted, messages_archived
+
+        for owner_id, room_id in room_keys:
+            with Session(engine) as session:
+                room = ChatRoom.get(
+                    session=session,
+                    owner_id=owner_id,
+                    room_id=room_id,
+                    for_update=True,
+                )
+                if room is None:
+                    continue
+
+                archived = ChatRoomArchive.compact(
+                    room=room,
+                    session=session,
+                    archive_before=archive_before,
+                    keep_recent=settings.llm_archive_keep_recent_messages,
+                    min_messages=settings.llm_archive_min_messages,
+                    segment_messages=settings.llm_archive_segment_messages,
+                    zstd_level=settings.llm_archive_zstd_level,
+                )
+                session.commit()
+
+            if archived > 0:
+                rooms_compacted += 1
+                messages_archived += archived
+
+        after = room_keys[-1]
+        print(f"{rooms_compacted} rooms compacted, {messages_archived} messages")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--after-days", type=float, default=settings.llm_archive_after_days
+    )
+    parser.add_argument("--batch-size", type=int, default=200)
+    arguments = parser.parse_args()
+
+    compact(arguments.after_days, arguments.batch_size)
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,7 +1,44 @@
-from common.conf import BaseSettings
+from functools import cache
 
+from checkpoints.conf import CheckpointSettings
+from common.conf import (
+    CompressionSettings,
+    LLMHttpSettings,
+    LLMRoutingSettings,
+    LoopMonitorSettings,
+    ProfilingSettings,
+    TrafficRecordSettings,
+    lazy_settings,
+)
+from database.conf import DatabaseSettings
+from foreign_exchange.conf import ForeignExchangeSettings
+from llm.conf import LLMSettings
+from todos.conf import TodosSettings
+from usage.conf import UsageSettings
 
-class __Settings(BaseSettings): ...
 
+class Settings(
+    CheckpointSettings,
+    CompressionSettings,
+    DatabaseSettings,
+    ForeignExchangeSettings,
+    LLMHttpSettings,
+    LLMRoutingSettings,
+    LLMSettings,
+    LoopMonitorSettings,
+    ProfilingSettings,
+    TodosSettings,
+    TrafficRecordSettings,
+    UsageSettings,
+):
+    """
+    Settings of every package in one object, so the environment is read once.
+    """
 
-settings = __Settings()  # type: ignore
+
+@cache
+def get_settings() -> Settings:
+    return Settings()  # type: ignore
+
+
+settings = lazy_settings()
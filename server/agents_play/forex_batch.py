@@ -0,0 +1,155 @@
+"""
+Runs currency queries through the foreign exchange graph without the server,
+for bulk reports. Queries are read one per line, as plain text or as JSON
+objects `{"query": ..., "id": ...}`, from a file or stdin. One NDJSON result
+per query is written to stdout as soon as it is ready, so results come out
+of order, the line number and id tell them apart. Rates of a base are fetched
+once and shared by every query asking for them.
+
+    python -m agents_play.forex_batch queries.txt [--concurrency 8] > rates.ndjson
+    cat queries.jsonl | python -m agents_play.forex_batch - --timeout 60
+"""
+
+import argparse
+import asyncio
+import sys
+from typing import IO, Any
+
+import orjson
+from common.deadlines import Deadline
+from foreign_exchange.graph import foreign_exchange_rate_invoke
+from foreign_exchange.tools import get_foreign_exchange_client
+from pydantic import BaseModel
+
+
+class BatchQuery(BaseModel):
+    line: int
+    query: str
+    id: Any = None
+
+    @classmethod
+    def parse(cls, line: int, raw: str) -> "BatchQuery":
+        if not raw.startswith("{"):
+            return cls(line=line, query=raw)
+
+        parsed = orjson.loads(raw)
+        query = parsed.get("query")
+        if not isinstance(query, str):
+            raise ValueError('JSON queries need a "query" string')
+
+        return cls(line=line, query=query, id=parsed.get("id"))
+
+
+async def run_query(query: BatchQuery, timeout_seconds: float) -> dict[str, Any]:
+    result: dict[str, Any] = {"line": query.line, "id": query.id, "query": query.query}
+    try:
+        end_state = await foreign_exchange_rate_invoke(
+            request=query.query, deadline=Deadline.from_timeout(timeout_seconds)
+        )
+    except Exception as e:
+        return {**result, "base": None, "rates": None, "error": str(e)}
+
+    return {
+        **result,
+        "base": end_state.user_currency_input,
+        "rates": end_state.rates if end_state.failure_message is None else None,
+        "error": end_state.failure_message,
+    }
+
+
+async def run_batch(
+    source: IO[str], output: IO[bytes], concurrency: int, timeout_seconds: float
+) -> tuple[int, int]:
+    # Bounded, a large input is never read much ahead of the workers
+    queries: asyncio.Queue[BatchQuery | None] = asyncio.Queue(maxsize=concurrency * 2)
+    counts = {"queries": 0, "failed": 0}
+
+    def write(result: dict[str, Any]) -> None:
+        counts["queries"] += 1
+        if result["error"] is not None:
+            counts["failed"] += 1
+        output.write(orjson.dumps(result) + b"\n")
+        output.flush()
+
+    async def read() -> None:
+        line = 0
+        while raw := await asyncio.to_thread(source.readline):
+            line += 1
+            raw = raw.strip()
+            if not raw:
+                continue
+
+            try:
+                query = BatchQuery.parse(line=line, raw=raw)
+            except ValueError as e:
+                write(
+                    {
+                        "line": line,
+                        "id": None,
+                        "query": raw,
+                        "base": None,
+                        "rates": None,
+                        "error": str(e),
+                    }
+                )
+                continue
+
+            await queries.put(query)
+
+        for _ in range(concurrency):
+            await queries.put(None)
+
+    async def work() -> None:
+        while (query := await queries.get()) is not None:
+            write(await run_query(query, timeout_seconds=timeout_seconds))
+
+    await asyncio.gather(read(), *(work() for _ in range(concurrency)))
+
+    return counts["queries"], counts["failed"]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("queries", help="File of queries, - for stdin")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--timeout", type=float, default=30, help="Seconds allowed per query"
+    )
+    parser.add_argument(
+        "--rates-ttl",
+        type=float,
+        default=300,
+        help="Seconds fetched rates are reused for, 0 to fetch every time",
+    )
+    arguments = parser.parse_args()
+
+    get_foreign_exchange_client().rates_ttl_seconds = arguments.rates_ttl
+
+    if arguments.queries == "-":
+        queries, failed = asyncio.run(
+            run_batch(
+                sys.stdin,
+                sys.stdout.buffer,
+                concurrency=arguments.concurrency,
+                timeout_seconds=arguments.timeout,
+            )
+        )
+    else:
+        with open(arguments.queries) as source:
+            queries, failed = asyncio.run(
+                run_batch(
+                    source,
+                    sys.stdout.buffer,
+                    concurrency=arguments.concurrency,
+                    timeout_seconds=arguments.timeout,
+                )
+            )
+    print(f"{queries} queries, {failed} failed", file=sys.stderr)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
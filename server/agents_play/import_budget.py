@@ -0,0 +1,115 @@
+"""
+Fails when importing the server gets slower than its budget or opens a
+database connection, so regressions in startup time are caught before every
+worker pays for them.
+
+The budget is relative: the server's import time over the time of importing
+just its heaviest dependencies, both measured on the same machine, so a
+slower or busier machine doesn't fail it. An absolute limit can be added.
+
+    python -m agents_play.import_budget [--max-ratio 2.5] [--runs 5]
+        [--budget-seconds 5]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+# Measured at 1.6 to 1.8, what the server's own modules add on top of these,
+# with room for the noise of a busy machine
+IMPORT_TIME_MAX_RATIO = 2.5
+IMPORTED_MODULE = "agents_play.main"
+BASELINE_MODULES = ("fastapi", "sqlmodel", "langgraph.graph", "langchain_core.messages")
+
+# Runs in a fresh interpreter, nothing may be imported before the clock starts
+IMPORT_PROBE = """
+import time
+
+start = time.perf_counter()
+
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+connections = 0
+
+
+def on_connect(*args):
+    global connections
+    connections += 1
+
+
+event.listen(Pool, "connect", on_connect)
+
+import {module}
+
+print(time.perf_counter() - start, connections)
+"""
+
+
+def measure_import(module: str) -> tuple[float, int]:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE.format(module=module)],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    elapsed_seconds, connections = output.split()
+
+    return float(elapsed_seconds), int(connections)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--max-ratio", type=float, default=IMPORT_TIME_MAX_RATIO)
+    parser.add_argument(
+        "--budget-seconds",
+        type=float,
+        default=None,
+        help="Absolute limit on top of the ratio, none by default",
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    arguments = parser.parse_args()
+
+    measurements: list[tuple[float, int]] = []
+    baselines: list[float] = []
+    for _ in range(arguments.runs):
+        # Paired back to back, a slow spell of the machine hits both alike
+        measurements.append(measure_import(IMPORTED_MODULE))
+        baselines.append(measure_import(", ".join(BASELINE_MODULES))[0])
+    # The fastest runs are the ones least disturbed by the rest of the machine
+    elapsed_seconds = min(elapsed for elapsed, _ in measurements)
+    baseline_seconds = min(baselines)
+    connections = max(connections for _, connections in measurements)
+    # The median pair, a single lopsided pair doesn't decide
+    ratio = statistics.median(
+        elapsed / baseline for (elapsed, _), baseline in zip(measurements, baselines)
+    )
+
+    print(
+        f"import {IMPORTED_MODULE}: {elapsed_seconds:.3f}s, "
+        f"{ratio:.2f}x its dependencies, {baseline_seconds:.3f}s "
+        f"(budget {arguments.max_ratio:.2f}x), "
+        f"{connections} database connection(s)"
+    )
+
+    if connections > 0:
+        print("Importing the server must not connect to the database")
+        return 1
+
+    if ratio > arguments.max_ratio:
+        print("Import time is over budget")
+        return 1
+
+    if (
+        arguments.budget_seconds is not None
+        and elapsed_seconds > arguments.budget_seconds
+    ):
+        print("Import time is over the absolute budget")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,111 @@
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
 from app_api.router import app_api_router
+from checkpoints.saver import get_graph_checkpointer
+from common.compression import CompressionMiddleware
+from common.llm_clients import get_llm_client_factory
+from common.loop_monitor import LoopMonitorMiddleware, get_loop_monitor
+from common.profiling import ProfilingMiddleware
+from common.recording import TrafficRecorderMiddleware
+from database.database import create_db_and_tables, get_database
+from database.read_your_writes import ReadYourWritesMiddleware
 from fastapi import FastAPI
 from health.router import health_router
+from llm.router import llm_router
+from llm.write_behind import get_chat_turns_write_behind
+from usage.meter import get_llm_usage_meter
 
 from agents_play.conf import settings
 
-assert settings.openai_api_key
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    if settings.database_create_tables_on_startup:
+        await asyncio.to_thread(create_db_and_tables, get_database())
+
+    # Checks replica lag in the background, never on the request path
+    await get_database().start()
+
+    loop_monitor = get_loop_monitor()
+    if loop_monitor is not None:
+        await loop_monitor.start()
+
+    chat_turns_write_behind = get_chat_turns_write_behind()
+    if chat_turns_write_behind is not None:
+        await chat_turns_write_behind.start()
+
+    llm_usage_meter = get_llm_usage_meter()
+    if llm_usage_meter is not None:
+        await llm_usage_meter.start()
+
+    graph_checkpointer = get_graph_checkpointer()
+    if graph_checkpointer is not None:
+        await graph_checkpointer.start()
+
+    yield
+
+    if chat_turns_write_behind is not None:
+        # Flushes whatever is still pending before the worker exits
+        await chat_turns_write_behind.stop()
+
+    if llm_usage_meter is not None:
+        await llm_usage_meter.stop()
+
+    if graph_checkpointer is not None:
+        await graph_checkpointer.stop()
+
+    # Last, the workers stopped above may still be calling models
+    await get_llm_client_factory().aclose()
+
+    await get_database().stop()
+
+    if loop_monitor is not None:
+        await loop_monitor.stop()
+
+
+def create_app() -> FastAPI:
+    """
+    The app, configured from the settings read here, on its first use rather
+    than on import. Served with `uvicorn agents_play.main:create_app --factory`.
+    """
+    app = FastAPI(lifespan=lifespan)
+
+    if settings.profiling_enabled:
+        app.add_middleware(ProfilingMiddleware)
+
+    app.add_middleware(
+        ReadYourWritesMiddleware,
+        max_age_seconds=settings.database_read_your_writes_seconds,
+    )
+
+    loop_monitor = get_loop_monitor()
+    if loop_monitor is not None:
+        app.add_middleware(LoopMonitorMiddleware, monitor=loop_monitor)
+
+    if settings.traffic_record_path is not None:
+        app.add_middleware(
+            TrafficRecorderMiddleware,
+            path_prefix=app_api_router.prefix,
+            trace_path=settings.traffic_record_path,
+            redact_patterns=settings.traffic_record_redact_patterns,
+            recorded_headers=settings.traffic_record_headers,
+        )
+
+    # Added last so it wraps the other middleware, the recorder sees plain bodies
+    app.add_middleware(
+        CompressionMiddleware,
+        path_prefixes=[
+            f"{app_api_router.prefix}{llm_router.prefix}",
+            health_router.prefix,
+        ],
+        min_bytes=settings.response_compression_min_bytes,
+        gzip_level=settings.response_compression_gzip_level,
+        brotli_quality=settings.response_compression_brotli_quality,
+    )
+
+    app.include_router(health_router)
+    app.include_router(app_api_router)
 
-app.include_router(health_router)
-app.include_router(app_api_router)
+    return app
@@ -0,0 +1,219 @@
+"""
+Replays a JSONL traffic trace, recorded with TRAFFIC_RECORD_PATH, through the
+app with the recorded LLM and forex responses served from the trace, and
+compares the latency and throughput of two replays, e.g. of two builds.
+
+    python -m agents_play.replay run trace.jsonl --output baseline.json
+    python -m agents_play.replay run trace.jsonl --speed full --concurrency 8
+    python -m agents_play.replay compare baseline.json candidate.json
+
+Replayed requests write to the configured database, point DATABASE_URL at a
+scratch one.
+"""
+
+import argparse
+import asyncio
+import math
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import httpx
+from common.recording import (
+    RecordedRequest,
+    ReplayCassette,
+    ReplaySpeed,
+    current_cassette,
+    read_trace,
+)
+from pydantic import BaseModel
+
+REPLAY_BASE_URL = "http://replay"
+
+COMPARED_METRICS = [
+    "throughput_rps",
+    "latency_mean_seconds",
+    "latency_p50_seconds",
+    "latency_p95_seconds",
+    "latency_p99_seconds",
+    "errors",
+]
+
+
+class ReplayedRequest(BaseModel):
+    id: uuid.UUID
+    path: str
+    status_code: int
+    recorded_status_code: int | None
+    latency_seconds: float
+    recorded_latency_seconds: float
+
+
+class ReplayReport(BaseModel):
+    speed: ReplaySpeed
+    concurrency: int
+    requests: int
+    errors: int
+    status_mismatches: int
+    duration_seconds: float
+    throughput_rps: float
+    latency_mean_seconds: float
+    latency_p50_seconds: float
+    latency_p95_seconds: float
+    latency_p99_seconds: float
+    replayed: list[ReplayedRequest]
+
+    @classmethod
+    def from_replayed(
+        cls,
+        replayed: list[ReplayedRequest],
+        speed: ReplaySpeed,
+        concurrency: int,
+        duration_seconds: float,
+    ) -> "ReplayReport":
+        latencies = sorted(request.latency_seconds for request in replayed)
+
+        return cls(
+            speed=speed,
+            concurrency=concurrency,
+            requests=len(replayed),
+            errors=sum(request.status_code >= 500 for request in replayed),
+            status_mismatches=sum(
+                request.status_code != request.recorded_status_code
+                for request in replayed
+            ),
+            duration_seconds=duration_seconds,
+            throughput_rps=len(replayed) / duration_seconds if duration_seconds else 0,
+            latency_mean_seconds=sum(latencies) / len(latencies) if latencies else 0,
+            latency_p50_seconds=_percentile(latencies, 50),
+            latency_p95_seconds=_percentile(latencies, 95),
+            latency_p99_seconds=_percentile(latencies, 99),
+            replayed=replayed,
+        )
+
+
+async def replay(
+    recordings: list[RecordedRequest], speed: ReplaySpeed, concurrency: int
+) -> ReplayReport:
+    from agents_play.main import create_app
+
+    app = create_app()
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def replay_request(
+        client: httpx.AsyncClient, recording: RecordedRequest
+    ) -> ReplayedRequest:
+        async with semaphore:
+            # The app runs in this task, so its agents and forex client see it
+            token = current_cassette.set(ReplayCassette(recording, speed=speed))
+            start = time.perf_counter()
+            try:
+                response = await client.request(
+                    recording.method,
+                    recording.path,
+                    params=httpx.QueryParams(recording.query_string),
+                    headers=recording.headers,
+                    content=(
+                        recording.body if isinstance(recording.body, str) else None
+                    ),
+                    json=(
+                        recording.body if not isinstance(recording.body, str) else None
+                    ),
+                )
+            finally:
+                current_cassette.reset(token)
+
+            return ReplayedRequest(
+                id=recording.id,
+                path=recording.path,
+                status_code=response.status_code,
+                recorded_status_code=recording.status_code,
+                latency_seconds=time.perf_counter() - start,
+                recorded_latency_seconds=recording.latency_seconds,
+            )
+
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url=REPLAY_BASE_URL
+        ) as client:
+            start = time.perf_counter()
+            replayed = await asyncio.gather(
+                *(replay_request(client, recording) for recording in recordings)
+            )
+            duration_seconds = time.perf_counter() - start
+
+    return ReplayReport.from_replayed(
+        list(replayed),
+        speed=speed,
+        concurrency=concurrency,
+        duration_seconds=duration_seconds,
+    )
+
+
+def compare(baseline: ReplayReport, candidate: ReplayReport) -> str:
+    lines = [f"{'metric':<24}{'baseline':>14}{'candidate':>14}{'delta':>10}"]
+    for metric in COMPARED_METRICS:
+        baseline_value = float(getattr(baseline, metric))
+        candidate_value = float(getattr(candidate, metric))
+        delta = "n/a"
+        if baseline_value:
+            delta = f"{(candidate_value - baseline_value) / baseline_value:+.1%}"
+        lines.append(
+            f"{metric:<24}{baseline_value:>14.4f}{candidate_value:>14.4f}{delta:>10}"
+        )
+
+    return "\n".join(lines)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Replay a trace")
+    run_parser.add_argument("trace", type=Path)
+    run_parser.add_argument("--speed", choices=["recorded", "full"], default="recorded")
+    run_parser.add_argument("--concurrency", type=int, default=1)
+    run_parser.add_argument("--output", type=Path)
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two replays")
+    compare_parser.add_argument("baseline", type=Path)
+    compare_parser.add_argument("candidate", type=Path)
+
+    arguments = parser.parse_args()
+
+    if arguments.command == "compare":
+        baseline = ReplayReport.model_validate_json(arguments.baseline.read_text())
+        candidate = ReplayReport.model_validate_json(arguments.candidate.read_text())
+        print(compare(baseline, candidate))
+        return 0
+
+    report = asyncio.run(
+        replay(
+            read_trace(arguments.trace),
+            speed=arguments.speed,
+            concurrency=arguments.concurrency,
+        )
+    )
+    print(report.model_dump_json(indent=2, exclude={"replayed"}))
+    if arguments.output is not None:
+        arguments.output.write_text(report.model_dump_json(indent=2))
+
+    return 0
+
+
+def _percentile(sorted_values: list[float], percentile: int) -> float:
+    if not sorted_values:
+        return 0.0
+
+    # Nearest rank
+    rank = math.ceil(percentile / 100 * len(sorted_values))
+
+    return sorted_values[max(rank, 1) - 1]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
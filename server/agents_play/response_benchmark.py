@@ -0,0 +1,128 @@
+"""
+Measures the bytes and CPU time per chat messages response, for the previous
+path (parse the stored messages, validate and dump them again for FastAPI's
+response model, `json.dumps`) and the current one (serve the stored JSON with
+orjson), uncompressed and with every negotiated content encoding.
+
+    python -m agents_play.response_benchmark [--messages 1000] [--runs 50]
+"""
+
+import argparse
+import time
+import uuid
+from collections.abc import Callable
+from datetime import timedelta
+
+from common.compression import (
+    CONTENT_ENCODINGS,
+    BrotliCompressor,
+    Compressor,
+    GzipCompressor,
+)
+from common.conf import settings
+from common.datetime_utils import datetime_now_with_timezone
+from fastapi.responses import JSONResponse, ORJSONResponse
+from llm.models import ChatRoom, get_chat_room_messages_cache
+from llm.schemas import (
+    ChatRoomMessage,
+    ListChatMessagesResponse,
+    chat_room_messages_adapter,
+)
+from pydantic import TypeAdapter
+
+list_chat_messages_response_adapter = TypeAdapter(ListChatMessagesResponse)
+
+
+def sample_room(message_count: int) -> ChatRoom:
+    start = datetime_now_with_timezone() - timedelta(days=1)
+    messages = [
+        ChatRoomMessage(
+            id=uuid.uuid4(),
+            role="user" if index % 2 == 0 else "assistant",
+            content=f"Message {index} about the todos and the exchange rates. " * 8,
+            llm_provider="openai",
+            llm_key="gpt-4o-mini",
+            date=start + timedelta(seconds=index),
+        )
+        for index in range(message_count)
+    ]
+
+    return ChatRoom(
+        owner_id=uuid.uuid4(),
+        title="Benchmark",
+        messages=chat_room_messages_adapter.dump_python(messages, mode="json"),
+        message_count=message_count,
+    )
+
+
+def previous_body(room: ChatRoom) -> bytes:
+    # What FastAPI did with the returned model: dump it, validate it against
+    # the response model, dump it to JSON and render it with `json.dumps`
+    get_chat_room_messages_cache().invalidate()
+    response = ListChatMessagesResponse(
+        detail="OK", data=room.validated_messages(), cursor=None
+    )
+    validated = list_chat_messages_response_adapter.validate_python(
+        response.model_dump()
+    )
+
+    return bytes(JSONResponse(content=validated.model_dump(mode="json")).body)
+
+
+def current_body(room: ChatRoom) -> bytes:
+    return bytes(
+        ORJSONResponse(
+            content={"detail": "OK", "data": room.json_messages(), "cursor": None}
+        ).body
+    )
+
+
+def compressor(encoding: str) -> Compressor:
+    if encoding == "br":
+        return BrotliCompressor(quality=settings.response_compression_brotli_quality)
+
+    return GzipCompressor(level=settings.response_compression_gzip_level)
+
+
+def measure(runs: int, render: Callable[[], bytes]) -> tuple[int, float]:
+    body = render()
+    start = time.process_time()
+    for _ in range(runs):
+        render()
+
+    return len(body), (time.process_time() - start) / runs
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=50)
+    arguments = parser.parse_args()
+
+    room = sample_room(arguments.messages)
+    print(f"{arguments.messages} messages, {arguments.runs} runs each")
+    print(f"{'path':<24}{'bytes':>12}{'cpu ms':>10}")
+
+    for name, render in [("previous", previous_body), ("current", current_body)]:
+        for encoding in [None, *CONTENT_ENCODINGS]:
+
+            def render_encoded(
+                render: Callable[[ChatRoom], bytes] = render,
+                encoding: str | None = encoding,
+            ) -> bytes:
+                body = render(room)
+                if encoding is None:
+                    return body
+                encoder = compressor(encoding)
+
+                return encoder.compress(body) + encoder.finish()
+
+            size, cpu_seconds = measure(arguments.runs, render_encoded)
+            label = f"{name} {encoding or 'identity'}"
+            print(f"{label:<24}{size:>12}{cpu_seconds * 1000:>10.2f}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
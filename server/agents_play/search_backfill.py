@@ -0,0 +1,59 @@
+"""
+Indexes the messages of existing chat rooms for search. New turns are indexed
+as they are written, only rooms from before the search index need this.
+Already indexed messages are skipped, so it can be rerun safely.
+
+    python -m agents_play.search_backfill [--batch-size 200]
+"""
+
+import argparse
+import uuid
+
+from database.database import get_database
+from llm.models import ChatMessageSearch, ChatRoom
+from llm.schemas import chat_room_messages_adapter
+from sqlmodel import Session, col, select, tuple_
+
+
+def backfill(batch_size: int) -> int:
+    rooms_indexed = 0
+    after: tuple[uuid.UUID, uuid.UUID] | None = None
+    with Session(get_database().engine) as session:
+        while True:
+            query = select(ChatRoom).order_by(col(ChatRoom.owner_id), col(ChatRoom.id))
+            if after is not None:
+                query = query.where(
+                    tuple_(col(ChatRoom.owner_id), col(ChatRoom.id)) > after
+                )
+            rooms = session.exec(query.limit(batch_size)).all()
+            if not rooms:
+                return rooms_indexed
+
+            for room in rooms:
+                ChatMessageSearch.index_messages(
+                    owner_id=room.owner_id,
+                    room_id=room.id,
+                    messages=chat_room_messages_adapter.validate_python(room.messages),
+                    session=session,
+                )
+            rooms_indexed += len(rooms)
+            after = (rooms[-1].owner_id, rooms[-1].id)
+
+            session.commit()
+            # Rooms are only read once, don't keep them around
+            session.expunge_all()
+            print(f"{rooms_indexed} rooms indexed")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=200)
+    arguments = parser.parse_args()
+
+    backfill(arguments.batch_size)
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
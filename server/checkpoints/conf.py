@@ -0,0 +1,16 @@
+from typing import TYPE_CHECKING
+
+from common.conf import BaseSettings, lazy_settings
+
+if TYPE_CHECKING:
+    from agents_play.conf import Settings
+
+
+class CheckpointSettings(BaseSettings):
+    checkpointing_enabled: bool = False
+    checkpoint_ttl_seconds: float = 24 * 60 * 60
+    checkpoint_gc_interval_seconds: float = 5 * 60
+    checkpoint_zstd_level: int = 3
+
+
+settings: "Settings" = lazy_settings()
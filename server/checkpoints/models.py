@@ -0,0 +1,82 @@
+from datetime import datetime
+
+from common.datetime_utils import datetime_now_with_timezone
+from sqlalchemy import Index, LargeBinary
+from sqlmodel import Column, DateTime, Field, SQLModel, col
+
+
+class GraphCheckpoint(SQLModel, table=True):
+    """
+    The latest checkpoint of one graph run, a thread in LangGraph's terms,
+    per namespace. Earlier checkpoints are overwritten, runs only ever
+    resume from their latest.
+    """
+
+    __tablename__: str = "graph_checkpoint"  # type: ignore
+
+    thread_id: str = Field(primary_key=True)
+    checkpoint_ns: str = Field(default="", primary_key=True)
+    checkpoint_id: str
+    parent_checkpoint_id: str | None = None
+    checkpoint_type: str
+    # zstd compressed, as serialized by the checkpointer's serde
+    checkpoint: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    checkpoint_metadata_type: str
+    checkpoint_metadata: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    created_at: datetime = Field(
+        sa_column=Column(DateTime(timezone=True), nullable=False),
+        default_factory=datetime_now_with_timezone,
+    )
+
+
+class GraphCheckpointWrite(SQLModel, table=True):
+    """A write of a task run on top of a checkpoint, kept until the next one."""
+
+    __tablename__: str = "graph_checkpoint_write"  # type: ignore
+
+    thread_id: str = Field(primary_key=True)
+    checkpoint_ns: str = Field(default="", primary_key=True)
+    checkpoint_id: str = Field(primary_key=True)
+    task_id: str = Field(primary_key=True)
+    idx: int = Field(primary_key=True)
+    task_path: str = ""
+    channel: str
+    value_type: str
+    # zstd compressed, as serialized by the checkpointer's serde
+    value: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    created_at: datetime = Field(
+        sa_column=Column(DateTime(timezone=True), nullable=False),
+        default_factory=datetime_now_with_timezone,
+    )
+
+
+class GraphRunResponse(SQLModel, table=True):
+    """
+    The response a finished run was answered with, kept in place of its
+    checkpoints so a retry whose answer got lost gets it again instead of
+    running the graph twice.
+    """
+
+    __tablename__: str = "graph_run_response"  # type: ignore
+
+    thread_id: str = Field(primary_key=True)
+    # JSON, as it was sent
+    response: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    created_at: datetime = Field(
+        sa_column=Column(DateTime(timezone=True), nullable=False),
+        default_factory=datetime_now_with_timezone,
+    )
+
+
+Index(
+    "ix_graph_checkpoint_created_at",
+    col(GraphCheckpoint.created_at),
+)
+Index(
+    "ix_graph_checkpoint_write_created_at",
+    col(GraphCheckpointWrite.created_at),
+)
+Index(
+    "ix_graph_run_response_created_at",
+    col(GraphRunResponse.created_at),
+)
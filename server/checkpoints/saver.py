@@ -0,0 +1,462 @@
+import asyncio
+import logging
+from collections.abc import AsyncIterator, Iterator, Sequence
+from datetime import timedelta
+from functools import cache
+from typing import Any, cast
+
+import zstandard
+from common.datetime_utils import datetime_now_with_timezone
+from database.database import Databaseable, get_database
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.graph.state import CompiledStateGraph
+from sqlalchemy import CursorResult, delete
+from sqlmodel import Session, col, select
+
+from checkpoints.conf import settings
+from checkpoints.models import GraphCheckpoint, GraphCheckpointWrite, GraphRunResponse
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseCheckpointSaver(BaseCheckpointSaver[int]):
+    """
+    Checkpoints graph runs to the database, Postgres or SQLite alike, so a
+    retried request resumes its run from the last completed node instead of
+    starting over. Only the latest checkpoint of a run and the writes made on
+    top of it are kept, zstd compressed, and runs older than `ttl_seconds`
+    are garbage collected.
+
+    LangGraph puts checkpoints in the background while the next node runs,
+    the async methods only move the database round trip off the event loop.
+    """
+
+    def __init__(
+        self,
+        database: Databaseable,
+        ttl_seconds: float,
+        gc_interval_seconds: float,
+        zstd_level: int,
+    ) -> None:
+        super().__init__()
+        self.database = database
+        self.ttl_seconds = ttl_seconds
+        self.gc_interval_seconds = gc_interval_seconds
+        self.zstd_level = zstd_level
+
+        self.__collector: asyncio.Task[None] | None = None
+
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        thread_id, checkpoint_ns = _thread(config)
+        checkpoint_id = get_checkpoint_id(config)
+        with Session(self.database.engine) as session:
+            row = session.get(
+                GraphCheckpoint,
+                {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns},
+            )
+            if row is None:
+                return None
+            if checkpoint_id is not None and row.checkpoint_id != checkpoint_id:
+                return None
+
+            writes = session.exec(
+                select(GraphCheckpointWrite)
+                .where(
+                    col(GraphCheckpointWrite.thread_id) == thread_id,
+                    col(GraphCheckpointWrite.checkpoint_ns) == checkpoint_ns,
+                    col(GraphCheckpointWrite.checkpoint_id) == row.checkpoint_id,
+                )
+                .order_by(
+                    col(GraphCheckpointWrite.task_id), col(GraphCheckpointWrite.idx)
+                )
+            ).all()
+
+            return CheckpointTuple(
+                config=_checkpoint_config(thread_id, checkpoint_ns, row.checkpoint_id),
+                checkpoint=self.__loads(row.checkpoint_type, row.checkpoint),
+                metadata=self.serde.loads_typed(
+                    (row.checkpoint_metadata_type, row.checkpoint_metadata)
+                ),
+                parent_config=(
+                    _checkpoint_config(
+                        thread_id, checkpoint_ns, row.parent_checkpoint_id
+                    )
+                    if row.parent_checkpoint_id is not None
+                    else None
+                ),
+                pending_writes=[
+                    (
+                        write.task_id,
+                        write.channel,
+                        self.__loads(write.value_type, write.value),
+                    )
+                    for write in writes
+                ],
+            )
+
+    def list(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> Iterator[CheckpointTuple]:
+        # There is no history to list, only the latest checkpoint is kept
+        if config is None or limit == 0:
+            return
+
+        checkpoint_tuple = self.get_tuple(config)
+        if checkpoint_tuple is None:
+            return
+        before_id = get_checkpoint_id(before) if before is not None else None
+        if before_id is not None and checkpoint_tuple.checkpoint["id"] >= before_id:
+            return
+        if filter and any(
+            checkpoint_tuple.metadata.get(key) != value for key, value in filter.items()
+        ):
+            return
+
+        yield checkpoint_tuple
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id, checkpoint_ns = _thread(config)
+        checkpoint_type, checkpoint_bytes = self.__dumps(checkpoint)
+        metadata_type, metadata_bytes = self.serde.dumps_typed(
+            get_checkpoint_metadata(config, metadata)
+        )
+        with Session(self.database.engine) as session:
+            session.merge(
+                GraphCheckpoint(
+                    thread_id=thread_id,
+                    checkpoint_ns=checkpoint_ns,
+                    checkpoint_id=checkpoint["id"],
+                    parent_checkpoint_id=get_checkpoint_id(config),
+                    checkpoint_type=checkpoint_type,
+                    checkpoint=checkpoint_bytes,
+                    checkpoint_metadata_type=metadata_type,
+                    checkpoint_metadata=metadata_bytes,
+                    created_at=datetime_now_with_timezone(),
+                )
+            )
+            # Writes on top of the previous checkpoint are part of this one now
+            session.execute(
+                delete(GraphCheckpointWrite).where(
+                    col(GraphCheckpointWrite.thread_id) == thread_id,
+                    col(GraphCheckpointWrite.checkpoint_ns) == checkpoint_ns,
+                    col(GraphCheckpointWrite.checkpoint_id) != checkpoint["id"],
+                )
+            )
+            session.commit()
+
+        return _checkpoint_config(thread_id, checkpoint_ns, checkpoint["id"])
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id, checkpoint_ns = _thread(config)
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        with Session(self.database.engine) as session:
+            written_idxs = set(
+                session.exec(
+                    select(col(GraphCheckpointWrite.idx)).where(
+                        col(GraphCheckpointWrite.thread_id) == thread_id,
+                        col(GraphCheckpointWrite.checkpoint_ns) == checkpoint_ns,
+                        col(GraphCheckpointWrite.checkpoint_id) == checkpoint_id,
+                        col(GraphCheckpointWrite.task_id) == task_id,
+                    )
+                ).all()
+            )
+            for position, (channel, value) in enumerate(writes):
+                idx = WRITES_IDX_MAP.get(channel, position)
+                # Regular writes are saved once, special ones (errors,
+                # interrupts) replace the previous
+                if idx >= 0 and idx in written_idxs:
+                    continue
+
+                value_type, value_bytes = self.__dumps(value)
+                session.merge(
+                    GraphCheckpointWrite(
+                        thread_id=thread_id,
+                        checkpoint_ns=checkpoint_ns,
+                        checkpoint_id=checkpoint_id,
+                        task_id=task_id,
+                        idx=idx,
+                        task_path=task_path,
+                        channel=channel,
+                        value_type=value_type,
+                        value=value_bytes,
+                    )
+                )
+            session.commit()
+
+    def delete_thread(self, thread_id: str) -> None:
+        with Session(self.database.engine) as session:
+            _delete_thread_checkpoints(session=session, thread_id=thread_id)
+            session.commit()
+
+    def finish_thread(self, thread_id: str, response: bytes) -> None:
+        """Replace the checkpoints of a finished run with its response."""
+        with Session(self.database.engine) as session:
+            _delete_thread_checkpoints(session=session, thread_id=thread_id)
+            session.merge(GraphRunResponse(thread_id=thread_id, response=response))
+            session.commit()
+
+    def get_response(self, thread_id: str) -> bytes | None:
+        expired_before = datetime_now_with_timezone() - timedelta(
+            seconds=self.ttl_seconds
+        )
+        with Session(self.database.engine) as session:
+            # Until collected, an expired response is as good as gone
+            return session.exec(
+                select(GraphRunResponse.response).where(
+                    col(GraphRunResponse.thread_id) == thread_id,
+                    col(GraphRunResponse.created_at) >= expired_before,
+                )
+            ).first()
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        checkpoint_tuples = await asyncio.to_thread(
+            lambda: [*self.list(config, filter=filter, before=before, limit=limit)]
+        )
+        for checkpoint_tuple in checkpoint_tuples:
+            yield checkpoint_tuple
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(
+            self.put, config, checkpoint, metadata, new_versions
+        )
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    async def afinish_thread(self, thread_id: str, response: bytes) -> None:
+        await asyncio.to_thread(self.finish_thread, thread_id, response)
+
+    async def aget_response(self, thread_id: str) -> bytes | None:
+        return await asyncio.to_thread(self.get_response, thread_id)
+
+    def delete_expired(self) -> int:
+        expired_before = datetime_now_with_timezone() - timedelta(
+            seconds=self.ttl_seconds
+        )
+        with Session(self.database.engine) as session:
+            result = cast(
+                CursorResult[Any],
+                session.execute(
+                    delete(GraphCheckpoint).where(
+                        col(GraphCheckpoint.created_at) < expired_before
+                    )
+                ),
+            )
+            session.execute(
+                delete(GraphCheckpointWrite).where(
+                    col(GraphCheckpointWrite.created_at) < expired_before
+                )
+            )
+            session.execute(
+                delete(GraphRunResponse).where(
+                    col(GraphRunResponse.created_at) < expired_before
+                )
+            )
+            session.commit()
+
+        return result.rowcount
+
+    async def start(self) -> None:
+        assert self.__collector is None
+
+        self.__collector = asyncio.create_task(self.__run_collector())
+
+    async def stop(self) -> None:
+        if self.__collector is None:
+            return
+
+        self.__collector.cancel()
+        try:
+            await self.__collector
+        except asyncio.CancelledError:
+            pass
+        self.__collector = None
+
+    async def __run_collector(self) -> None:
+        while True:
+            try:
+                deleted = await asyncio.to_thread(self.delete_expired)
+            except Exception:
+                logger.exception("Failed to delete expired graph checkpoints")
+            else:
+                if deleted > 0:
+                    logger.info("Deleted %d expired graph checkpoints", deleted)
+
+            await asyncio.sleep(self.gc_interval_seconds)
+
+    def __dumps(self, value: Any) -> tuple[str, bytes]:
+        value_type, value_bytes = self.serde.dumps_typed(value)
+
+        return value_type, zstandard.ZstdCompressor(level=self.zstd_level).compress(
+            value_bytes
+        )
+
+    def __loads(self, value_type: str, value_bytes: bytes) -> Any:
+        return self.serde.loads_typed(
+            (value_type, zstandard.ZstdDecompressor().decompress(value_bytes))
+        )
+
+
+def _delete_thread_checkpoints(session: Session, thread_id: str) -> None:
+    session.execute(
+        delete(GraphCheckpoint).where(col(GraphCheckpoint.thread_id) == thread_id)
+    )
+    session.execute(
+        delete(GraphCheckpointWrite).where(
+            col(GraphCheckpointWrite.thread_id) == thread_id
+        )
+    )
+
+
+def _thread(config: RunnableConfig) -> tuple[str, str]:
+    configurable = config["configurable"]
+
+    return configurable["thread_id"], configurable.get("checkpoint_ns", "")
+
+
+def _checkpoint_config(
+    thread_id: str, checkpoint_ns: str, checkpoint_id: str
+) -> RunnableConfig:
+    return {
+        "configurable": {
+            "thread_id": thread_id,
+            "checkpoint_ns": checkpoint_ns,
+            "checkpoint_id": checkpoint_id,
+        }
+    }
+
+
+__graph_checkpointer: DatabaseCheckpointSaver | None = None
+
+
+def get_graph_checkpointer() -> DatabaseCheckpointSaver | None:
+    global __graph_checkpointer
+
+    if not settings.checkpointing_enabled:
+        return None
+
+    if __graph_checkpointer is None:
+        __graph_checkpointer = DatabaseCheckpointSaver(
+            database=get_database(),
+            ttl_seconds=settings.checkpoint_ttl_seconds,
+            gc_interval_seconds=settings.checkpoint_gc_interval_seconds,
+            zstd_level=settings.checkpoint_zstd_level,
+        )
+
+    return __graph_checkpointer
+
+
+@cache
+def _checkpointed_graph(
+    graph: CompiledStateGraph[Any], checkpointer: DatabaseCheckpointSaver
+) -> CompiledStateGraph[Any]:
+    return graph.copy(update={"checkpointer": checkpointer})
+
+
+async def ainvoke_checkpointed(
+    graph: CompiledStateGraph[Any],
+    input: Any,
+    config: dict[str, Any],
+    thread_id: str | None,
+) -> dict[str, Any]:
+    """
+    Run the graph, checkpointed as `thread_id` when checkpointing is on. A
+    run of the thread that failed before is resumed from its last completed
+    node, one that finished returns its end state without running again.
+    """
+    checkpointer = get_graph_checkpointer()
+    if checkpointer is None or thread_id is None:
+        return cast(dict[str, Any], await graph.ainvoke(input, config))  # type: ignore[arg-type]
+
+    checkpointed_graph = _checkpointed_graph(graph, checkpointer)
+    config = {
+        **config,
+        "configurable": {**config.get("configurable", {}), "thread_id": thread_id},
+    }
+    snapshot = await checkpointed_graph.aget_state(config)  # type: ignore[arg-type]
+    if snapshot.created_at is None:
+        return cast(
+            dict[str, Any],
+            await checkpointed_graph.ainvoke(input, config),  # type: ignore[arg-type]
+        )
+    if not snapshot.next:
+        return cast(dict[str, Any], snapshot.values)
+
+    # No input resumes the run from its latest checkpoint
+    return cast(
+        dict[str, Any],
+        await checkpointed_graph.ainvoke(None, config),  # type: ignore[arg-type]
+    )
+
+
+async def checkpointed_response(thread_id: str) -> bytes | None:
+    """The response a finished run of the thread was answered with, if kept."""
+    checkpointer = get_graph_checkpointer()
+    if checkpointer is None:
+        return None
+
+    return await checkpointer.aget_response(thread_id)
+
+
+async def release_checkpointed(thread_id: str, response: bytes) -> None:
+    """
+    Drop the checkpoints of a run once its result is safely stored, keeping
+    the response retries of the run are answered with until it expires.
+    """
+    checkpointer = get_graph_checkpointer()
+    if checkpointer is None:
+        return
+
+    await checkpointer.afinish_thread(thread_id, response)
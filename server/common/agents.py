@@ -0,0 +1,297 @@
+import asyncio
+import time
+from collections.abc import Sequence
+from typing import Any
+
+from common.conf import LLMCallType, LLMModelSettings, settings
+from common.deadlines import DeadlineExceededError, get_deadline
+from common.events import current_agent_name
+from common.llm_clients import get_llm_client_factory
+from common.recording import current_cassette, record_llm_call
+from common.usage import LLMUsageCallbackHandler, count_tokens, record_llm_usage
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import RunnableConfig, ensure_config
+from langchain_core.runnables.config import merge_configs
+from langchain_core.tools import BaseTool
+from langgraph.graph.state import CompiledStateGraph
+from pydantic import BaseModel
+
+AGENT_NAME_RESPONSE_KEY = "agent_name"
+LATENCY_EWMA_ALPHA = 0.2
+ERROR_RATE_WEIGHT = 4.0
+# Latency score of a model without enough calls to measure it, as if it ran
+# right at its SLO, so an untried backup never outranks a proven primary
+UNMEASURED_LATENCY_SCORE = 1.0
+
+
+class LLMModelStats(BaseModel):
+    name: str
+    call_types: list[LLMCallType]
+    calls: int = 0
+    failures: int = 0
+    timeouts: int = 0
+    latency_ewma_seconds: float | None = None
+    error_rate_ewma: float = 0.0
+    last_failure_at: float | None = None
+    total_tokens: int = 0
+    estimated_cost: float = 0.0
+
+
+class AgentRegistry:
+    """
+    Keeps the configured models with their observed latency, error rate and
+    cost, and ranks them per call type so every agent invocation goes to the
+    healthiest, cheapest model that can serve it.
+    """
+
+    def __init__(self, models: list[LLMModelSettings]) -> None:
+        assert len(models) > 0
+
+        self.models = {model.name: model for model in models}
+        self.stats = {
+            model.name: LLMModelStats(name=model.name, call_types=model.call_types)
+            for model in models
+        }
+
+    def has_model(self, name: str) -> bool:
+        return name in self.models
+
+    def default_model(self, call_type: LLMCallType) -> LLMModelSettings:
+        return self.candidates(call_type)[0]
+
+    def candidates(self, call_type: LLMCallType) -> list[LLMModelSettings]:
+        models = [
+            model for model in self.models.values() if call_type in model.call_types
+        ]
+        assert len(models) > 0, f"No model configured for {call_type} calls"
+
+        # sorted is stable, so configuration order breaks ties
+        return sorted(models, key=self.__score)
+
+    def agent(
+        self,
+        name: str,
+        call_type: LLMCallType,
+        tools: Sequence[BaseTool],
+        prompt: str | None = None,
+    ) -> "RoutedAgent":
+        return RoutedAgent(
+            name=name, call_type=call_type, tools=tools, prompt=prompt, registry=self
+        )
+
+    def record_success(
+        self, name: str, latency_seconds: float, output_messages: list[BaseMessage]
+    ) -> None:
+        stats = self.stats[name]
+        stats.calls += 1
+        stats.latency_ewma_seconds = _ewma(stats.latency_ewma_seconds, latency_seconds)
+        stats.error_rate_ewma = _ewma(stats.error_rate_ewma, 0.0)
+
+        # Counted as usage metering does, every model call of the invocation
+        tokens = count_tokens(output_messages).total_tokens
+        stats.total_tokens += tokens
+        stats.estimated_cost += (
+            tokens * self.models[name].cost_per_million_tokens / 1_000_000
+        )
+
+    def record_failure(
+        self, name: str, latency_seconds: float, timed_out: bool
+    ) -> None:
+        stats = self.stats[name]
+        stats.calls += 1
+        stats.failures += 1
+        if timed_out:
+            stats.timeouts += 1
+        stats.latency_ewma_seconds = _ewma(stats.latency_ewma_seconds, latency_seconds)
+        stats.error_rate_ewma = _ewma(stats.error_rate_ewma, 1.0)
+        stats.last_failure_at = time.monotonic()
+
+    def stats_snapshot(self) -> list[LLMModelStats]:
+        return [stats.model_copy() for stats in self.stats.values()]
+
+    def __score(self, model: LLMModelSettings) -> float:
+        stats = self.stats[model.name]
+
+        latency_score = UNMEASURED_LATENCY_SCORE
+        if (
+            stats.latency_ewma_seconds is not None
+            and stats.calls >= settings.llm_routing_min_samples
+        ):
+            latency_score = stats.latency_ewma_seconds / model.latency_slo_seconds
+
+        error_score = 0.0
+        if (
+            stats.last_failure_at is not None
+            and time.monotonic() - stats.last_failure_at
+            < settings.llm_model_failure_cooldown_seconds
+        ):
+            error_score = ERROR_RATE_WEIGHT * stats.error_rate_ewma
+
+        max_cost = max(
+            candidate.cost_per_million_tokens for candidate in self.models.values()
+        )
+        cost_score = 0.0
+        if max_cost > 0:
+            cost_score = (
+                settings.llm_routing_cost_weight
+                * model.cost_per_million_tokens
+                / max_cost
+            )
+
+        return latency_score + error_score + cost_score
+
+
+class RoutedAgent:
+    """
+    A react agent definition that is compiled per model on first use and
+    invoked on the best ranked model, failing over to the next candidate when
+    a model errors or breaches its latency SLO.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        call_type: LLMCallType,
+        tools: Sequence[BaseTool],
+        prompt: str | None,
+        registry: AgentRegistry | None = None,
+    ) -> None:
+        self.__registry = registry
+        self.name = name
+        self.call_type = call_type
+        self.tools = tools
+        self.prompt = prompt
+        self.__agents: dict[str, tuple[BaseChatModel, CompiledStateGraph[Any]]] = {}
+
+    @property
+    def registry(self) -> AgentRegistry:
+        # Agents defined at import use the configured registry, built on first use
+        if self.__registry is None:
+            return get_agent_registry()
+
+        return self.__registry
+
+    async def ainvoke(
+        self, input: dict[str, Any], config: RunnableConfig | None = None
+    ) -> dict[str, Any]:
+        cassette = current_cassette.get()
+        if cassette is not None:
+            model_name, messages = await cassette.llm_call(self.name)
+
+            return {"messages": messages, AGENT_NAME_RESPONSE_KEY: model_name}
+
+        deadline = get_deadline(config)
+        candidates = self.registry.candidates(self.call_type)
+        for index, model in enumerate(candidates):
+            is_last_candidate = index == len(candidates) - 1
+            timeout = None if is_last_candidate else model.latency_slo_seconds
+            if deadline is not None:
+                deadline.check()
+                if timeout is None or timeout > deadline.remaining_seconds:
+                    timeout = deadline.remaining_seconds
+
+            start = time.perf_counter()
+            agent_name_token = current_agent_name.set(self.name)
+            usage_callback_handler = LLMUsageCallbackHandler()
+            failed = True
+            try:
+                async with asyncio.timeout(timeout):
+                    response = await self.__agent(model.name).ainvoke(
+                        input,
+                        merge_configs(
+                            ensure_config(config),
+                            {"callbacks": [usage_callback_handler]},
+                        ),
+                    )
+                failed = False
+            except Exception as e:
+                if deadline is not None and deadline.is_expired:
+                    # Out of request budget, not the model's fault
+                    raise DeadlineExceededError from e
+
+                self.registry.record_failure(
+                    model.name,
+                    latency_seconds=time.perf_counter() - start,
+                    timed_out=isinstance(e, TimeoutError),
+                )
+                if is_last_candidate:
+                    raise
+                continue
+            finally:
+                current_agent_name.reset(agent_name_token)
+                latency_seconds = time.perf_counter() - start
+                # Failed and cancelled attempts are metered too, the model
+                # calls they completed were paid for
+                record_llm_usage(
+                    agent=self.name,
+                    model=model.name,
+                    latency_seconds=latency_seconds,
+                    output_messages=usage_callback_handler.messages,
+                    cost_per_million_tokens=model.cost_per_million_tokens,
+                    config=config,
+                    failed=failed,
+                )
+
+            # The agent's state starts with the messages it was given
+            output_messages = response["messages"][len(input["messages"]) :]
+            self.registry.record_success(
+                model.name,
+                latency_seconds=latency_seconds,
+                output_messages=output_messages,
+            )
+            record_llm_call(
+                agent=self.name,
+                model=model.name,
+                latency_seconds=latency_seconds,
+                input_messages=input["messages"],
+                output_messages=response["messages"],
+            )
+
+            return {**response, AGENT_NAME_RESPONSE_KEY: model.name}
+
+        raise AssertionError("unreachable")
+
+    def __agent(self, name: str) -> CompiledStateGraph[Any]:
+        chat_model = get_llm_client_factory().chat_model(name)
+        cached = self.__agents.get(name)
+        # The factory rebuilds its models after closing, agents follow
+        if cached is not None and cached[0] is chat_model:
+            return cached[1]
+
+        # Deferred, importing the prebuilt agents dominates startup time
+        from langgraph.prebuilt import create_react_agent
+
+        agent = create_react_agent(chat_model, tools=self.tools, prompt=self.prompt)
+        self.__agents[name] = (chat_model, agent)
+
+        return agent
+
+
+def _ewma(current: float | None, value: float) -> float:
+    if current is None:
+        return value
+
+    return LATENCY_EWMA_ALPHA * value + (1 - LATENCY_EWMA_ALPHA) * current
+
+
+def routed_agent(
+    name: str,
+    call_type: LLMCallType,
+    tools: Sequence[BaseTool],
+    prompt: str | None = None,
+) -> RoutedAgent:
+    """An agent of the configured registry, safe to define at import."""
+    return RoutedAgent(name=name, call_type=call_type, tools=tools, prompt=prompt)
+
+
+__agent_registry: AgentRegistry | None = None
+
+
+def get_agent_registry() -> AgentRegistry:
+    global __agent_registry
+
+    if __agent_registry is None:
+        __agent_registry = AgentRegistry(models=settings.llm_models)
+
+    return __agent_registry
@@ -0,0 +1,45 @@
+import threading
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class VersionedCache(Generic[T]):
+    """
+    In-process LRU cache where every entry remembers the data version it was
+    read at. Entries are only served while that version is still the current
+    one, so bumping the version invalidates them.
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.__entries: OrderedDict[Hashable, tuple[Hashable, T]] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key: Hashable, version: Hashable) -> T | None:
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return None
+
+            entry_version, value = entry
+            if entry_version != version:
+                del self.__entries[key]
+                return None
+
+            self.__entries.move_to_end(key)
+
+            return value
+
+    def set(self, key: Hashable, version: Hashable, value: T) -> None:
+        with self.__lock:
+            self.__entries[key] = (version, value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+
+    def invalidate(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
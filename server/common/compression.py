@@ -0,0 +1,189 @@
+import zlib
+from typing import Literal, Protocol
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+ContentEncoding = Literal["br", "gzip"]
+
+# In order of preference when the client accepts several
+CONTENT_ENCODINGS: tuple[ContentEncoding, ...] = ("br", "gzip")
+
+COMPRESSIBLE_CONTENT_TYPES = ("application/json", "text/")
+
+GZIP_WBITS = zlib.MAX_WBITS | 16
+
+
+class Compressor(Protocol):
+    def compress(self, data: bytes) -> bytes: ...
+
+    def flush(self) -> bytes: ...
+
+    def finish(self) -> bytes: ...
+
+
+class GzipCompressor(Compressor):
+    def __init__(self, level: int) -> None:
+        self.__compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.__compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.__compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self.__compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor(Compressor):
+    def __init__(self, quality: int) -> None:
+        self.__compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return bytes(self.__compressor.process(data))
+
+    def flush(self) -> bytes:
+        return bytes(self.__compressor.flush())
+
+    def finish(self) -> bytes:
+        return bytes(self.__compressor.finish())
+
+
+class CompressionMiddleware:
+    """
+    Compresses JSON and text responses under `path_prefixes` with brotli or
+    gzip, whichever the client prefers of those it accepts, once they are at
+    least `min_bytes` long. Small responses are sent as they are, compressing
+    them costs more CPU than the bytes saved are worth.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        path_prefixes: list[str],
+        min_bytes: int,
+        gzip_level: int,
+        brotli_quality: int,
+    ) -> None:
+        self.app = app
+        self.path_prefixes = tuple(path_prefixes)
+        self.min_bytes = min_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Message | None = None
+        compressor: Compressor | None = None
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start_message, compressor
+
+            if message["type"] == "http.response.start":
+                # Held back until the first body part tells the size
+                start_message = message
+                return
+
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            body: bytes = message.get("body", b"")
+            more_body: bool = message.get("more_body", False)
+
+            if compressor is None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                if not self.__should_compress(headers, body, more_body):
+                    await send(start_message)
+                    start_message = None
+                    await send(message)
+                    return
+
+                compressor = self.__compressor(encoding)
+                headers["content-encoding"] = encoding
+                if "accept-encoding" not in headers.get("vary", "").lower():
+                    headers.add_vary_header("accept-encoding")
+                etag = headers.get("etag")
+                if etag is not None and not etag.startswith("W/"):
+                    # The compressed bytes differ from what a strong ETag
+                    # promises, weak comparison still matches If-None-Match
+                    headers["etag"] = f"W/{etag}"
+                del headers["content-length"]
+                if not more_body:
+                    compressed = compressor.compress(body) + compressor.finish()
+                    headers["content-length"] = str(len(compressed))
+                    await send(start_message)
+                    await send({**message, "body": compressed})
+                    return
+
+                await send(start_message)
+
+            if more_body:
+                chunk = compressor.compress(body) + compressor.flush()
+            else:
+                chunk = compressor.compress(body) + compressor.finish()
+            await send({**message, "body": chunk})
+
+        await self.app(scope, receive, send_compressed)
+
+    def __should_compress(
+        self, headers: MutableHeaders, body: bytes, more_body: bool
+    ) -> bool:
+        if "content-encoding" in headers:
+            return False
+        if not headers.get("content-type", "").startswith(COMPRESSIBLE_CONTENT_TYPES):
+            return False
+
+        size = len(body)
+        if more_body:
+            # Streamed, only the announced length says how much is coming
+            size = int(headers.get("content-length", self.min_bytes))
+
+        return size >= self.min_bytes
+
+    def __compressor(self, encoding: ContentEncoding) -> Compressor:
+        if encoding == "br":
+            return BrotliCompressor(quality=self.brotli_quality)
+
+        return GzipCompressor(level=self.gzip_level)
+
+
+def negotiate_encoding(accept_encoding: str) -> ContentEncoding | None:
+    accepted: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, parameters = part.strip().partition(";")
+        quality = 1.0
+        parameter_name, _, value = parameters.strip().partition("=")
+        if parameter_name.strip() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                continue
+        accepted[name.strip().lower()] = quality
+
+    candidates = [
+        encoding
+        for encoding in CONTENT_ENCODINGS
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0
+    ]
+    if not candidates:
+        return None
+
+    # Highest quality first, ties broken by our preference
+    return max(
+        candidates,
+        key=lambda encoding: (
+            accepted.get(encoding, accepted.get("*", 0.0)),
+            -CONTENT_ENCODINGS.index(encoding),
+        ),
+    )
@@ -1,14 +1,35 @@
+import uuid
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Literal, cast
+
 import pytz
+from pydantic import BaseModel, SecretStr
 from pydantic_extra_types.timezone_name import TimeZoneName
 from pydantic_settings import BaseSettings as PydanticBaseSettings
 from pydantic_settings import SettingsConfigDict
 
+if TYPE_CHECKING:
+    from agents_play.conf import Settings
+
+LLMCallType = Literal["classification", "extraction", "generation"]
+
+
+class LLMModelSettings(BaseModel):
+    name: str
+    call_types: list[LLMCallType] = ["classification", "extraction", "generation"]
+    latency_slo_seconds: float = 30.0
+    cost_per_million_tokens: float = 0.0
+
 
 class BaseSettings(PydanticBaseSettings):
     model_config = SettingsConfigDict(extra="ignore")
 
     openai_api_key: str
     timezone: TimeZoneName = TimeZoneName("UTC")
+    default_owner_id: uuid.UUID = uuid.UUID(int=0)
+    # Only behind a proxy that authenticates users and sets the owner header,
+    # clients could claim any owner otherwise
+    owner_id_header_trusted: bool = False
 
     @property
     def tzinfo(self) -> pytz.BaseTzInfo:
@@ -17,4 +38,105 @@ class BaseSettings(PydanticBaseSettings):
         return timezone
 
 
-settings = BaseSettings()  # type: ignore
+class LLMRoutingSettings(BaseSettings):
+    llm_models: list[LLMModelSettings] = [
+        LLMModelSettings(name="openai:gpt-4o-mini", cost_per_million_tokens=0.6)
+    ]
+    llm_routing_cost_weight: float = 0.5
+    # Calls a model needs before its measured latency counts in its ranking
+    llm_routing_min_samples: int = 5
+    llm_model_failure_cooldown_seconds: float = 30.0
+
+
+class LLMHttpSettings(BaseSettings):
+    # One HTTP connection pool is shared by every agent's model calls
+    llm_http_max_connections: int = 100
+    llm_http_max_keepalive_connections: int = 20
+    llm_http_keepalive_expiry_seconds: float = 30.0
+    llm_http_connect_timeout_seconds: float = 5.0
+    llm_http_read_timeout_seconds: float = 60.0
+    llm_http_write_timeout_seconds: float = 10.0
+    llm_http_pool_timeout_seconds: float = 10.0
+    llm_http_max_retries: int = 2
+    llm_http_connect_retries: int = 1
+
+
+class ProfilingSettings(BaseSettings):
+    profiling_admin_token: SecretStr | None = None
+    profiling_sample_rate: float = 0.0
+    profiling_interval_seconds: float = 0.005
+    profiling_max_samples: int = 20_000
+    profiling_max_concurrent: int = 2
+    profiling_directory: Path = Path(".profiles")
+    profiling_max_stored: int = 200
+
+    @property
+    def profiling_enabled(self) -> bool:
+        return self.profiling_admin_token is not None or self.profiling_sample_rate > 0
+
+
+class LoopMonitorSettings(BaseSettings):
+    loop_monitor_enabled: bool = True
+    loop_monitor_interval_seconds: float = 0.1
+    loop_monitor_max_samples: int = 1024
+    # Debug only, a watchdog thread records the stacks the loop is stuck in
+    loop_monitor_debug: bool = False
+    loop_monitor_blocking_threshold_seconds: float = 0.1
+    loop_monitor_max_blocking_calls: int = 50
+
+
+class CompressionSettings(BaseSettings):
+    response_compression_min_bytes: int = 1024
+    response_compression_gzip_level: int = 6
+    # Brotli's default of 11 is meant for static assets, far too slow per request
+    response_compression_brotli_quality: int = 4
+
+
+class TrafficRecordSettings(BaseSettings):
+    traffic_record_path: Path | None = None
+    traffic_record_headers: list[str] = [
+        "content-type",
+        "if-none-match",
+        "user-agent",
+        "x-owner-id",
+    ]
+    traffic_record_redact_patterns: list[str] = [
+        # E-mail addresses
+        r"[\w.+-]+@[\w-]+\.[\w.-]+",
+        # API keys and bearer tokens
+        r"\bsk-[\w-]{16,}",
+        r"(?i)bearer\s+[\w.~+/-]+=*",
+        # Card, account and phone numbers
+        r"\b\d[\d -]{10,}\d\b",
+    ]
+
+
+def shared_settings() -> "Settings":
+    """
+    The one settings object of the server, read from the environment on first
+    use. Every package's `conf.settings` resolves to it.
+    """
+    from agents_play.conf import get_settings
+
+    return get_settings()
+
+
+class LazySettings:
+    """
+    Stands in for the settings in every package's `conf`. Importing
+    `settings` binds this proxy without reading the environment, the first
+    attribute read builds the settings.
+    """
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(shared_settings(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(shared_settings(), name, value)
+
+
+def lazy_settings() -> "Settings":
+    return cast("Settings", LazySettings())
+
+
+settings = lazy_settings()
@@ -0,0 +1,54 @@
+import time
+from typing import Any
+
+from langchain_core.runnables import RunnableConfig
+
+DEADLINE_CONFIG_KEY = "deadline"
+
+
+class DeadlineExceededError(TimeoutError): ...
+
+
+class Deadline:
+    """
+    Point in (monotonic) time by which a request has to be answered, carried in
+    the graphs `RunnableConfig` so every step can check what is left of it.
+    """
+
+    def __init__(self, expires_at: float) -> None:
+        self.expires_at = expires_at
+
+    @classmethod
+    def from_timeout(cls, timeout_seconds: float) -> "Deadline":
+        return cls(expires_at=time.monotonic() + timeout_seconds)
+
+    @property
+    def remaining_seconds(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def is_expired(self) -> bool:
+        return self.remaining_seconds <= 0
+
+    def has_budget_for(self, seconds: float) -> bool:
+        return self.remaining_seconds >= seconds
+
+    def check(self) -> None:
+        if self.is_expired:
+            raise DeadlineExceededError
+
+
+def get_deadline(config: RunnableConfig | None) -> Deadline | None:
+    if config is None:
+        return None
+
+    configurable: dict[str, Any] = config.get("configurable", {})
+    deadline = configurable.get(DEADLINE_CONFIG_KEY)
+    if not isinstance(deadline, Deadline):
+        return None
+
+    return deadline
+
+
+def deadline_config(deadline: Deadline | None) -> RunnableConfig:
+    return {"configurable": {DEADLINE_CONFIG_KEY: deadline}}
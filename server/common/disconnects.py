@@ -0,0 +1,28 @@
+import asyncio
+from collections.abc import Awaitable
+from typing import TypeVar
+
+from fastapi import Request
+
+T = TypeVar("T")
+
+
+async def cancel_on_disconnect(request: Request, awaitable: Awaitable[T]) -> T:
+    """
+    Await `awaitable` while watching the client connection, cancelling the
+    work as soon as the client goes away instead of finishing it for nobody.
+    """
+    work = asyncio.ensure_future(awaitable)
+
+    async def watch_disconnect() -> None:
+        while True:
+            message = await request.receive()
+            if message["type"] == "http.disconnect":
+                work.cancel()
+                return
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        return await work
+    finally:
+        watcher.cancel()
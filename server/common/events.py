@@ -0,0 +1,81 @@
+import contextvars
+import uuid
+from collections.abc import Awaitable, Callable
+from typing import Any, Literal
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from pydantic import BaseModel
+
+ChatEventType = Literal["route", "tool_start", "tool_end", "token"]
+
+
+class ChatEvent(BaseModel):
+    type: ChatEventType
+    data: dict[str, Any]
+
+
+ChatEventSink = Callable[[ChatEvent], Awaitable[None]]
+
+# Set while a chat turn is streamed to its client, tasks of the turn inherit it
+current_chat_events: contextvars.ContextVar[ChatEventSink | None] = (
+    contextvars.ContextVar("current_chat_events", default=None)
+)
+# Name of the agent currently invoked, so its tokens can be told apart
+current_agent_name: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "current_agent_name", default=None
+)
+
+
+async def emit_chat_event(type: ChatEventType, **data: Any) -> None:
+    sink = current_chat_events.get()
+    if sink is not None:
+        await sink(ChatEvent(type=type, data=data))
+
+
+class ChatEventsCallbackHandler(AsyncCallbackHandler):
+    """
+    Forwards the tokens and tool calls of the agents of a streamed chat turn
+    to its event sink. The chat models are built streaming, and awaiting the
+    sink slows them down to what the client keeps up with.
+    """
+
+    def __init__(self) -> None:
+        self.__tool_names: dict[uuid.UUID, str] = {}
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if token:
+            await emit_chat_event("token", agent=current_agent_name.get(), token=token)
+
+    async def on_tool_start(
+        self,
+        serialized: dict[str, Any],
+        input_str: str,
+        *,
+        run_id: uuid.UUID,
+        **kwargs: Any,
+    ) -> None:
+        tool_name = serialized.get("name", "tool")
+        self.__tool_names[run_id] = tool_name
+        await emit_chat_event(
+            "tool_start", agent=current_agent_name.get(), tool=tool_name
+        )
+
+    async def on_tool_end(
+        self, output: Any, *, run_id: uuid.UUID, **kwargs: Any
+    ) -> None:
+        await emit_chat_event(
+            "tool_end",
+            agent=current_agent_name.get(),
+            tool=self.__tool_names.pop(run_id, "tool"),
+            ok=True,
+        )
+
+    async def on_tool_error(
+        self, error: BaseException, *, run_id: uuid.UUID, **kwargs: Any
+    ) -> None:
+        await emit_chat_event(
+            "tool_end",
+            agent=current_agent_name.get(),
+            tool=self.__tool_names.pop(run_id, "tool"),
+            ok=False,
+        )
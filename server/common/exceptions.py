@@ -38,6 +38,15 @@ class AgentsPlayNotFoundError(AgentsPlayError):
         )
 
 
+class AgentsPlayTooManyRequestsError(AgentsPlayError):
+    def __init__(self, headers: dict[str, str] | None = None):
+        super().__init__(
+            HTTPStatus.TOO_MANY_REQUESTS,
+            [AgentsPlayErrorDetail(msg="Too many requests", type="too_many_requests")],
+            headers,
+        )
+
+
 class AgentsPlayGeneralError(AgentsPlayError):
     def __init__(self, headers: dict[str, str] | None = None):
         super().__init__(
@@ -51,5 +60,32 @@ class AgentsPlayGeneralError(AgentsPlayError):
         )
 
 
+class AgentsPlayServiceUnavailableError(AgentsPlayError):
+    def __init__(self, retry_after_seconds: int, headers: dict[str, str] | None = None):
+        super().__init__(
+            HTTPStatus.SERVICE_UNAVAILABLE,
+            [
+                AgentsPlayErrorDetail(
+                    msg="Too busy to answer in time, retry later",
+                    type="overloaded",
+                )
+            ],
+            {**(headers or {}), "Retry-After": str(max(retry_after_seconds, 1))},
+        )
+
+
+class AgentsPlayGatewayTimeoutError(AgentsPlayError):
+    def __init__(self, headers: dict[str, str] | None = None):
+        super().__init__(
+            HTTPStatus.GATEWAY_TIMEOUT,
+            [
+                AgentsPlayErrorDetail(
+                    msg="Request took too long to process", type="deadline_exceeded"
+                )
+            ],
+            headers,
+        )
+
+
 def _base_model_as_dict(base_model: BaseModel) -> dict[str, Any]:
     return base_model.model_dump()
@@ -0,0 +1,56 @@
+import asyncio
+from collections.abc import Callable
+
+
+class BackgroundFlusher:
+    """
+    Calls `flush` in a worker thread every `interval_seconds`, or as soon as
+    it is woken, from a task of the event loop it was started on.
+    """
+
+    def __init__(self, flush: Callable[[], object], interval_seconds: float) -> None:
+        self.flush = flush
+        self.interval_seconds = interval_seconds
+
+        self.__loop: asyncio.AbstractEventLoop | None = None
+        self.__wakeup: asyncio.Event | None = None
+        self.__task: asyncio.Task[None] | None = None
+
+    async def start(self) -> None:
+        assert self.__task is None
+
+        self.__loop = asyncio.get_running_loop()
+        self.__wakeup = asyncio.Event()
+        self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self) -> None:
+        if self.__task is None:
+            return
+
+        self.__task.cancel()
+        try:
+            await self.__task
+        except asyncio.CancelledError:
+            pass
+        self.__task = None
+        self.__loop = None
+
+    def wake(self) -> None:
+        """Flushes early, safe to call from any thread, a no-op while stopped."""
+        loop, wakeup = self.__loop, self.__wakeup
+        if loop is not None and wakeup is not None:
+            loop.call_soon_threadsafe(wakeup.set)
+
+    async def __run(self) -> None:
+        assert self.__wakeup is not None
+
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self.__wakeup.wait(), timeout=self.interval_seconds
+                )
+            except TimeoutError:
+                pass
+            self.__wakeup.clear()
+
+            await asyncio.to_thread(self.flush)
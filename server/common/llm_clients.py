@@ -0,0 +1,213 @@
+from collections.abc import AsyncIterator, Callable
+from typing import TYPE_CHECKING, Any
+
+import httpx
+from common.conf import settings
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    from langchain_core.language_models import BaseChatModel
+
+
+def llm_call_errors() -> tuple[type[Exception], ...]:
+    """
+    How a model call fails rather than the code around it: the provider's
+    API errors, transport errors and timeouts, deadlines included.
+    """
+    # Deferred like the chat models, it is imported by their first call anyway
+    from langgraph.errors import GraphRecursionError
+    from openai import APIError
+
+    return (APIError, httpx.HTTPError, TimeoutError, GraphRecursionError)
+
+
+class LLMHttpPoolStats(BaseModel):
+    max_connections: int
+    max_keepalive_connections: int
+    in_flight: int
+    peak_in_flight: int
+    # Requests beyond the pool size wait for a connection to free up
+    waiting: int
+    peak_waiting: int
+    utilization: float
+    requests: int
+    failures: int
+
+
+class CountingTransport(httpx.AsyncBaseTransport):
+    """
+    Counts the requests holding a pooled connection, from sending until the
+    response is read or closed, so streamed responses count while they stream.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport) -> None:
+        self.transport = transport
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.failures = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            response = await self.transport.handle_async_request(request)
+        except Exception:
+            self.failures += 1
+            self.in_flight -= 1
+            raise
+
+        assert isinstance(response.stream, httpx.AsyncByteStream)
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_CountedStream(response.stream, on_close=self.__release),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+    def __release(self) -> None:
+        self.in_flight -= 1
+
+
+class _CountedStream(httpx.AsyncByteStream):
+    def __init__(
+        self, stream: httpx.AsyncByteStream, on_close: Callable[[], None]
+    ) -> None:
+        self.stream = stream
+        self.on_close = on_close
+        self.closed = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self.stream.aclose()
+        finally:
+            if not self.closed:
+                self.closed = True
+                self.on_close()
+
+
+class LLMClientFactory:
+    """
+    Builds the chat models every agent calls, one per configured model, all
+    sharing one pooled HTTP client with keep-alive, so connections to the
+    provider are reused across agents and requests. Timeouts and retries are
+    set here once. The app closes it on shutdown, it reopens on next use.
+    """
+
+    def __init__(self) -> None:
+        self.limits = httpx.Limits(
+            max_connections=settings.llm_http_max_connections,
+            max_keepalive_connections=settings.llm_http_max_keepalive_connections,
+            keepalive_expiry=settings.llm_http_keepalive_expiry_seconds,
+        )
+        self.timeout = httpx.Timeout(
+            connect=settings.llm_http_connect_timeout_seconds,
+            read=settings.llm_http_read_timeout_seconds,
+            write=settings.llm_http_write_timeout_seconds,
+            pool=settings.llm_http_pool_timeout_seconds,
+        )
+
+        self.__transport: CountingTransport | None = None
+        self.__client: httpx.AsyncClient | None = None
+        self.__chat_models: dict[str, "BaseChatModel"] = {}
+
+    def chat_model(self, name: str) -> "BaseChatModel":
+        chat_model = self.__chat_models.get(name)
+        if chat_model is None:
+            # Deferred, importing the chat models dominates startup time
+            from langchain.chat_models import init_chat_model
+
+            model_options: dict[str, Any] = {}
+            if name.startswith("openai:"):
+                assert settings.openai_api_key
+                model_options = {
+                    "http_async_client": self.http_client(),
+                    "timeout": self.timeout,
+                    # The SDK retries connection errors, 408, 409, 429 and 5xx
+                    # with exponential backoff
+                    "max_retries": settings.llm_http_max_retries,
+                    # Tokens reach the callbacks as they arrive, e.g. for the
+                    # chat socket, and streamed calls still report usage
+                    "streaming": True,
+                    "stream_usage": True,
+                }
+
+            chat_model = init_chat_model(name, **model_options)
+            self.__chat_models[name] = chat_model
+
+        return chat_model
+
+    def http_client(self) -> httpx.AsyncClient:
+        if self.__client is None:
+            self.__transport = CountingTransport(
+                httpx.AsyncHTTPTransport(
+                    limits=self.limits,
+                    # Only retries failed connects, the SDK retries requests
+                    retries=settings.llm_http_connect_retries,
+                )
+            )
+            self.__client = httpx.AsyncClient(
+                transport=self.__transport, timeout=self.timeout
+            )
+
+        return self.__client
+
+    def stats(self) -> LLMHttpPoolStats:
+        max_connections = self.limits.max_connections or 0
+        in_flight = peak_in_flight = requests = failures = 0
+        if self.__transport is not None:
+            in_flight = self.__transport.in_flight
+            peak_in_flight = self.__transport.peak_in_flight
+            requests = self.__transport.requests
+            failures = self.__transport.failures
+
+        return LLMHttpPoolStats(
+            max_connections=max_connections,
+            max_keepalive_connections=self.limits.max_keepalive_connections or 0,
+            in_flight=in_flight,
+            peak_in_flight=peak_in_flight,
+            waiting=_waiting(in_flight, max_connections),
+            peak_waiting=_waiting(peak_in_flight, max_connections),
+            utilization=(
+                min(in_flight / max_connections, 1.0) if max_connections else 0.0
+            ),
+            requests=requests,
+            failures=failures,
+        )
+
+    async def aclose(self) -> None:
+        if self.__client is not None:
+            await self.__client.aclose()
+
+        self.__client = None
+        self.__transport = None
+        # The models hold the closed client, rebuild them on next use
+        self.__chat_models.clear()
+
+
+def _waiting(in_flight: int, max_connections: int) -> int:
+    if not max_connections:
+        return 0
+
+    return max(in_flight - max_connections, 0)
+
+
+__llm_client_factory: LLMClientFactory | None = None
+
+
+def get_llm_client_factory() -> LLMClientFactory:
+    global __llm_client_factory
+
+    if __llm_client_factory is None:
+        __llm_client_factory = LLMClientFactory()
+
+    return __llm_client_factory
@@ -0,0 +1,279 @@
+import asyncio
+import logging
+import math
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any
+
+from common.conf import settings
+from common.profiling import running_stack
+from pydantic import BaseModel
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+ALL_ROUTES = "*"
+IDLE_ROUTE = "<idle>"
+UNROUTED_ROUTE = "<unrouted>"
+
+
+class LoopLagStats(BaseModel):
+    route: str
+    samples: int
+    p50_seconds: float
+    p95_seconds: float
+    p99_seconds: float
+    max_seconds: float
+
+
+class BlockingCall(BaseModel):
+    detected_at: float
+    # At least this long, updated with the full duration once the loop runs
+    blocked_seconds: float
+    routes: list[str]
+    stack: list[str]
+
+
+class LoopMonitorStats(BaseModel):
+    interval_seconds: float
+    debug: bool
+    lag: list[LoopLagStats]
+    blocking_calls: list[BlockingCall]
+
+
+class EventLoopMonitor:
+    """
+    Measures how late the event loop wakes a task sleeping for a fixed
+    interval, which is how long callbacks kept it busy, and keeps recent lag
+    samples per route in flight to report their percentiles. A sample is
+    charged to every route in flight during its interval, the one blocking
+    can't be told apart.
+
+    In debug mode a watchdog thread also catches the loop stuck in one
+    callback for longer than `blocking_threshold_seconds` and records the
+    stack it is stuck in.
+    """
+
+    def __init__(
+        self,
+        interval_seconds: float,
+        max_samples: int,
+        debug: bool,
+        blocking_threshold_seconds: float,
+        max_blocking_calls: int,
+    ) -> None:
+        self.interval_seconds = interval_seconds
+        self.max_samples = max_samples
+        self.debug = debug
+        self.blocking_threshold_seconds = blocking_threshold_seconds
+
+        self.__lag: dict[str, deque[float]] = {}
+        self.__blocking_calls: deque[BlockingCall] = deque(maxlen=max_blocking_calls)
+        self.__requests: dict[int, Scope] = {}
+        # Requests that ended since the last tick may have caused its lag
+        self.__finished_routes: set[str] = set()
+        self.__lock = threading.Lock()
+        self.__last_tick = time.monotonic()
+        self.__stalled: BlockingCall | None = None
+        self.__loop_thread_id: int | None = None
+        self.__ticker: asyncio.Task[None] | None = None
+        self.__watchdog: threading.Thread | None = None
+        self.__stopped = threading.Event()
+
+    def request_started(self, scope: Scope) -> None:
+        with self.__lock:
+            self.__requests[id(scope)] = scope
+
+    def request_finished(self, scope: Scope) -> None:
+        with self.__lock:
+            self.__requests.pop(id(scope), None)
+            self.__finished_routes.add(_route(scope))
+
+    def stats(self) -> LoopMonitorStats:
+        with self.__lock:
+            lag = {route: sorted(samples) for route, samples in self.__lag.items()}
+            blocking_calls = [call.model_copy() for call in self.__blocking_calls]
+
+        return LoopMonitorStats(
+            interval_seconds=self.interval_seconds,
+            debug=self.debug,
+            lag=[
+                LoopLagStats(
+                    route=route,
+                    samples=len(samples),
+                    p50_seconds=_percentile(samples, 50),
+                    p95_seconds=_percentile(samples, 95),
+                    p99_seconds=_percentile(samples, 99),
+                    max_seconds=samples[-1] if samples else 0.0,
+                )
+                for route, samples in sorted(lag.items())
+            ],
+            blocking_calls=blocking_calls,
+        )
+
+    async def start(self) -> None:
+        assert self.__ticker is None
+
+        self.__loop_thread_id = threading.get_ident()
+        self.__last_tick = time.monotonic()
+        self.__ticker = asyncio.create_task(self.__run_ticker())
+        if self.debug:
+            self.__stopped.clear()
+            self.__watchdog = threading.Thread(
+                target=self.__run_watchdog, name="loop-watchdog", daemon=True
+            )
+            self.__watchdog.start()
+
+    async def stop(self) -> None:
+        if self.__ticker is None:
+            return
+
+        self.__ticker.cancel()
+        try:
+            await self.__ticker
+        except asyncio.CancelledError:
+            pass
+        self.__ticker = None
+
+        if self.__watchdog is not None:
+            self.__stopped.set()
+            self.__watchdog.join()
+            self.__watchdog = None
+
+    async def __run_ticker(self) -> None:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval_seconds)
+            now = time.monotonic()
+            self.__record(max(now - start - self.interval_seconds, 0.0), now)
+
+    def __record(self, lag_seconds: float, now: float) -> None:
+        with self.__lock:
+            self.__last_tick = now
+            if self.__stalled is not None:
+                self.__stalled.blocked_seconds = max(
+                    self.__stalled.blocked_seconds, lag_seconds
+                )
+                self.__stalled = None
+
+            routes = self.__routes(finished_routes=self.__finished_routes)
+            self.__finished_routes = set()
+            for route in [ALL_ROUTES, *routes]:
+                samples = self.__lag.get(route)
+                if samples is None:
+                    samples = self.__lag[route] = deque(maxlen=self.max_samples)
+                samples.append(lag_seconds)
+
+    def __run_watchdog(self) -> None:
+        check_interval = self.blocking_threshold_seconds / 2
+        while not self.__stopped.wait(check_interval):
+            with self.__lock:
+                blocked_seconds = (
+                    time.monotonic() - self.__last_tick - self.interval_seconds
+                )
+                if (
+                    self.__stalled is not None
+                    or blocked_seconds < self.blocking_threshold_seconds
+                ):
+                    continue
+
+                routes = self.__routes()
+
+            stack = self.__loop_stack()
+            blocking_call = BlockingCall(
+                detected_at=time.time(),
+                blocked_seconds=blocked_seconds,
+                routes=routes,
+                stack=stack,
+            )
+            with self.__lock:
+                self.__stalled = blocking_call
+                self.__blocking_calls.append(blocking_call)
+
+            logger.warning(
+                "Event loop blocked for %.3fs serving %s, in:\n%s",
+                blocked_seconds,
+                ", ".join(routes),
+                "\n".join(stack),
+            )
+
+    def __routes(self, finished_routes: set[str] | None = None) -> list[str]:
+        routes = {_route(scope) for scope in self.__requests.values()}
+        if finished_routes:
+            routes |= finished_routes
+        if not routes:
+            return [IDLE_ROUTE]
+
+        return sorted(routes)
+
+    def __loop_stack(self) -> list[str]:
+        if self.__loop_thread_id is None:
+            return []
+
+        frame = sys._current_frames().get(self.__loop_thread_id)
+        if frame is None:
+            return []
+
+        return running_stack(frame, root=None)
+
+
+class LoopMonitorMiddleware:
+    """Tells the monitor which routes are in flight, to tag lag samples with."""
+
+    def __init__(self, app: ASGIApp, monitor: EventLoopMonitor) -> None:
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        self.monitor.request_started(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.monitor.request_finished(scope)
+
+
+def _route(scope: Scope) -> str:
+    # Set by the router once it matched, templates keep the tags few
+    route: Any = scope.get("route")
+    path = getattr(route, "path", None)
+    if path is None:
+        return UNROUTED_ROUTE
+
+    return f"{scope.get('method', 'WS')} {path}"
+
+
+def _percentile(sorted_values: list[float], percentile: int) -> float:
+    if not sorted_values:
+        return 0.0
+
+    # Nearest rank
+    rank = math.ceil(percentile / 100 * len(sorted_values))
+
+    return sorted_values[max(rank, 1) - 1]
+
+
+__loop_monitor: EventLoopMonitor | None = None
+
+
+def get_loop_monitor() -> EventLoopMonitor | None:
+    global __loop_monitor
+
+    if not settings.loop_monitor_enabled:
+        return None
+
+    if __loop_monitor is None:
+        __loop_monitor = EventLoopMonitor(
+            interval_seconds=settings.loop_monitor_interval_seconds,
+            max_samples=settings.loop_monitor_max_samples,
+            debug=settings.loop_monitor_debug,
+            blocking_threshold_seconds=settings.loop_monitor_blocking_threshold_seconds,
+            max_blocking_calls=settings.loop_monitor_max_blocking_calls,
+        )
+
+    return __loop_monitor
@@ -0,0 +1,22 @@
+import uuid
+from typing import Annotated
+
+from common.conf import settings
+from fastapi import Header
+
+OWNER_ID_HEADER = "x-owner-id"
+
+
+def get_owner_id(
+    owner_id: Annotated[uuid.UUID | None, Header(alias=OWNER_ID_HEADER)] = None,
+) -> uuid.UUID:
+    """
+    Owner of the chat rooms and todos a request reads and writes. Stands in
+    for the authenticated user until there is authentication. The header is
+    only read when a trusted proxy sets it, other requests all share the
+    default owner.
+    """
+    if owner_id is None or not settings.owner_id_header_trusted:
+        return settings.default_owner_id
+
+    return owner_id
@@ -0,0 +1,326 @@
+import asyncio
+import contextvars
+import hmac
+import json
+import random
+import sys
+import threading
+import uuid
+import weakref
+from collections import Counter
+from collections.abc import Callable, Coroutine
+from pathlib import Path
+from types import FrameType
+from typing import Any, Literal
+
+from common.conf import settings
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+PROFILE_TOKEN_HEADER = "x-profile-token"
+REQUEST_ID_HEADER = "x-request-id"
+
+ProfileFormat = Literal["speedscope", "collapsed"]
+
+PROFILE_FILE_SUFFIXES: dict[ProfileFormat, str] = {
+    "speedscope": ".speedscope.json",
+    "collapsed": ".collapsed.txt",
+}
+
+Stack = tuple[str, ...]
+
+TaskFactory = Callable[..., "asyncio.Future[Any]"]
+
+# Set for the tasks of a profiled request, new tasks inherit it
+current_profile: contextvars.ContextVar["RequestProfile | None"] = (
+    contextvars.ContextVar("current_profile", default=None)
+)
+
+
+class RequestProfile:
+    """
+    Samples the stacks of every task of one request from a background thread.
+    Running tasks are sampled from the event loop thread's frames, suspended
+    ones from their chain of awaited coroutines, so time spent waiting on the
+    database or a model shows up as well as time spent computing.
+    """
+
+    def __init__(
+        self,
+        request_id: str,
+        name: str,
+        loop: asyncio.AbstractEventLoop,
+        interval_seconds: float,
+        max_samples: int,
+    ) -> None:
+        self.request_id = request_id
+        self.name = name
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        self.interval_seconds = interval_seconds
+        self.max_samples = max_samples
+        self.tasks: weakref.WeakSet[asyncio.Task[Any]] = weakref.WeakSet()
+        self.samples: list[Stack] = []
+
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__sampler = threading.Thread(
+            target=self.__run_sampler, name=f"profiler-{request_id}", daemon=True
+        )
+
+    def add_task(self, task: asyncio.Task[Any]) -> None:
+        with self.__lock:
+            self.tasks.add(task)
+
+    def start(self) -> None:
+        self.__sampler.start()
+
+    def stop(self) -> None:
+        self.__stopped.set()
+        self.__sampler.join()
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's collapsed stacks, one `frame;frame;frame count` line."""
+        counts = Counter(self.samples)
+
+        return "".join(
+            f"{';'.join(stack)} {count}\n" for stack, count in counts.items()
+        )
+
+    def speedscope(self) -> dict[str, Any]:
+        frame_indexes: dict[str, int] = {}
+        samples = [
+            [frame_indexes.setdefault(frame, len(frame_indexes)) for frame in stack]
+            for stack in self.samples
+        ]
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "agents-play",
+            "shared": {"frames": [{"name": frame} for frame in frame_indexes]},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": self.name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": len(samples) * self.interval_seconds,
+                    "samples": samples,
+                    "weights": [self.interval_seconds] * len(samples),
+                }
+            ],
+        }
+
+    def save(self, directory: Path, max_stored: int) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        profile_path(directory, self.request_id, "speedscope").write_text(
+            json.dumps(self.speedscope())
+        )
+        profile_path(directory, self.request_id, "collapsed").write_text(
+            self.collapsed()
+        )
+
+        stored = sorted(
+            directory.glob(f"*{PROFILE_FILE_SUFFIXES['speedscope']}"),
+            key=lambda path: path.stat().st_mtime,
+        )
+        for expired in stored[: max(len(stored) - max_stored, 0)]:
+            request_id = expired.name.removesuffix(PROFILE_FILE_SUFFIXES["speedscope"])
+            for format in PROFILE_FILE_SUFFIXES:
+                profile_path(directory, request_id, format).unlink(missing_ok=True)
+
+    def __run_sampler(self) -> None:
+        while not self.__stopped.wait(self.interval_seconds):
+            if len(self.samples) >= self.max_samples:
+                return
+
+            self.__sample()
+
+    def __sample(self) -> None:
+        loop_frame = sys._current_frames().get(self.loop_thread_id)
+        running_task = asyncio.current_task(self.loop)
+        with self.__lock:
+            tasks = [task for task in self.tasks if not task.done()]
+
+        for task in tasks:
+            # Tasks made by a task factory are unnamed on some Python versions
+            task_name = f"[{task.get_name() or 'task'}]"
+            coroutine = task.get_coro()
+            if task is running_task and loop_frame is not None:
+                stack = running_stack(loop_frame, root=_coroutine_frame(coroutine))
+                self.samples.append((task_name, *stack))
+            else:
+                stack = _awaiting_stack(coroutine)
+                self.samples.append((task_name, *stack, "<awaiting>"))
+
+
+class ProfilingMiddleware:
+    """
+    Profiles requests carrying the admin profiling token, and a bounded random
+    sample of the others, storing their flame data under the request id and
+    linking to it from the response. Only installed when profiling is enabled,
+    so it costs nothing otherwise. The task factory tracking a request's tasks
+    is only set while a profile runs, the loop's own comes back after.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self.__active_profiles = 0
+        self.__previous_task_factory: TaskFactory | None = None
+        self.__task_factory: TaskFactory | None = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.__should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        if self.__active_profiles >= settings.profiling_max_concurrent:
+            await self.app(scope, receive, send)
+            return
+
+        loop = asyncio.get_running_loop()
+
+        request_id = uuid.uuid4().hex
+        profile = RequestProfile(
+            request_id=request_id,
+            name=f"{scope['method']} {scope['path']} {request_id}",
+            loop=loop,
+            interval_seconds=settings.profiling_interval_seconds,
+            max_samples=settings.profiling_max_samples,
+        )
+        task = asyncio.current_task()
+        assert task is not None
+        profile.add_task(task)
+
+        async def send_with_profile_link(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((REQUEST_ID_HEADER.encode(), request_id.encode()))
+                # Profiles are only served with the admin token, without one
+                # the link would lead nowhere
+                if settings.profiling_admin_token is not None:
+                    headers.append(
+                        (
+                            b"link",
+                            f'</health/profiles/{request_id}>; rel="profile"'.encode(),
+                        )
+                    )
+                message = {**message, "headers": headers}
+
+            await send(message)
+
+        if self.__active_profiles == 0:
+            self.__install_task_factory(loop)
+        self.__active_profiles += 1
+        token = current_profile.set(profile)
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_profile_link)
+        finally:
+            profile.stop()
+            current_profile.reset(token)
+            self.__active_profiles -= 1
+            if self.__active_profiles == 0:
+                self.__restore_task_factory(loop)
+
+            await asyncio.to_thread(
+                profile.save,
+                directory=settings.profiling_directory,
+                max_stored=settings.profiling_max_stored,
+            )
+
+    def __install_task_factory(self, loop: asyncio.AbstractEventLoop) -> None:
+        previous_task_factory = loop.get_task_factory()
+
+        def profiled_task_factory(
+            loop: asyncio.AbstractEventLoop,
+            coro: Coroutine[Any, Any, Any],
+            **kwargs: Any,
+        ) -> "asyncio.Future[Any]":
+            # Whatever factory the loop had still makes the tasks
+            task = (
+                previous_task_factory(loop, coro, **kwargs)
+                if previous_task_factory is not None
+                else asyncio.Task(coro, loop=loop, **kwargs)
+            )
+            profile = current_profile.get()
+            if profile is not None and isinstance(task, asyncio.Task):
+                profile.add_task(task)
+
+            return task
+
+        self.__previous_task_factory = previous_task_factory
+        self.__task_factory = profiled_task_factory
+        loop.set_task_factory(profiled_task_factory)
+
+    def __restore_task_factory(self, loop: asyncio.AbstractEventLoop) -> None:
+        # Left alone if something else replaced it meanwhile
+        if loop.get_task_factory() is self.__task_factory:
+            loop.set_task_factory(self.__previous_task_factory)
+
+        self.__previous_task_factory = None
+        self.__task_factory = None
+
+    def __should_profile(self, scope: Scope) -> bool:
+        admin_token = settings.profiling_admin_token
+        if admin_token is not None:
+            for name, value in scope["headers"]:
+                if name == PROFILE_TOKEN_HEADER.encode():
+                    return is_profile_token_valid(value.decode())
+
+        return random.random() < settings.profiling_sample_rate
+
+
+def is_profile_token_valid(token: str | None) -> bool:
+    admin_token = settings.profiling_admin_token
+    if admin_token is None or token is None:
+        return False
+
+    return hmac.compare_digest(token, admin_token.get_secret_value())
+
+
+def profile_path(directory: Path, request_id: str, format: ProfileFormat) -> Path:
+    return directory / f"{request_id}{PROFILE_FILE_SUFFIXES[format]}"
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+
+    return f"{code.co_qualname} ({code.co_filename}:{frame.f_lineno})"
+
+
+def _coroutine_frame(coroutine: Any) -> FrameType | None:
+    return (
+        getattr(coroutine, "cr_frame", None)
+        or getattr(coroutine, "gi_frame", None)
+        or getattr(coroutine, "ag_frame", None)
+    )
+
+
+def running_stack(frame: FrameType, root: FrameType | None) -> list[str]:
+    frames: list[FrameType] = []
+    current: FrameType | None = frame
+    while current is not None:
+        frames.append(current)
+        # Everything above the task's own coroutine is event loop machinery
+        if current is root:
+            break
+        current = current.f_back
+
+    return [_frame_name(frame) for frame in reversed(frames)]
+
+
+def _awaiting_stack(coroutine: Any) -> list[str]:
+    stack: list[str] = []
+    while coroutine is not None:
+        frame = _coroutine_frame(coroutine)
+        if frame is None:
+            break
+        stack.append(_frame_name(frame))
+        coroutine = (
+            getattr(coroutine, "cr_await", None)
+            or getattr(coroutine, "gi_yieldfrom", None)
+            or getattr(coroutine, "ag_await", None)
+        )
+
+    return stack
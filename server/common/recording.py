@@ -0,0 +1,258 @@
+import asyncio
+import contextvars
+import json
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Literal
+
+from common.datetime_utils import datetime_now_with_timezone
+from langchain_core.messages import (
+    BaseMessage,
+    convert_to_messages,
+    messages_from_dict,
+    messages_to_dict,
+)
+from pydantic import BaseModel, Field
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+REDACTED = "[REDACTED]"
+
+ReplaySpeed = Literal["recorded", "full"]
+
+
+class ReplayMismatchError(Exception):
+    """The replayed request asked for a call the trace has no recording of."""
+
+
+class RecordedLLMCall(BaseModel):
+    agent: str
+    model: str
+    latency_seconds: float
+    input_messages: list[dict[str, Any]]
+    output_messages: list[dict[str, Any]]
+
+
+class RecordedForexCall(BaseModel):
+    base: str
+    latency_seconds: float
+    response: dict[str, Any]
+
+
+class RecordedRequest(BaseModel):
+    id: uuid.UUID = Field(default_factory=uuid.uuid4)
+    recorded_at: datetime = Field(default_factory=datetime_now_with_timezone)
+    method: str
+    path: str
+    query_string: str
+    headers: dict[str, str]
+    body: Any = None
+    status_code: int | None = None
+    response_body: Any = None
+    latency_seconds: float = 0.0
+    routes: list[str] = []
+    llm_calls: list[RecordedLLMCall] = []
+    forex_calls: list[RecordedForexCall] = []
+
+
+# Set while a request is recorded or replayed, tasks of the request inherit it
+current_recording: contextvars.ContextVar[RecordedRequest | None] = (
+    contextvars.ContextVar("current_recording", default=None)
+)
+current_cassette: contextvars.ContextVar["ReplayCassette | None"] = (
+    contextvars.ContextVar("current_cassette", default=None)
+)
+
+
+def record_route(route: str) -> None:
+    recording = current_recording.get()
+    if recording is not None:
+        recording.routes.append(route)
+
+
+def record_llm_call(
+    agent: str,
+    model: str,
+    latency_seconds: float,
+    input_messages: list[Any],
+    output_messages: list[BaseMessage],
+) -> None:
+    recording = current_recording.get()
+    if recording is None:
+        return
+
+    recording.llm_calls.append(
+        RecordedLLMCall(
+            agent=agent,
+            model=model,
+            latency_seconds=latency_seconds,
+            input_messages=messages_to_dict(convert_to_messages(input_messages)),
+            output_messages=messages_to_dict(output_messages),
+        )
+    )
+
+
+def record_forex_call(
+    base: str, latency_seconds: float, response: dict[str, Any]
+) -> None:
+    recording = current_recording.get()
+    if recording is None:
+        return
+
+    recording.forex_calls.append(
+        RecordedForexCall(base=base, latency_seconds=latency_seconds, response=response)
+    )
+
+
+class ReplayCassette:
+    """
+    Serves the LLM and forex responses recorded for one request, in the order
+    they were recorded, after waiting their recorded latency unless replaying
+    at full speed.
+    """
+
+    def __init__(self, recording: RecordedRequest, speed: ReplaySpeed) -> None:
+        self.speed = speed
+        self.__llm_calls: defaultdict[str, deque[RecordedLLMCall]] = defaultdict(deque)
+        for llm_call in recording.llm_calls:
+            self.__llm_calls[llm_call.agent].append(llm_call)
+        self.__forex_calls: defaultdict[str, deque[RecordedForexCall]] = defaultdict(
+            deque
+        )
+        for forex_call in recording.forex_calls:
+            self.__forex_calls[forex_call.base].append(forex_call)
+
+    async def llm_call(self, agent: str) -> tuple[str, list[BaseMessage]]:
+        if not self.__llm_calls[agent]:
+            raise ReplayMismatchError(f"No recorded call of agent {agent}")
+
+        llm_call = self.__llm_calls[agent].popleft()
+        await self.__wait(llm_call.latency_seconds)
+
+        return llm_call.model, messages_from_dict(llm_call.output_messages)
+
+    async def forex_call(self, base: str) -> dict[str, Any]:
+        if not self.__forex_calls[base]:
+            raise ReplayMismatchError(f"No recorded forex call for {base}")
+
+        forex_call = self.__forex_calls[base].popleft()
+        await self.__wait(forex_call.latency_seconds)
+
+        return forex_call.response
+
+    async def __wait(self, latency_seconds: float) -> None:
+        if self.speed == "recorded":
+            await asyncio.sleep(latency_seconds)
+
+
+class TrafficRecorderMiddleware:
+    """
+    Appends every request under `path_prefix` to a JSONL trace, with its
+    payload, routing decisions, LLM and forex calls and response, redacting
+    anything matching the configured patterns before it is written.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        path_prefix: str,
+        trace_path: Path,
+        redact_patterns: list[str],
+        recorded_headers: list[str],
+    ) -> None:
+        self.app = app
+        self.path_prefix = path_prefix
+        self.trace_path = trace_path
+        self.redact_patterns = [re.compile(pattern) for pattern in redact_patterns]
+        self.recorded_headers = {header.lower() for header in recorded_headers}
+        self.__lock = threading.Lock()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or not scope["path"].startswith(self.path_prefix)
+            # Replayed traffic is not recorded again
+            or current_cassette.get() is not None
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        recording = RecordedRequest(
+            method=scope["method"],
+            path=scope["path"],
+            query_string=scope["query_string"].decode(),
+            headers={
+                name.decode(): value.decode()
+                for name, value in scope["headers"]
+                if name.decode().lower() in self.recorded_headers
+            },
+        )
+        request_body = bytearray()
+        response_body = bytearray()
+
+        async def receive_recorded() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                request_body.extend(message.get("body", b""))
+
+            return message
+
+        async def send_recorded(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                recording.status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                response_body.extend(message.get("body", b""))
+
+            await send(message)
+
+        token = current_recording.set(recording)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive_recorded, send_recorded)
+        finally:
+            recording.latency_seconds = time.perf_counter() - start
+            current_recording.reset(token)
+
+            recording.body = _json_or_text(bytes(request_body))
+            recording.response_body = _json_or_text(bytes(response_body))
+            await asyncio.to_thread(self.__append, recording)
+
+    def __append(self, recording: RecordedRequest) -> None:
+        line = json.dumps(self.__redacted(recording.model_dump(mode="json")))
+        with self.__lock:
+            self.trace_path.parent.mkdir(parents=True, exist_ok=True)
+            with self.trace_path.open("a") as trace:
+                trace.write(f"{line}\n")
+
+    def __redacted(self, value: Any) -> Any:
+        if isinstance(value, str):
+            for pattern in self.redact_patterns:
+                value = pattern.sub(REDACTED, value)
+            return value
+        if isinstance(value, list):
+            return [self.__redacted(item) for item in value]
+        if isinstance(value, dict):
+            return {key: self.__redacted(item) for key, item in value.items()}
+
+        return value
+
+
+def read_trace(trace_path: Path) -> list[RecordedRequest]:
+    with trace_path.open() as trace:
+        return [
+            RecordedRequest.model_validate_json(line) for line in trace if line.strip()
+        ]
+
+
+def _json_or_text(body: bytes) -> Any:
+    if not body:
+        return None
+
+    try:
+        return json.loads(body)
+    except ValueError:
+        return body.decode(errors="replace")
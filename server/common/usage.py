@@ -0,0 +1,181 @@
+import contextvars
+import re
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Protocol
+
+from common.datetime_utils import datetime_now_with_timezone
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+from langchain_core.runnables import RunnableConfig, ensure_config
+from pydantic import BaseModel, Field
+
+# Checkpoint namespaces look like `outer_node:<task id>|inner_node:<task id>`
+CHECKPOINT_NS_TASK_ID = re.compile(r":[^|]*")
+
+
+class LLMUsage(BaseModel):
+    """Tokens and latency of one agent invocation, every model call it made."""
+
+    recorded_at: datetime = Field(default_factory=datetime_now_with_timezone)
+    request_id: uuid.UUID | None
+    owner_id: uuid.UUID | None
+    room_id: uuid.UUID | None
+    node: str | None
+    node_path: str | None
+    agent: str
+    model: str
+    model_calls: int
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int
+    latency_seconds: float
+    estimated_cost: float
+    # Errored or ran out of time, only the model calls that completed count
+    failed: bool = False
+
+
+class LLMTokenCounts(BaseModel):
+    model_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+def count_tokens(output_messages: list[BaseMessage]) -> LLMTokenCounts:
+    """
+    Tokens of every model call an agent invocation made, one AI message each.
+    Tool calling invocations make several, not only the final answer.
+    """
+    counts = LLMTokenCounts()
+    for message in output_messages:
+        if not isinstance(message, AIMessage) or not message.usage_metadata:
+            continue
+
+        counts.model_calls += 1
+        counts.prompt_tokens += message.usage_metadata["input_tokens"]
+        counts.completion_tokens += message.usage_metadata["output_tokens"]
+        counts.cached_tokens += message.usage_metadata.get(
+            "input_token_details", {}
+        ).get("cache_read", 0)
+
+    return counts
+
+
+class LLMUsageCallbackHandler(BaseCallbackHandler):
+    """
+    Collects the AI message of every model call as it completes, the calls an
+    invocation made before failing are metered too.
+    """
+
+    run_inline = True
+
+    def __init__(self) -> None:
+        self.messages: list[BaseMessage] = []
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                if isinstance(generation, ChatGeneration):
+                    self.messages.append(generation.message)
+
+
+class LLMUsageSink(Protocol):
+    def add(self, usage: LLMUsage) -> None: ...
+
+
+class LLMUsageScope:
+    """What the agent invocations of one request are metered against."""
+
+    def __init__(
+        self,
+        sink: LLMUsageSink,
+        request_id: uuid.UUID,
+        owner_id: uuid.UUID | None = None,
+        room_id: uuid.UUID | None = None,
+    ) -> None:
+        self.sink = sink
+        self.request_id = request_id
+        self.owner_id = owner_id
+        self.room_id = room_id
+
+
+# Set for the tasks of a metered request, new tasks inherit it
+current_llm_usage_scope: contextvars.ContextVar[LLMUsageScope | None] = (
+    contextvars.ContextVar("current_llm_usage_scope", default=None)
+)
+
+
+@contextmanager
+def llm_usage_scope(
+    sink: LLMUsageSink | None,
+    request_id: uuid.UUID,
+    owner_id: uuid.UUID | None = None,
+    room_id: uuid.UUID | None = None,
+) -> Iterator[None]:
+    """Meters the agent invocations made inside, unless metering is off."""
+    if sink is None:
+        yield
+        return
+
+    token = current_llm_usage_scope.set(
+        LLMUsageScope(
+            sink=sink, request_id=request_id, owner_id=owner_id, room_id=room_id
+        )
+    )
+    try:
+        yield
+    finally:
+        current_llm_usage_scope.reset(token)
+
+
+def record_llm_usage(
+    agent: str,
+    model: str,
+    latency_seconds: float,
+    output_messages: list[BaseMessage],
+    cost_per_million_tokens: float,
+    config: RunnableConfig | None,
+    failed: bool = False,
+) -> None:
+    scope = current_llm_usage_scope.get()
+    if scope is None:
+        return
+
+    # The node running the agent, inherited from the graph invoking it
+    metadata = ensure_config(config).get("metadata", {})
+    node = metadata.get("langgraph_node")
+    checkpoint_ns = metadata.get("langgraph_checkpoint_ns")
+    node_path = (
+        CHECKPOINT_NS_TASK_ID.sub("", checkpoint_ns).replace("|", "/")
+        if isinstance(checkpoint_ns, str)
+        else None
+    )
+
+    counts = count_tokens(output_messages)
+
+    scope.sink.add(
+        LLMUsage(
+            request_id=scope.request_id,
+            owner_id=scope.owner_id,
+            room_id=scope.room_id,
+            node=node if isinstance(node, str) else None,
+            node_path=node_path,
+            agent=agent,
+            model=model,
+            model_calls=counts.model_calls,
+            prompt_tokens=counts.prompt_tokens,
+            completion_tokens=counts.completion_tokens,
+            cached_tokens=counts.cached_tokens,
+            latency_seconds=latency_seconds,
+            estimated_cost=(counts.total_tokens * cost_per_million_tokens / 1_000_000),
+            failed=failed,
+        )
+    )
@@ -0,0 +1,4 @@
+from database.database import create_db_and_tables, get_database
+
+if __name__ == "__main__":
+    create_db_and_tables(get_database())
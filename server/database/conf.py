@@ -1,4 +1,9 @@
-from common.conf import BaseSettings
+from typing import TYPE_CHECKING
+
+from common.conf import BaseSettings, lazy_settings
+
+if TYPE_CHECKING:
+    from agents_play.conf import Settings
 
 DATABASE_USER = "agent-play-user"
 DATABASE_PASSWORD = "secure-password"
@@ -8,8 +13,14 @@ DATABASE_NAME = "agent_play_db"
 DEFAULT_POSTGRES_DSN = f"postgresql+psycopg://{DATABASE_USER}:{DATABASE_PASSWORD}@{DATABASE_HOST}:{DATABASE_PORT}/{DATABASE_NAME}"
 
 
-class __Settings(BaseSettings):
+class DatabaseSettings(BaseSettings):
     database_url: str = DEFAULT_POSTGRES_DSN
+    database_create_tables_on_startup: bool = True
+    database_owner_partitions: int = 16
+    database_replica_urls: list[str] = []
+    database_read_your_writes_seconds: float = 5.0
+    database_replica_max_lag_seconds: float = 2.0
+    database_replica_lag_check_interval_seconds: float = 5.0
 
 
-settings = __Settings()  # type: ignore
+settings: "Settings" = lazy_settings()
@@ -1,32 +1,290 @@
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
 from typing import Protocol
 
-from sqlalchemy import Engine
-from sqlmodel import SQLModel, create_engine
+from common.deadlines import Deadline
+from pydantic import BaseModel
+from sqlalchemy import Connection, Engine, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlmodel import SQLModel, Session, create_engine
 
 from database.conf import settings
+from database.read_your_writes import (
+    ReadScope,
+    client_wrote_within,
+    record_client_write,
+)
+
+logger = logging.getLogger(__name__)
+
+# What a write marks as fresh: a scope of one owner, or one of its rooms
+WriteKey = tuple[ReadScope, uuid.UUID, uuid.UUID | None]
+
+# Table options of the per-owner tables, whose rows are spread over
+# `database_owner_partitions` hash partitions on Postgres
+OWNER_HASH_PARTITIONED = {"postgresql_partition_by": "HASH (owner_id)"}
+
+# Seconds since the last replayed transaction, or 0 when fully caught up
+POSTGRES_REPLICA_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+    "END"
+)
 
 
 class Databaseable(Protocol):
+    # The writer, also used for reads that must see the latest writes
     engine: Engine
 
+    def reader_engine(
+        self, scope: ReadScope, owner_id: uuid.UUID, room_id: uuid.UUID | None = None
+    ) -> Engine: ...
 
-class BaseDatabase:
+    def record_write(
+        self, scope: ReadScope, owner_id: uuid.UUID, room_id: uuid.UUID | None = None
+    ) -> None: ...
+
+    def replicas_stats(self) -> list["ReplicaStats"]: ...
+
+    async def start(self) -> None: ...
+
+    async def stop(self) -> None: ...
+
+
+class ReplicaStats(BaseModel):
+    url: str
+    healthy: bool
+    lag_seconds: float | None
+    checked_seconds_ago: float | None
+
+
+class Replica:
     def __init__(self, engine: Engine) -> None:
         self.engine = engine
+        self.healthy = False
+        self.lag_seconds: float | None = None
+        self.checked_at: float | None = None
+
+    def stats(self) -> ReplicaStats:
+        return ReplicaStats(
+            url=self.engine.url.render_as_string(hide_password=True),
+            healthy=self.healthy,
+            lag_seconds=self.lag_seconds,
+            checked_seconds_ago=(
+                None if self.checked_at is None else time.monotonic() - self.checked_at
+            ),
+        )
+
+
+class BaseDatabase:
+    """
+    A writer engine plus optional read replicas. Reads go to a healthy replica
+    unless what they read was written within the read-your-writes window, by
+    this worker or, as its `last_write` cookie tells, by the same client on
+    any worker. Replica lag is checked in the background, replicas lagging
+    more than allowed are left out until they catch up.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        replica_engines: list[Engine] | None = None,
+        read_your_writes_seconds: float = 0.0,
+        replica_max_lag_seconds: float = 0.0,
+        replica_lag_check_interval_seconds: float = 0.0,
+    ) -> None:
+        self.engine = engine
+        self.replicas = [Replica(engine) for engine in replica_engines or []]
+        self.read_your_writes_seconds = read_your_writes_seconds
+        self.replica_max_lag_seconds = replica_max_lag_seconds
+        self.replica_lag_check_interval_seconds = replica_lag_check_interval_seconds
+
+        # Oldest write first, expired ones are dropped from the front
+        self.__written_at: OrderedDict[WriteKey, float] = OrderedDict()
+        self.__next_replica = 0
+        self.__lock = threading.Lock()
+        self.__lag_checker: asyncio.Task[None] | None = None
+
+    def reader_engine(
+        self, scope: ReadScope, owner_id: uuid.UUID, room_id: uuid.UUID | None = None
+    ) -> Engine:
+        if not self.replicas:
+            return self.engine
+
+        if client_wrote_within(scope, self.read_your_writes_seconds):
+            return self.engine
+
+        now = time.monotonic()
+        with self.__lock:
+            for key in {(scope, owner_id, None), (scope, owner_id, room_id)}:
+                written_at = self.__written_at.get(key)
+                if (
+                    written_at is not None
+                    and now - written_at < self.read_your_writes_seconds
+                ):
+                    return self.engine
+
+            healthy_replicas = [replica for replica in self.replicas if replica.healthy]
+            if not healthy_replicas:
+                return self.engine
+
+            self.__next_replica = (self.__next_replica + 1) % len(healthy_replicas)
+
+            return healthy_replicas[self.__next_replica].engine
+
+    def record_write(
+        self, scope: ReadScope, owner_id: uuid.UUID, room_id: uuid.UUID | None = None
+    ) -> None:
+        record_client_write(scope, time.time())
+        if not self.replicas:
+            return
+
+        now = time.monotonic()
+        with self.__lock:
+            # A room write also freshens reads that don't know their room yet
+            for key in {(scope, owner_id, None), (scope, owner_id, room_id)}:
+                self.__written_at.pop(key, None)
+                self.__written_at[key] = now
+
+            while self.__written_at:
+                oldest_key, written_at = next(iter(self.__written_at.items()))
+                if now - written_at < self.read_your_writes_seconds:
+                    break
+                del self.__written_at[oldest_key]
+
+    def replicas_stats(self) -> list[ReplicaStats]:
+        return [replica.stats() for replica in self.replicas]
+
+    def check_replicas_lag(self) -> None:
+        for replica in self.replicas:
+            lag_seconds = _replica_lag_seconds(replica.engine)
+            replica.lag_seconds = lag_seconds
+            replica.healthy = (
+                lag_seconds is not None and lag_seconds <= self.replica_max_lag_seconds
+            )
+            replica.checked_at = time.monotonic()
+
+    async def start(self) -> None:
+        if not self.replicas:
+            return
+
+        assert self.__lag_checker is None
+
+        self.__lag_checker = asyncio.create_task(self.__run_lag_checker())
+
+    async def stop(self) -> None:
+        if self.__lag_checker is None:
+            return
+
+        self.__lag_checker.cancel()
+        try:
+            await self.__lag_checker
+        except asyncio.CancelledError:
+            pass
+        self.__lag_checker = None
+
+    async def __run_lag_checker(self) -> None:
+        # Replicas count as unhealthy until their first check, reads go to the
+        # writer meanwhile
+        while True:
+            try:
+                await asyncio.to_thread(self.check_replicas_lag)
+            except Exception:
+                logger.exception("Failed to check the replicas lag")
+
+            await asyncio.sleep(self.replica_lag_check_interval_seconds)
+
+
+def _replica_lag_seconds(engine: Engine) -> float | None:
+    try:
+        with engine.connect() as connection:
+            if connection.dialect.name != "postgresql":
+                # Stand-ins such as a SQLite copy have no replication to lag
+                connection.execute(text("SELECT 1"))
+                return 0.0
+
+            return float(connection.execute(POSTGRES_REPLICA_LAG_QUERY).scalar_one())
+    except SQLAlchemyError as e:
+        logger.warning("Replica lag check failed for %s: %s", engine.url, e)
+        return None
 
 
 def create_db_and_tables(database: Databaseable) -> None:
+    from checkpoints.models import GraphCheckpoint  # noqa: F401
     from llm.models import ChatRoom  # noqa: F401
     from todos.models import Todo  # noqa: F401
+    from usage.models import LLMUsageRecord  # noqa: F401
+
+    with database.engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            # Back the trigram index used for todo title search, led by the
+            # owner's uuid which needs btree_gin to be part of a GIN index
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS btree_gin"))
 
     SQLModel.metadata.create_all(database.engine)
 
+    with database.engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            create_owner_partitions(connection, settings.database_owner_partitions)
+
+
+def create_owner_partitions(connection: Connection, partitions: int) -> None:
+    """
+    Postgres only routes rows of a partitioned table to partitions that exist,
+    so every hash partitioned table gets its partitions right after creation.
+    The count can't change afterwards without rewriting the table.
+    """
+    for table in SQLModel.metadata.sorted_tables:
+        if not table.dialect_options["postgresql"].get("partition_by"):
+            continue
+
+        for remainder in range(partitions):
+            connection.execute(
+                text(
+                    f'CREATE TABLE IF NOT EXISTS "{table.name}_p{remainder}" '
+                    f'PARTITION OF "{table.name}" '
+                    f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+                )
+            )
+
+
+def apply_deadline(session: Session, deadline: Deadline | None) -> None:
+    """
+    Fail fast when the request deadline already passed, otherwise bound the
+    statements of the session's current transaction by what is left of it.
+    """
+    if deadline is None:
+        return
+
+    deadline.check()
+
+    if session.get_bind().dialect.name == "postgresql":
+        statement_timeout_ms = max(int(deadline.remaining_seconds * 1000), 1)
+        session.execute(text(f"SET LOCAL statement_timeout = {statement_timeout_ms}"))
+
 
 class Database(BaseDatabase):
     def __init__(self) -> None:
         engine = create_engine(settings.database_url, echo=True)
+        replica_engines = [
+            create_engine(replica_url, echo=True)
+            for replica_url in settings.database_replica_urls
+        ]
 
-        super().__init__(engine=engine)
+        super().__init__(
+            engine=engine,
+            replica_engines=replica_engines,
+            read_your_writes_seconds=settings.database_read_your_writes_seconds,
+            replica_max_lag_seconds=settings.database_replica_max_lag_seconds,
+            replica_lag_check_interval_seconds=(
+                settings.database_replica_lag_check_interval_seconds
+            ),
+        )
 
 
 __database: Database | None = None
@@ -35,12 +293,9 @@ __database: Database | None = None
 def get_database() -> Databaseable:
     global __database
 
+    # Creating the engine does not connect, tables are created on startup or
+    # with `python -m database`, see `create_db_and_tables`
     if __database is None:
         __database = Database()
-        create_db_and_tables(__database)
 
     return __database
-
-
-if settings.database_url.startswith("postgresql+psycopg"):
-    get_database()
@@ -0,0 +1,129 @@
+import contextvars
+import time
+from http.cookies import SimpleCookie
+from typing import Literal, get_args
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Reads of a scope go to the writer for a while after the scope was written
+ReadScope = Literal["chat_room", "todo", "usage"]
+
+READ_SCOPES: tuple[ReadScope, ...] = get_args(ReadScope)
+
+LAST_WRITE_COOKIE = "last_write"
+LAST_WRITE_HEADER = "x-last-write"
+
+
+class ClientWrites:
+    """
+    When the client of the current request last wrote each scope, wall clock
+    seconds, as carried by its `last_write` cookie or `X-Last-Write` header.
+    Travelling with the client, it holds on whichever worker serves the next
+    read, not only on the one that took the write.
+    """
+
+    def __init__(self, written_at: dict[ReadScope, float]) -> None:
+        self.written_at = written_at
+        self.changed = False
+
+    @classmethod
+    def parse(cls, value: str | None) -> "ClientWrites":
+        written_at: dict[ReadScope, float] = {}
+        for part in (value or "").split("|"):
+            scope, _, timestamp = part.partition(":")
+            if scope not in READ_SCOPES:
+                continue
+            try:
+                written_at[scope] = float(timestamp)
+            except ValueError:
+                continue
+
+        return cls(written_at)
+
+    def record(self, scope: ReadScope, written_at: float) -> None:
+        self.written_at[scope] = written_at
+        self.changed = True
+
+    def serialize(self) -> str:
+        return "|".join(
+            f"{scope}:{written_at:.3f}" for scope, written_at in self.written_at.items()
+        )
+
+
+current_client_writes: contextvars.ContextVar[ClientWrites | None] = (
+    contextvars.ContextVar("current_client_writes", default=None)
+)
+
+
+def client_wrote_within(scope: ReadScope, seconds: float) -> bool:
+    client_writes = current_client_writes.get()
+    if client_writes is None:
+        return False
+
+    written_at = client_writes.written_at.get(scope)
+
+    return written_at is not None and time.time() - written_at < seconds
+
+
+def record_client_write(scope: ReadScope, written_at: float) -> None:
+    client_writes = current_client_writes.get()
+    if client_writes is not None:
+        client_writes.record(scope, written_at)
+
+
+class ReadYourWritesMiddleware:
+    """
+    Reads the client's last writes from its cookie or header before the
+    request, and sends them back updated when the request wrote.
+    """
+
+    def __init__(self, app: ASGIApp, max_age_seconds: float) -> None:
+        self.app = app
+        self.max_age_seconds = max_age_seconds
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        client_writes = ClientWrites.parse(_last_write(scope))
+
+        async def send_with_last_write(message: Message) -> None:
+            if message["type"] == "http.response.start" and client_writes.changed:
+                value = client_writes.serialize()
+                headers = list(message.get("headers", []))
+                headers.append((LAST_WRITE_HEADER.encode(), value.encode()))
+                headers.append(
+                    (
+                        b"set-cookie",
+                        (
+                            f"{LAST_WRITE_COOKIE}={value}; "
+                            f"Max-Age={max(int(self.max_age_seconds), 1)}; "
+                            "Path=/; HttpOnly; SameSite=Lax"
+                        ).encode(),
+                    )
+                )
+                message = {**message, "headers": headers}
+
+            await send(message)
+
+        token = current_client_writes.set(client_writes)
+        try:
+            await self.app(scope, receive, send_with_last_write)
+        finally:
+            current_client_writes.reset(token)
+
+
+def _last_write(scope: Scope) -> str | None:
+    cookie_value: str | None = None
+    for name, value in scope["headers"]:
+        if name == LAST_WRITE_HEADER.encode():
+            # Explicit header wins, e.g. of clients without cookies
+            return str(value.decode("latin-1"))
+        if name == b"cookie":
+            cookies: SimpleCookie = SimpleCookie()
+            cookies.load(value.decode("latin-1"))
+            if LAST_WRITE_COOKIE in cookies:
+                cookie_value = cookies[LAST_WRITE_COOKIE].value
+
+    return cookie_value
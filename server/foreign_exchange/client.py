@@ -1,7 +1,11 @@
+import asyncio
 import os
+import time
 import urllib
 
 import aiohttp
+from common.deadlines import Deadline, DeadlineExceededError
+from common.recording import current_cassette, record_forex_call
 
 from foreign_exchange.conf import settings
 from foreign_exchange.currencies import Currencies
@@ -9,15 +13,92 @@ from foreign_exchange.responses import RatesResponse
 
 
 class ForeignExchangeClient:
-    async def get_rates(self, base: Currencies) -> RatesResponse:
-        async with aiohttp.ClientSession() as session:
+    """
+    With `rates_ttl_seconds` above zero the rates of a base are cached that
+    long and concurrent requests for the same base share one fetch, so a
+    batch asking for the same currencies over and over fetches each once.
+    The shared fetch runs on its own `shared_fetch_timeout_seconds`, not on
+    the deadline of whichever caller started it, and every caller waits for
+    it only until its own deadline.
+    """
+
+    def __init__(
+        self, rates_ttl_seconds: float = 0, shared_fetch_timeout_seconds: float = 10.0
+    ) -> None:
+        self.rates_ttl_seconds = rates_ttl_seconds
+        self.shared_fetch_timeout_seconds = shared_fetch_timeout_seconds
+
+        self.__rates: dict[Currencies, tuple[float, RatesResponse]] = {}
+        self.__fetches: dict[Currencies, asyncio.Task[RatesResponse]] = {}
+
+    async def get_rates(
+        self, base: Currencies, deadline: Deadline | None = None
+    ) -> RatesResponse:
+        cassette = current_cassette.get()
+        if cassette is not None:
+            return RatesResponse(**await cassette.forex_call(base))
+
+        if self.rates_ttl_seconds <= 0:
+            return await self.__fetch_rates(base=base, deadline=deadline)
+
+        cached = self.__rates.get(base)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        fetch = self.__fetches.get(base)
+        if fetch is None:
+            fetch = asyncio.create_task(self.__fetch_and_cache_rates(base=base))
+            self.__fetches[base] = fetch
+            fetch.add_done_callback(lambda _: self.__fetches.pop(base, None))
+
+        # A caller giving up doesn't cancel the fetch the others wait on
+        if deadline is None:
+            return await asyncio.shield(fetch)
+
+        deadline.check()
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(fetch), timeout=deadline.remaining_seconds
+            )
+        except TimeoutError as e:
+            if fetch.done():
+                # The fetch itself timed out, not this caller
+                raise
+
+            raise DeadlineExceededError from e
+
+    async def __fetch_and_cache_rates(self, base: Currencies) -> RatesResponse:
+        rates = await self.__fetch_rates(
+            base=base,
+            deadline=Deadline.from_timeout(self.shared_fetch_timeout_seconds),
+        )
+        self.__rates[base] = (time.monotonic() + self.rates_ttl_seconds, rates)
+
+        return rates
+
+    async def __fetch_rates(
+        self, base: Currencies, deadline: Deadline | None
+    ) -> RatesResponse:
+        timeout = aiohttp.ClientTimeout()
+        if deadline is not None:
+            deadline.check()
+            timeout = aiohttp.ClientTimeout(total=deadline.remaining_seconds)
+
+        start = time.perf_counter()
+        async with aiohttp.ClientSession(timeout=timeout) as session:
             async with session.get(
                 f"{self.__url}?{urllib.parse.urlencode({'base': base})}"
             ) as response:
                 response.raise_for_status()
                 json_data = await response.json()
 
-                return RatesResponse(**json_data)
+        record_forex_call(
+            base=base,
+            latency_seconds=time.perf_counter() - start,
+            response=json_data,
+        )
+
+        return RatesResponse(**json_data)
 
     @property
     def __url(self) -> str:
@@ -1,9 +1,19 @@
-from common.conf import BaseSettings
+from typing import TYPE_CHECKING
+
+from common.conf import BaseSettings, lazy_settings
 from pydantic import HttpUrl
 
+if TYPE_CHECKING:
+    from agents_play.conf import Settings
+
 
-class __Settings(BaseSettings):
+class ForeignExchangeSettings(BaseSettings):
     forex_base_api_url: HttpUrl
+    # Off by default, recorded traffic expects every rates call to be made
+    forex_rates_cache_ttl_seconds: float = 0
+    # Of a fetch shared by concurrent callers, each still waits only as long
+    # as its own deadline allows
+    forex_shared_fetch_timeout_seconds: float = 10.0
 
 
-settings = __Settings()  # type: ignore
+settings: "Settings" = lazy_settings()
@@ -1,12 +1,14 @@
 import json
-from typing import Literal, Self, cast
+import logging
+from typing import Literal, Self, TypedDict, cast
 
+from common.agents import routed_agent
+from common.deadlines import Deadline, deadline_config, get_deadline
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph
-from langgraph.prebuilt import create_react_agent
 from langgraph.types import Command as LanggraphCommand
 from pydantic import BaseModel
 
-from foreign_exchange.conf import settings
 from foreign_exchange.currencies import (
     CURRENCIES,
     Currencies,
@@ -14,7 +16,7 @@ from foreign_exchange.currencies import (
 from foreign_exchange.prompts import determine_currency_prompt
 from foreign_exchange.tools import get_exchange_rates_tool
 
-assert settings.openai_api_key
+logger = logging.getLogger(__name__)
 
 
 ForeignExchangeGraphNodes = Literal[
@@ -27,6 +29,12 @@ ForeignExchangeGraphNodes = Literal[
 ForeignExchangeGraphCommand = LanggraphCommand[ForeignExchangeGraphNodes]
 
 
+class ForeignExchangeGraphConfig(TypedDict):
+    deadline: Deadline | None
+    # Ask on stdin when the request is empty, only for runs from a terminal
+    interactive: bool
+
+
 class ForeignExchangeGraphState(BaseModel):
     raw_user_input: str | None
     user_currency_input: Currencies | None
@@ -58,13 +66,11 @@ class ForeignExchangeGraphState(BaseModel):
         return new_state
 
 
-gpt4o_mini_agent = create_react_agent(
-    "openai:gpt-4o-mini", tools=[get_exchange_rates_tool]
-)
+currency_agent = routed_agent("currency", "extraction", tools=[get_exchange_rates_tool])
 
 
 def get_user_currency_input_node(
-    state: ForeignExchangeGraphState,
+    state: ForeignExchangeGraphState, config: RunnableConfig
 ) -> ForeignExchangeGraphCommand:
     user_currency_input = state.raw_user_input
     if user_currency_input:
@@ -72,12 +78,13 @@ def get_user_currency_input_node(
             update=state, goto="determine_currency_and_get_rates_node"
         )
 
-    try:
-        user_currency_input = input(
-            "Which currency do you want to know the rates of today?\n"
-        ).strip()
-    except Exception:
-        pass
+    if _is_interactive(config):
+        try:
+            user_currency_input = input(
+                "Which currency do you want to know the rates of today?\n"
+            ).strip()
+        except Exception:
+            pass
 
     if not user_currency_input:
         return ForeignExchangeGraphCommand(
@@ -90,16 +97,21 @@ def get_user_currency_input_node(
     )
 
 
-def failure_node(state: ForeignExchangeGraphState) -> ForeignExchangeGraphState:
+def failure_node(
+    state: ForeignExchangeGraphState, config: RunnableConfig
+) -> ForeignExchangeGraphState:
     assert state.failure_message
 
-    print(state.failure_message)
+    if _is_interactive(config):
+        print(state.failure_message)
+    else:
+        logger.info("Foreign exchange request failed: %s", state.failure_message)
 
     return state
 
 
 async def determine_currency_and_get_rates_node(
-    state: ForeignExchangeGraphState,
+    state: ForeignExchangeGraphState, config: RunnableConfig
 ) -> ForeignExchangeGraphCommand:
     """
     Use the AI model with the exchange rates tool to:
@@ -114,8 +126,9 @@ async def determine_currency_and_get_rates_node(
     )
 
     try:
-        response = await gpt4o_mini_agent.ainvoke(
-            {"messages": [{"role": "user", "content": currency_and_rates_prompt}]}
+        response = await currency_agent.ainvoke(
+            {"messages": [{"role": "user", "content": currency_and_rates_prompt}]},
+            config=deadline_config(get_deadline(config)),
         )
     except Exception as e:
         return ForeignExchangeGraphCommand(
@@ -157,7 +170,7 @@ def end_node(state: ForeignExchangeGraphState) -> ForeignExchangeGraphState:
 
 
 foreign_exchange_graph = (
-    StateGraph(ForeignExchangeGraphState)
+    StateGraph(ForeignExchangeGraphState, config_schema=ForeignExchangeGraphConfig)
     .add_node("get_user_currency_input_node", get_user_currency_input_node)
     .add_node("failure_node", failure_node)
     .add_node(
@@ -171,15 +184,24 @@ foreign_exchange_graph = (
 )
 
 
-async def foreign_exchange_rate_invoke(request: str) -> ForeignExchangeGraphState:
+def _is_interactive(config: RunnableConfig) -> bool:
+    return bool(config.get("configurable", {}).get("interactive", False))
+
+
+async def foreign_exchange_rate_invoke(
+    request: str, deadline: Deadline | None = None, interactive: bool = False
+) -> ForeignExchangeGraphState:
     foreign_exchange_initial_state = ForeignExchangeGraphState(
         raw_user_input=request,
         user_currency_input=None,
         failure_message=None,
         rates={},
     )
+    config = deadline_config(deadline)
+    config["configurable"]["interactive"] = interactive
     end_state = await foreign_exchange_graph.ainvoke(
-        input=foreign_exchange_initial_state  # type: ignore
+        input=foreign_exchange_initial_state,  # type: ignore
+        config=config,
     )
 
     return ForeignExchangeGraphState(**end_state)
@@ -1,15 +1,32 @@
 from typing import cast
 
+from common.deadlines import get_deadline
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
 
 from foreign_exchange.client import ForeignExchangeClient
+from foreign_exchange.conf import settings
 from foreign_exchange.currencies import CURRENCIES, Currencies
 
-foreign_exchange_client = ForeignExchangeClient()
+__foreign_exchange_client: ForeignExchangeClient | None = None
+
+
+def get_foreign_exchange_client() -> ForeignExchangeClient:
+    global __foreign_exchange_client
+
+    if __foreign_exchange_client is None:
+        __foreign_exchange_client = ForeignExchangeClient(
+            rates_ttl_seconds=settings.forex_rates_cache_ttl_seconds,
+            shared_fetch_timeout_seconds=settings.forex_shared_fetch_timeout_seconds,
+        )
+
+    return __foreign_exchange_client
 
 
 @tool
-async def get_exchange_rates_tool(base_currency: str) -> dict[Currencies, float]:
+async def get_exchange_rates_tool(
+    base_currency: str, config: RunnableConfig
+) -> dict[Currencies, float]:
     """Get current foreign exchange rates for a base currency.
 
     Args:
@@ -29,7 +46,9 @@ async def get_exchange_rates_tool(base_currency: str) -> dict[Currencies, float]
     validated_base_currency = cast(Currencies, base_currency_upper)
 
     try:
-        response = await foreign_exchange_client.get_rates(base=validated_base_currency)
+        response = await get_foreign_exchange_client().get_rates(
+            base=validated_base_currency, deadline=get_deadline(config)
+        )
     except Exception as e:
         raise RuntimeError(
             f"Failed to get exchange rates for '{base_currency}': {str(e)}"
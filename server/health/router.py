@@ -1,9 +1,26 @@
-from typing import Literal
+import uuid
+from typing import Annotated, Literal
 
-from fastapi import APIRouter
+from common.agents import LLMModelStats, get_agent_registry
+from common.conf import settings
+from common.exceptions import AgentsPlayNotFoundError
+from common.llm_clients import LLMHttpPoolStats, get_llm_client_factory
+from common.loop_monitor import LoopMonitorStats, get_loop_monitor
+from common.profiling import (
+    PROFILE_TOKEN_HEADER,
+    ProfileFormat,
+    is_profile_token_valid,
+    profile_path,
+)
+from common.schemas import OKResponse
+from database.database import ReplicaStats, get_database
+from fastapi import APIRouter, Header
+from fastapi.responses import FileResponse, ORJSONResponse
+from llm.admission import AdmissionStats, get_admission_controller
+from llm.write_behind import ChatTurnsWriteBehindStats, get_chat_turns_write_behind
 from pydantic import BaseModel
 
-health_router = APIRouter(prefix="/health")
+health_router = APIRouter(prefix="/health", default_response_class=ORJSONResponse)
 
 
 class PingResponse(BaseModel):
@@ -13,3 +30,95 @@ class PingResponse(BaseModel):
 @health_router.get("/ping")
 async def ping() -> PingResponse:
     return PingResponse(message="PONG")
+
+
+class LLMModelsStatsResponse(OKResponse):
+    data: list[LLMModelStats]
+
+
+@health_router.get("/llm-models")
+async def llm_models_stats() -> LLMModelsStatsResponse:
+    return LLMModelsStatsResponse(
+        detail="OK", data=get_agent_registry().stats_snapshot()
+    )
+
+
+class LLMHttpPoolStatsResponse(OKResponse):
+    data: LLMHttpPoolStats
+
+
+@health_router.get("/llm-http-pool")
+async def llm_http_pool_stats() -> LLMHttpPoolStatsResponse:
+    return LLMHttpPoolStatsResponse(detail="OK", data=get_llm_client_factory().stats())
+
+
+class EventLoopStatsResponse(OKResponse):
+    enabled: bool
+    data: LoopMonitorStats | None
+
+
+@health_router.get("/event-loop")
+async def event_loop_stats() -> EventLoopStatsResponse:
+    loop_monitor = get_loop_monitor()
+    if loop_monitor is None:
+        return EventLoopStatsResponse(detail="OK", enabled=False, data=None)
+
+    return EventLoopStatsResponse(detail="OK", enabled=True, data=loop_monitor.stats())
+
+
+class WriteBehindStatsResponse(OKResponse):
+    enabled: bool
+    data: ChatTurnsWriteBehindStats | None
+
+
+@health_router.get("/write-behind")
+async def write_behind_stats() -> WriteBehindStatsResponse:
+    chat_turns_write_behind = get_chat_turns_write_behind()
+    if chat_turns_write_behind is None:
+        return WriteBehindStatsResponse(detail="OK", enabled=False, data=None)
+
+    return WriteBehindStatsResponse(
+        detail="OK", enabled=True, data=chat_turns_write_behind.stats()
+    )
+
+
+class AdmissionStatsResponse(OKResponse):
+    data: AdmissionStats
+
+
+@health_router.get("/admission")
+async def admission_stats() -> AdmissionStatsResponse:
+    return AdmissionStatsResponse(detail="OK", data=get_admission_controller().stats())
+
+
+class DatabaseReplicasStatsResponse(OKResponse):
+    data: list[ReplicaStats]
+
+
+@health_router.get("/database-replicas")
+async def database_replicas_stats() -> DatabaseReplicasStatsResponse:
+    return DatabaseReplicasStatsResponse(
+        detail="OK", data=get_database().replicas_stats()
+    )
+
+
+PROFILE_MEDIA_TYPES: dict[ProfileFormat, str] = {
+    "speedscope": "application/json",
+    "collapsed": "text/plain",
+}
+
+
+@health_router.get("/profiles/{request_id}", response_class=FileResponse)
+async def request_profile(
+    request_id: uuid.UUID,
+    profile_token: Annotated[str | None, Header(alias=PROFILE_TOKEN_HEADER)] = None,
+    format: ProfileFormat = "speedscope",
+) -> FileResponse:
+    if not is_profile_token_valid(profile_token):
+        raise AgentsPlayNotFoundError
+
+    path = profile_path(settings.profiling_directory, request_id.hex, format)
+    if not path.exists():
+        raise AgentsPlayNotFoundError
+
+    return FileResponse(path, media_type=PROFILE_MEDIA_TYPES[format])
@@ -0,0 +1,172 @@
+import asyncio
+import math
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Literal
+
+from common.exceptions import AgentsPlayServiceUnavailableError
+from pydantic import BaseModel
+
+from llm.conf import settings
+
+RUN_SECONDS_EWMA_ALPHA = 0.2
+
+# Cheap requests never reach a model, so they are let in ahead of the others
+AdmissionPriority = Literal["cheap", "expensive"]
+
+ADMISSION_PRIORITIES: tuple[AdmissionPriority, ...] = ("cheap", "expensive")
+
+
+class AdmissionStats(BaseModel):
+    max_in_flight: int
+    max_wait_seconds: float
+    in_flight: int
+    queue_depth: dict[AdmissionPriority, int]
+    admitted: dict[AdmissionPriority, int]
+    shed: dict[AdmissionPriority, int]
+    timed_out: dict[AdmissionPriority, int]
+    run_seconds_ewma: float | None
+    wait_seconds_ewma: float | None
+
+
+class AdmissionController:
+    """
+    Bounds the chat turns running at once. Turns over the limit queue for a
+    slot, cheap ones ahead of expensive ones, and a turn is shed up front when
+    the wait estimated from the queue ahead of it and the observed run time
+    exceeds the SLO, instead of queueing until its client gave up anyway.
+    """
+
+    def __init__(self, max_in_flight: int, max_wait_seconds: float) -> None:
+        assert max_in_flight > 0
+
+        self.max_in_flight = max_in_flight
+        self.max_wait_seconds = max_wait_seconds
+        self.in_flight = 0
+        self.run_seconds_ewma: float | None = None
+        self.wait_seconds_ewma: float | None = None
+        self.admitted = dict.fromkeys(ADMISSION_PRIORITIES, 0)
+        self.shed = dict.fromkeys(ADMISSION_PRIORITIES, 0)
+        self.timed_out = dict.fromkeys(ADMISSION_PRIORITIES, 0)
+
+        self.__waiters: dict[AdmissionPriority, deque[asyncio.Future[None]]] = {
+            priority: deque() for priority in ADMISSION_PRIORITIES
+        }
+
+    def estimated_wait_seconds(self, priority: AdmissionPriority) -> float:
+        if self.in_flight < self.max_in_flight:
+            return 0.0
+        if self.run_seconds_ewma is None:
+            # Nothing finished yet to estimate from, the queue timeout applies
+            return 0.0
+
+        ahead = len(self.__waiters["cheap"])
+        if priority == "expensive":
+            ahead += len(self.__waiters["expensive"])
+
+        # Every slot frees up about once per run, the requests ahead and this
+        # one need that many slots
+        return (ahead + 1) / self.max_in_flight * self.run_seconds_ewma
+
+    @asynccontextmanager
+    async def admit(self, priority: AdmissionPriority) -> AsyncIterator[None]:
+        estimated_wait_seconds = self.estimated_wait_seconds(priority)
+        if estimated_wait_seconds > self.max_wait_seconds:
+            self.shed[priority] += 1
+            raise AgentsPlayServiceUnavailableError(
+                retry_after_seconds=math.ceil(estimated_wait_seconds)
+            )
+
+        wait_start = time.monotonic()
+        if self.in_flight < self.max_in_flight:
+            self.in_flight += 1
+        else:
+            await self.__wait_for_slot(priority)
+
+        self.admitted[priority] += 1
+        self.wait_seconds_ewma = _ewma(
+            self.wait_seconds_ewma, time.monotonic() - wait_start
+        )
+
+        run_start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.run_seconds_ewma = _ewma(
+                self.run_seconds_ewma, time.monotonic() - run_start
+            )
+            self.__release()
+
+    def stats(self) -> AdmissionStats:
+        return AdmissionStats(
+            max_in_flight=self.max_in_flight,
+            max_wait_seconds=self.max_wait_seconds,
+            in_flight=self.in_flight,
+            queue_depth={
+                priority: len(waiters) for priority, waiters in self.__waiters.items()
+            },
+            admitted=dict(self.admitted),
+            shed=dict(self.shed),
+            timed_out=dict(self.timed_out),
+            run_seconds_ewma=self.run_seconds_ewma,
+            wait_seconds_ewma=self.wait_seconds_ewma,
+        )
+
+    async def __wait_for_slot(self, priority: AdmissionPriority) -> None:
+        slot = asyncio.get_running_loop().create_future()
+        waiters = self.__waiters[priority]
+        waiters.append(slot)
+        try:
+            async with asyncio.timeout(self.max_wait_seconds):
+                await slot
+        except BaseException as e:
+            if slot in waiters:
+                waiters.remove(slot)
+            elif slot.done() and not slot.cancelled():
+                # Handed a slot just as we gave up, pass it on
+                self.__release()
+
+            if isinstance(e, TimeoutError):
+                self.timed_out[priority] += 1
+                raise AgentsPlayServiceUnavailableError(
+                    retry_after_seconds=math.ceil(
+                        self.estimated_wait_seconds(priority) or self.max_wait_seconds
+                    )
+                )
+            raise
+
+    def __release(self) -> None:
+        # The slot goes straight to the next waiter, so in_flight stays put
+        for priority in ADMISSION_PRIORITIES:
+            waiters = self.__waiters[priority]
+            while waiters:
+                slot = waiters.popleft()
+                if not slot.done():
+                    slot.set_result(None)
+                    return
+
+        self.in_flight -= 1
+
+
+def _ewma(current: float | None, value: float) -> float:
+    if current is None:
+        return value
+
+    return RUN_SECONDS_EWMA_ALPHA * value + (1 - RUN_SECONDS_EWMA_ALPHA) * current
+
+
+__admission_controller: AdmissionController | None = None
+
+
+def get_admission_controller() -> AdmissionController:
+    global __admission_controller
+
+    if __admission_controller is None:
+        __admission_controller = AdmissionController(
+            max_in_flight=settings.llm_admission_max_in_flight,
+            max_wait_seconds=settings.llm_admission_max_wait_seconds,
+        )
+
+    return __admission_controller
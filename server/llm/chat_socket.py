@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import time
+
+from common.events import ChatEvent, current_chat_events
+from common.exceptions import (
+    AgentsPlayBadRequestError,
+    AgentsPlayError,
+    AgentsPlayGeneralError,
+    AgentsPlayTooManyRequestsError,
+)
+from fastapi import WebSocket, status
+from pydantic import ValidationError
+
+from llm.conf import settings
+from llm.controller import ChatConnectionState, LLMControllable
+from llm.schemas import (
+    ChatSocketCancelFrame,
+    ChatSocketMessageFrame,
+    ChatSocketPingFrame,
+    ChatSocketServerFrame,
+    chat_socket_client_frame_adapter,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ChatSocket:
+    """
+    One client connection carrying any number of chat turns, each tagged by
+    the id the client gave its message. The room stays loaded between turns,
+    and the events of every turn are pushed as they happen.
+
+    Frames to the client go through a bounded queue, so turns producing
+    faster than the client reads wait for it, and a client that stops
+    reading for too long, or stops answering pings, is disconnected.
+    """
+
+    def __init__(self, websocket: WebSocket, controller: LLMControllable) -> None:
+        self.websocket = websocket
+        self.controller = controller
+        self.connection_state = ChatConnectionState()
+        self.__outbox: asyncio.Queue[ChatSocketServerFrame] = asyncio.Queue(
+            maxsize=settings.llm_ws_send_queue_size
+        )
+        self.__turns: dict[str, asyncio.Task[None]] = {}
+        self.__last_received_at = time.monotonic()
+
+    async def serve(self) -> None:
+        await self.websocket.accept()
+
+        receiver = asyncio.create_task(self.__run_receiver())
+        sender = asyncio.create_task(self.__run_sender())
+        heartbeat = asyncio.create_task(self.__run_heartbeat())
+        try:
+            done, _ = await asyncio.wait(
+                [receiver, sender, heartbeat], return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            for task in [receiver, sender, heartbeat, *self.__turns.values()]:
+                task.cancel()
+            await asyncio.gather(
+                receiver,
+                sender,
+                heartbeat,
+                *self.__turns.values(),
+                return_exceptions=True,
+            )
+
+        if receiver in done:
+            # The client went away, there is nobody left to close for
+            return
+
+        close_code = status.WS_1001_GOING_AWAY
+        if sender in done:
+            close_code = status.WS_1013_TRY_AGAIN_LATER
+        try:
+            await self.websocket.close(code=close_code)
+        except RuntimeError:
+            # Already closed underneath us
+            pass
+
+    async def __run_receiver(self) -> None:
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+            self.__last_received_at = time.monotonic()
+            text = message.get("text")
+            if text is None:
+                await self.__send_error(None, AgentsPlayBadRequestError())
+                continue
+
+            try:
+                frame = chat_socket_client_frame_adapter.validate_json(text)
+            except ValidationError:
+                await self.__send_error(None, AgentsPlayBadRequestError())
+                continue
+
+            if isinstance(frame, ChatSocketMessageFrame):
+                await self.__start_turn(frame)
+            elif isinstance(frame, ChatSocketCancelFrame):
+                await self.__cancel_turn(frame.id)
+            elif isinstance(frame, ChatSocketPingFrame):
+                await self.__send(ChatSocketServerFrame(type="pong"))
+
+    async def __run_sender(self) -> None:
+        while True:
+            frame = await self.__outbox.get()
+            try:
+                async with asyncio.timeout(settings.llm_ws_send_timeout_seconds):
+                    await self.websocket.send_text(
+                        frame.model_dump_json(exclude_none=True)
+                    )
+            except TimeoutError:
+                logger.warning("Closing chat socket of a client not reading")
+                return
+
+    async def __run_heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(settings.llm_ws_heartbeat_interval_seconds)
+            silent_seconds = time.monotonic() - self.__last_received_at
+            if silent_seconds > settings.llm_ws_heartbeat_timeout_seconds:
+                logger.info("Closing chat socket silent for %.0fs", silent_seconds)
+                return
+
+            await self.__send(ChatSocketServerFrame(type="ping"))
+
+    async def __start_turn(self, frame: ChatSocketMessageFrame) -> None:
+        if frame.id in self.__turns:
+            await self.__send_error(frame.id, AgentsPlayBadRequestError())
+            return
+
+        if len(self.__turns) >= settings.llm_ws_max_in_flight:
+            await self.__send_error(frame.id, AgentsPlayTooManyRequestsError())
+            return
+
+        self.__turns[frame.id] = asyncio.create_task(self.__run_turn(frame))
+        await self.__send(ChatSocketServerFrame(type="accepted", id=frame.id))
+
+    async def __cancel_turn(self, turn_id: str) -> None:
+        turn = self.__turns.pop(turn_id, None)
+        if turn is None:
+            return
+
+        turn.cancel()
+        await self.__send(ChatSocketServerFrame(type="cancelled", id=turn_id))
+
+    async def __run_turn(self, frame: ChatSocketMessageFrame) -> None:
+        async def send_event(event: ChatEvent) -> None:
+            await self.__send(
+                ChatSocketServerFrame(type=event.type, id=frame.id, data=event.data)
+            )
+
+        # Only this turn's task and its children see the sink
+        current_chat_events.set(send_event)
+        try:
+            response = await self.controller.create_chat_message(
+                frame, connection_state=self.connection_state
+            )
+        except AgentsPlayError as e:
+            await self.__send_error(frame.id, e)
+        except Exception:
+            logger.exception("Chat socket turn failed")
+            await self.__send_error(frame.id, AgentsPlayGeneralError())
+        else:
+            await self.__send(
+                ChatSocketServerFrame(
+                    type="message", id=frame.id, data=response.model_dump(mode="json")
+                )
+            )
+        finally:
+            if self.__turns.get(frame.id) is asyncio.current_task():
+                del self.__turns[frame.id]
+
+    async def __send_error(self, turn_id: str | None, error: AgentsPlayError) -> None:
+        await self.__send(
+            ChatSocketServerFrame(
+                type="error",
+                id=turn_id,
+                data={
+                    "status_code": error.status_code,
+                    "detail": error.detail,
+                    # Carries Retry-After when the turn was shed
+                    "headers": error.headers,
+                },
+            )
+        )
+
+    async def __send(self, frame: ChatSocketServerFrame) -> None:
+        # Waits while the outbox is full, which holds back token streams too
+        await self.__outbox.put(frame)
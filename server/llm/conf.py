@@ -1,7 +1,50 @@
-from common.conf import BaseSettings
+from pathlib import Path
+from typing import TYPE_CHECKING, Literal
 
+from common.conf import BaseSettings, lazy_settings
 
-class __Settings(BaseSettings): ...
+if TYPE_CHECKING:
+    from agents_play.conf import Settings
 
 
-settings = __Settings()  # type: ignore
+class LLMSettings(BaseSettings):
+    llm_summarize_todo_responses: bool = False
+    llm_messages_cache_max_entries: int = 128
+    llm_request_timeout_seconds: float = 60.0
+    llm_summary_min_budget_seconds: float = 5.0
+    llm_write_behind_enabled: bool = False
+    # Each worker journals to its own file in here
+    llm_write_behind_journal_dir: Path = Path(".write-behind")
+    llm_write_behind_batch_size: int = 100
+    llm_write_behind_flush_interval_seconds: float = 0.5
+    # Turns beyond this are refused with a 503 until the flusher catches up
+    llm_write_behind_max_pending: int = 10_000
+    # Failed writes of a turn before it moves to the dead letters
+    llm_write_behind_max_attempts: int = 5
+    llm_memory_enabled: bool = True
+    llm_memory_embedder: Literal["hashing", "openai"] = "hashing"
+    llm_memory_embedding_model: str = "text-embedding-3-small"
+    llm_memory_dimensions: int = 256
+    llm_memory_recent_messages: int = 6
+    llm_memory_top_k: int = 4
+    llm_memory_min_score: float = 0.1
+    # Baked into the generated search column, changing it means rebuilding it
+    llm_search_text_config: str = "english"
+    llm_search_trigram_enabled: bool = False
+    # Turns older than this move out of the room's row into its archive, the
+    # most recent messages always stay
+    llm_archive_after_days: float = 30.0
+    llm_archive_keep_recent_messages: int = 50
+    llm_archive_min_messages: int = 100
+    llm_archive_segment_messages: int = 500
+    llm_archive_zstd_level: int = 10
+    llm_admission_max_in_flight: int = 32
+    llm_admission_max_wait_seconds: float = 10.0
+    llm_ws_max_in_flight: int = 4
+    llm_ws_send_queue_size: int = 256
+    llm_ws_send_timeout_seconds: float = 10.0
+    llm_ws_heartbeat_interval_seconds: float = 20.0
+    llm_ws_heartbeat_timeout_seconds: float = 60.0
+
+
+settings: "Settings" = lazy_settings()
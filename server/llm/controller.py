@@ -1,95 +1,458 @@
+import asyncio
 import uuid
-from typing import Annotated, Protocol
+from collections.abc import Iterator, Sequence
+from datetime import datetime
+from typing import Annotated, Protocol, cast
 
+import orjson
+from checkpoints.saver import checkpointed_response, release_checkpointed
+from common.agents import get_agent_registry
 from common.datetime_utils import datetime_now_with_timezone
-from common.exceptions import AgentsPlayGeneralError
-from database.database import Databaseable, get_database
+from common.deadlines import Deadline, DeadlineExceededError
+from common.exceptions import (
+    AgentsPlayGatewayTimeoutError,
+    AgentsPlayGeneralError,
+    AgentsPlayNotFoundError,
+)
+from common.owners import get_owner_id
+from common.usage import LLMUsageSink, llm_usage_scope
+from database.database import Databaseable, apply_deadline, get_database
 from fastapi import Depends
 from sqlmodel import Session
+from todos.commands import parse_todos_command
+from usage.meter import get_llm_usage_meter
 
-from llm.graph import llm_graph_invoke_question
-from llm.models import ChatRoom
+from llm.admission import (
+    AdmissionController,
+    AdmissionPriority,
+    get_admission_controller,
+)
+from llm.conf import settings
+from llm.graph import LLMGraphStateFailure, llm_graph_invoke_question
+from llm.models import (
+    ChatMessageSearch,
+    ChatRoom,
+    ChatRoomArchive,
+    ChatRoomVersion,
+    chat_room_title,
+)
 from llm.schemas import (
     ChatRoomMessage,
+    ChatRoomMessageDict,
     CreateChatMessagePayload,
     CreateChatMessageResponse,
     CreateChatRoomPayload,
-    ListChatMessagesResponse,
+    LLMMessageDict,
+    ListChatMessagesDict,
+    SearchChatMessagesPayload,
+    SearchChatMessagesResponse,
+    chat_room_messages_adapter,
+)
+from llm.write_behind import (
+    ChatTurnsWriteBehind,
+    PendingChatTurn,
+    get_chat_turns_write_behind,
 )
 
-LLM_PROVIDER = "openai"
-LLM_KEY = "gpt-4o-mini"
+
+class ChatConnectionState:
+    """
+    Room of a long-lived chat connection, kept between its turns so a turn
+    only checks the room's version instead of loading all of its messages.
+    Writes of the connection's concurrent turns are serialized, each one
+    appending to the room as the previous one left it.
+    """
+
+    def __init__(self) -> None:
+        self.room: ChatRoom | None = None
+        self.write_lock = asyncio.Lock()
 
 
 class LLMControllable(Protocol):
     database: Databaseable
 
-    def list_chat_messages(self) -> ListChatMessagesResponse: ...
+    def chat_messages_etag(self) -> str: ...
+
+    def list_chat_messages(
+        self, since: uuid.UUID | None = None
+    ) -> tuple[ListChatMessagesDict, str]: ...
+
+    def search_chat_messages(
+        self, payload: SearchChatMessagesPayload
+    ) -> SearchChatMessagesResponse: ...
+
+    def stream_chat_archive_segment(
+        self, room_id: uuid.UUID, segment: int
+    ) -> Iterator[bytes]: ...
 
     async def create_chat_message(
-        self, payload: CreateChatMessagePayload
+        self,
+        payload: CreateChatMessagePayload,
+        connection_state: ChatConnectionState | None = None,
+        idempotency_key: str | None = None,
     ) -> CreateChatMessageResponse: ...
 
 
 class LLMController(LLMControllable):
     database: Databaseable
+    owner_id: uuid.UUID
+    write_behind: ChatTurnsWriteBehind | None
+    admission: AdmissionController | None
+    usage_sink: LLMUsageSink | None
 
-    def __init__(self, database: Databaseable):
+    def __init__(
+        self,
+        database: Databaseable,
+        owner_id: uuid.UUID,
+        write_behind: ChatTurnsWriteBehind | None = None,
+        admission: AdmissionController | None = None,
+        usage_sink: LLMUsageSink | None = None,
+    ):
         self.database = database
+        self.owner_id = owner_id
+        self.write_behind = write_behind
+        self.admission = admission
+        self.usage_sink = usage_sink
 
-    def list_chat_messages(self) -> ListChatMessagesResponse:
-        messages: list[ChatRoomMessage]
-        with Session(self.database.engine) as session:
-            rooms = ChatRoom.list(session=session)
-            if len(rooms) == 0:
-                return ListChatMessagesResponse(detail="OK", data=[])
+    def chat_messages_etag(self) -> str:
+        pending_room_id = self.__latest_pending_room_id()
+        with Session(
+            self.database.reader_engine("chat_room", self.owner_id)
+        ) as session:
+            room_version = ChatRoom.version(
+                session=session, owner_id=self.owner_id, room_id=pending_room_id
+            )
 
-            room = rooms[0]
-            messages = room.validated_messages()
+        return _chat_messages_etag(
+            room_version=room_version,
+            pending_room_id=pending_room_id,
+            pending_turn_count=self.__pending_turn_count(pending_room_id),
+        )
 
-        return ListChatMessagesResponse(detail="OK", data=messages)
+    def list_chat_messages(
+        self, since: uuid.UUID | None = None
+    ) -> tuple[ListChatMessagesDict, str]:
+        """
+        The current room's messages with the ETag of the very rows read, an
+        ETag checked beforehand may come from another replica.
+        """
+        pending_room_id = self.__latest_pending_room_id()
+        # Served from the stored JSON, parsing messages only to dump them
+        # again dominated the cost of large rooms
+        messages: list[ChatRoomMessageDict] = []
+        since_found = False
+        room_version: ChatRoomVersion | None = None
+        room_id: str | None = None
+        archive_segment: int | None = None
+        archive_summary: str | None = None
+        with Session(
+            self.database.reader_engine("chat_room", self.owner_id)
+        ) as session:
+            room = self.__current_room(session=session, with_messages=False)
+            if room is not None:
+                delta_messages: list[ChatRoomMessageDict] | None = None
+                if since is not None:
+                    # Sliced by the database, catching up reads only the delta
+                    delta_messages = ChatRoom.messages_after(
+                        session=session,
+                        owner_id=self.owner_id,
+                        room_id=room.id,
+                        message_id=since,
+                    )
+                since_found = delta_messages is not None
+                messages = (
+                    delta_messages
+                    if delta_messages is not None
+                    else room.json_messages()
+                )
+                room_version = ChatRoomVersion(
+                    id=room.id,
+                    updated_at=room.updated_at,
+                    message_count=room.message_count,
+                )
+                room_id = str(room.id)
+                archive_segment = room.latest_archive_segment
+                archive_summary = room.archive_summary
+
+        pending_messages = self.__pending_messages(room=room, stored_messages=messages)
+        if pending_messages:
+            messages.extend(
+                cast(
+                    list[ChatRoomMessageDict],
+                    chat_room_messages_adapter.dump_python(
+                        pending_messages, mode="json"
+                    ),
+                )
+            )
+
+        cursor = messages[-1]["id"] if messages else None
+        if since is not None and since_found:
+            cursor = cursor or str(since)
+        elif since is not None:
+            # The cursor may still be a turn waiting to be written
+            since_id = str(since)
+            since_index = next(
+                (
+                    index
+                    for index, message in enumerate(messages)
+                    if message["id"] == since_id
+                ),
+                None,
+            )
+            # An unknown cursor means the client has to resync everything
+            if since_index is not None:
+                messages = messages[since_index + 1 :]
+
+        chat_messages: ListChatMessagesDict = {
+            "detail": "OK",
+            "data": messages,
+            "cursor": cursor,
+            "room_id": room_id,
+            "archive_segment": archive_segment,
+            "archive_summary": archive_summary,
+        }
+        etag = _chat_messages_etag(
+            room_version=room_version,
+            pending_room_id=pending_room_id,
+            pending_turn_count=self.__pending_turn_count(pending_room_id),
+        )
+
+        return chat_messages, etag
+
+    def search_chat_messages(
+        self, payload: SearchChatMessagesPayload
+    ) -> SearchChatMessagesResponse:
+        # Turns still pending in the write-behind are found once flushed
+        with Session(
+            self.database.reader_engine("chat_room", self.owner_id)
+        ) as session:
+            hits, next_cursor = ChatMessageSearch.search(
+                session=session, owner_id=self.owner_id, payload=payload
+            )
+
+        return SearchChatMessagesResponse(
+            detail="OK", data=hits, next_cursor=next_cursor
+        )
+
+    def stream_chat_archive_segment(
+        self, room_id: uuid.UUID, segment: int
+    ) -> Iterator[bytes]:
+        with Session(
+            self.database.reader_engine("chat_room", self.owner_id, room_id)
+        ) as session:
+            archive = ChatRoomArchive.get(
+                session=session,
+                owner_id=self.owner_id,
+                room_id=room_id,
+                segment=segment,
+            )
+        if archive is None:
+            raise AgentsPlayNotFoundError
+
+        return _chat_archive_segment_body(archive)
+
+    async def create_chat_message(
+        self,
+        payload: CreateChatMessagePayload,
+        connection_state: ChatConnectionState | None = None,
+        idempotency_key: str | None = None,
+    ) -> CreateChatMessageResponse:
+        # Retries of a request resume its run instead of starting another
+        thread_id = (
+            f"llm:{self.owner_id}:{idempotency_key}"
+            if idempotency_key is not None
+            else None
+        )
+        if thread_id is not None:
+            stored_response = await checkpointed_response(thread_id)
+            if stored_response is not None:
+                # Stored already, only the response got lost on its way
+                return CreateChatMessageResponse.model_validate_json(stored_response)
+
+        if self.write_behind is not None:
+            self.write_behind.check_capacity()
 
-    async def create_chat_message(self, payload) -> CreateChatMessageResponse:
         request_time = datetime_now_with_timezone()
-        messages: list[ChatRoomMessage] = []
-        existing_room: ChatRoom | None = None
-        with Session(self.database.engine) as session:
-            rooms = ChatRoom.list(session=session)
-            if len(rooms) > 0:
-                room = rooms[0]
-                existing_room = room
-                messages = room.validated_messages()
+        # Started before admission, time spent queued counts against it
+        deadline = Deadline.from_timeout(settings.llm_request_timeout_seconds)
+        if self.admission is None:
+            return await self.__create_chat_message(
+                payload=payload,
+                request_time=request_time,
+                deadline=deadline,
+                connection_state=connection_state,
+                thread_id=thread_id,
+            )
+
+        async with self.admission.admit(chat_message_priority(payload)):
+            return await self.__create_chat_message(
+                payload=payload,
+                request_time=request_time,
+                deadline=deadline,
+                connection_state=connection_state,
+                thread_id=thread_id,
+            )
+
+    async def __create_chat_message(
+        self,
+        payload: CreateChatMessagePayload,
+        request_time: datetime,
+        deadline: Deadline,
+        connection_state: ChatConnectionState | None,
+        thread_id: str | None,
+    ) -> CreateChatMessageResponse:
+        # Off the event loop, recalling memories may call the embeddings API
+        if connection_state is None:
+            existing_room, messages = await asyncio.to_thread(
+                self.__turn_context, payload=payload, deadline=deadline
+            )
+        else:
+            # The connection's room must not be in two threads' sessions at once
+            async with connection_state.write_lock:
+                existing_room, messages = await asyncio.to_thread(
+                    self.__turn_context,
+                    payload=payload,
+                    deadline=deadline,
+                    connection_state=connection_state,
+                )
+        messages.extend(
+            message.as_llm_message_dict
+            for message in self.__pending_messages(room=existing_room)
+        )
+        room_id = self.__turn_room_id(existing_room=existing_room)
 
+        llm_provider, llm_key = _split_agent_name(
+            get_agent_registry().default_model("generation").name
+        )
         question = ChatRoomMessage(
             id=uuid.uuid4(),
             role="user",
             content=payload.message,
-            llm_provider=LLM_PROVIDER,
-            llm_key=LLM_KEY,
+            llm_provider=llm_provider,
+            llm_key=llm_key,
             date=request_time,
         )
-        end_state = await llm_graph_invoke_question(
-            database=self.database, question=question, messages=messages
-        )
+        try:
+            with llm_usage_scope(
+                sink=self.usage_sink,
+                request_id=uuid.uuid4(),
+                owner_id=self.owner_id,
+                room_id=room_id,
+            ):
+                end_state = await llm_graph_invoke_question(
+                    database=self.database,
+                    owner_id=self.owner_id,
+                    question=question,
+                    messages=messages,
+                    deadline=deadline,
+                    thread_id=thread_id,
+                )
+        except DeadlineExceededError:
+            raise AgentsPlayGatewayTimeoutError
+
         response_time = datetime_now_with_timezone()
         if not end_state.is_ok:
+            if (
+                isinstance(end_state.result, LLMGraphStateFailure)
+                and end_state.result.code == "deadline_exceeded"
+            ):
+                raise AgentsPlayGatewayTimeoutError
+
             raise AgentsPlayGeneralError
 
         graph_ok_result = end_state.ok_result
         assert graph_ok_result is not None
 
+        # A resumed run answers the question it was first asked
+        question = end_state.question
+
         ai_response = graph_ok_result.ai_response
 
         assert isinstance(ai_response.content, str)
 
+        if graph_ok_result.agent_name is not None:
+            llm_provider, llm_key = _split_agent_name(graph_ok_result.agent_name)
+
         response = ChatRoomMessage(
             role="assistant",
             content=ai_response.content,
             id=uuid.uuid4(),
-            llm_provider=LLM_PROVIDER,
-            llm_key=LLM_KEY,
+            llm_provider=llm_provider,
+            llm_key=llm_key,
             date=response_time,
         )
+        if self.write_behind is not None:
+            # Off the event loop, journaling waits for the turn to be on disk
+            chat_message_response = await asyncio.to_thread(
+                self.__enqueue_chat_turn,
+                write_behind=self.write_behind,
+                existing_room=existing_room,
+                room_id=room_id,
+                question=question,
+                response=response,
+            )
+        elif connection_state is None:
+            # Off the event loop, storing embeds the turn's messages
+            chat_message_response = await asyncio.to_thread(
+                self.__store_chat_turn,
+                existing_room=existing_room,
+                room_id=room_id,
+                question=question,
+                response=response,
+            )
+        else:
+            async with connection_state.write_lock:
+                # A concurrent turn of the connection may have written in between
+                if connection_state.room is not None:
+                    existing_room = connection_state.room
+                chat_message_response = await asyncio.to_thread(
+                    self.__store_chat_turn,
+                    existing_room=existing_room,
+                    room_id=room_id,
+                    question=question,
+                    response=response,
+                    connection_state=connection_state,
+                )
+
+        if thread_id is not None:
+            # The turn is stored, there is nothing left to resume
+            await release_checkpointed(
+                thread_id, response=chat_message_response.model_dump_json().encode()
+            )
+
+        return chat_message_response
+
+    def __turn_context(
+        self,
+        payload: CreateChatMessagePayload,
+        deadline: Deadline,
+        connection_state: ChatConnectionState | None = None,
+    ) -> tuple[ChatRoom | None, list[LLMMessageDict]]:
+        messages: list[LLMMessageDict] = []
+        existing_room: ChatRoom | None = None
+        with Session(self.database.engine) as session:
+            apply_deadline(session=session, deadline=deadline)
+            if connection_state is not None:
+                existing_room = self.__connection_room(
+                    session=session, connection_state=connection_state
+                )
+            else:
+                existing_room = self.__current_room(session=session)
+            if existing_room is not None:
+                messages = existing_room.memory_llm_messages(
+                    query=payload.message, session=session
+                )
+
+        return existing_room, messages
+
+    def __store_chat_turn(
+        self,
+        existing_room: ChatRoom | None,
+        room_id: uuid.UUID,
+        question: ChatRoomMessage,
+        response: ChatRoomMessage,
+        connection_state: ChatConnectionState | None = None,
+    ) -> CreateChatMessageResponse:
         with Session(self.database.engine) as session:
             if existing_room is not None:
                 room = existing_room.add_messages(
@@ -100,9 +463,15 @@ class LLMController(LLMControllable):
                     payload=CreateChatRoomPayload(
                         question=question,
                         answer=response,
+                        room_id=room_id,
                     ),
+                    owner_id=self.owner_id,
                     session=session,
                 )
+                session.refresh(room)
+            self.database.record_write("chat_room", self.owner_id, room.id)
+            if connection_state is not None:
+                connection_state.room = room
 
             return CreateChatMessageResponse(
                 role=response.role,
@@ -117,8 +486,221 @@ class LLMController(LLMControllable):
                 updated_at=room.updated_at,
             )
 
+    def __current_room(
+        self, session: Session, with_messages: bool = True
+    ) -> ChatRoom | None:
+        # Turns waiting to be written always belong to the most recent room
+        pending_room_id = self.__latest_pending_room_id()
+        if pending_room_id is not None:
+            return ChatRoom.get(
+                session=session,
+                owner_id=self.owner_id,
+                room_id=pending_room_id,
+                with_messages=with_messages,
+            )
+
+        return ChatRoom.latest(
+            session=session, owner_id=self.owner_id, with_messages=with_messages
+        )
+
+    def __latest_pending_room_id(self) -> uuid.UUID | None:
+        if self.write_behind is None:
+            return None
+
+        return self.write_behind.latest_pending_room_id(owner_id=self.owner_id)
+
+    def __pending_turn_count(self, pending_room_id: uuid.UUID | None) -> int:
+        if pending_room_id is None or self.write_behind is None:
+            return 0
+
+        return len(
+            self.write_behind.pending_turns(
+                owner_id=self.owner_id, room_id=pending_room_id
+            )
+        )
+
+    def __connection_room(
+        self, session: Session, connection_state: ChatConnectionState
+    ) -> ChatRoom | None:
+        pending_room_id: uuid.UUID | None = None
+        if self.write_behind is not None:
+            pending_room_id = self.write_behind.latest_pending_room_id(
+                owner_id=self.owner_id
+            )
+        room_version = ChatRoom.version(
+            session=session, owner_id=self.owner_id, room_id=pending_room_id
+        )
+        if room_version is None:
+            connection_state.room = None
+            return None
+
+        room = connection_state.room
+        if room is not None:
+            # Picks up the room again, expired attributes reload through it
+            session.add(room)
+        if (
+            room is None
+            or room.id != room_version.id
+            or room.updated_at != room_version.updated_at
+        ):
+            # Written by another connection or request since, or a new room
+            room = ChatRoom.get(
+                session=session, owner_id=self.owner_id, room_id=room_version.id
+            )
+            connection_state.room = room
+
+        return room
+
+    def __turn_room_id(self, existing_room: ChatRoom | None) -> uuid.UUID:
+        # Decided up front so the turn's usage can be tagged with its room
+        if existing_room is not None:
+            return existing_room.id
+
+        if self.write_behind is not None:
+            pending_room_id = self.write_behind.latest_pending_room_id(
+                owner_id=self.owner_id
+            )
+            if pending_room_id is not None:
+                return pending_room_id
+
+        return uuid.uuid4()
+
+    def __pending_messages(
+        self,
+        room: ChatRoom | None,
+        stored_messages: Sequence[ChatRoomMessageDict] | None = None,
+    ) -> list[ChatRoomMessage]:
+        """
+        The turns of `room` waiting to be written. A flush may land between
+        reading the room and its pending turns, the ones among
+        `stored_messages`, all of the room's by default, are left out.
+        """
+        if self.write_behind is None:
+            return []
+
+        room_id: uuid.UUID | None
+        stored_message_ids: set[str] = set()
+        if room is not None:
+            room_id = room.id
+            if stored_messages is None:
+                stored_messages = cast(list[ChatRoomMessageDict], room.messages)
+            stored_message_ids = {message["id"] for message in stored_messages}
+        else:
+            room_id = self.write_behind.latest_pending_room_id(owner_id=self.owner_id)
+            if room_id is None:
+                return []
+
+        return [
+            message
+            for turn in self.write_behind.pending_turns(
+                owner_id=self.owner_id, room_id=room_id
+            )
+            for message in (turn.question, turn.answer)
+            if str(message.id) not in stored_message_ids
+        ]
+
+    def __enqueue_chat_turn(
+        self,
+        write_behind: ChatTurnsWriteBehind,
+        existing_room: ChatRoom | None,
+        room_id: uuid.UUID,
+        question: ChatRoomMessage,
+        response: ChatRoomMessage,
+    ) -> CreateChatMessageResponse:
+        write_behind.enqueue(
+            PendingChatTurn(
+                owner_id=self.owner_id,
+                room_id=room_id,
+                question=question,
+                answer=response,
+            )
+        )
+
+        title: str
+        if existing_room is not None:
+            title = existing_room.title
+        else:
+            first_turn = write_behind.pending_turns(
+                owner_id=self.owner_id, room_id=room_id
+            )[0]
+            title = chat_room_title(first_turn.question)
+
+        return CreateChatMessageResponse(
+            role=response.role,
+            content=response.content,
+            id=response.id,
+            llm_provider=response.llm_provider,
+            llm_key=response.llm_key,
+            date=response.date,
+            detail="Created",
+            room_id=room_id,
+            title=title,
+            updated_at=response.date,
+        )
+
+
+def _chat_archive_segment_body(archive: ChatRoomArchive) -> Iterator[bytes]:
+    """
+    A `ChatArchiveSegmentResponse`, its messages streamed as they decompress
+    instead of being parsed and dumped again.
+    """
+    head = orjson.dumps(
+        {
+            "detail": "OK",
+            "previous_segment": archive.previous_segment,
+            "summary": archive.summary,
+        }
+    )
+    yield head[:-1] + b',"data":'
+    yield from archive.iter_messages_json()
+    yield b"}"
+
 
 def get_llm_controller(
     database: Annotated[Databaseable, Depends(get_database)],
+    owner_id: Annotated[uuid.UUID, Depends(get_owner_id)],
+    write_behind: Annotated[
+        ChatTurnsWriteBehind | None, Depends(get_chat_turns_write_behind)
+    ],
+    admission: Annotated[AdmissionController, Depends(get_admission_controller)],
+    usage_sink: Annotated[LLMUsageSink | None, Depends(get_llm_usage_meter)],
 ) -> LLMControllable:
-    return LLMController(database)
+    return LLMController(
+        database,
+        owner_id=owner_id,
+        write_behind=write_behind,
+        admission=admission,
+        usage_sink=usage_sink,
+    )
+
+
+def chat_message_priority(payload: CreateChatMessagePayload) -> AdmissionPriority:
+    # Direct todo commands are answered from the database without a model
+    if parse_todos_command(payload.message) is not None:
+        return "cheap"
+
+    return "expensive"
+
+
+def _chat_messages_etag(
+    room_version: ChatRoomVersion | None,
+    pending_room_id: uuid.UUID | None,
+    pending_turn_count: int,
+) -> str:
+    etag_parts = ["empty"]
+    if room_version is not None:
+        etag_parts = [
+            room_version.id.hex,
+            str(room_version.updated_at.timestamp()),
+            str(room_version.message_count),
+        ]
+    if pending_room_id is not None:
+        etag_parts.extend([pending_room_id.hex, str(pending_turn_count)])
+
+    return f'"{"-".join(etag_parts)}"'
+
+
+def _split_agent_name(agent_name: str) -> tuple[str, str]:
+    llm_provider, _, llm_key = agent_name.partition(":")
+
+    return llm_provider, llm_key
@@ -1,52 +1,86 @@
-from functools import reduce
+import asyncio
+import uuid
 from typing import TYPE_CHECKING, Any, Literal, TypedDict
 
+from checkpoints.saver import ainvoke_checkpointed
+from common.agents import AGENT_NAME_RESPONSE_KEY, get_agent_registry, routed_agent
+from common.deadlines import (
+    Deadline,
+    DeadlineExceededError,
+    deadline_config,
+    get_deadline,
+)
+from common.events import (
+    ChatEventsCallbackHandler,
+    current_chat_events,
+    emit_chat_event,
+)
+from common.llm_clients import llm_call_errors
+from common.recording import record_route
 from langchain_core.messages import AIMessage
 from langchain_core.runnables import RunnableConfig
-from langgraph.graph.state import CompiledStateGraph, StateGraph
-from langgraph.prebuilt import create_react_agent
+from langgraph.graph.state import StateGraph
 from langgraph.types import Command as LanggraphCommand
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
+from todos.commands import parse_todos_command, todos_command_invoke
 from todos.graph import todos_graph_invoke
+from todos.rendering import render_todos_response
 
 from llm.conf import settings
-from llm.schemas import ChatRoomMessage
+from llm.prompts import todos_summary_prompt
+from llm.schemas import ChatRoomMessage, LLMMessageDict
 from llm.tools import get_exchange_rates_tool
 
 if TYPE_CHECKING:
     from database.database import Databaseable
 
-assert settings.openai_api_key
-
 LLMGraphNodes = Literal[
     "llm_entry_node",
+    "llm_todo_node",
+    "llm_summary_node",
+    "llm_general_node",
     "llm_finish_node",
 ]
 
 LLMExchangeGraphCommand = LanggraphCommand[LLMGraphNodes]
 
 
-LLMExceptionCodes = Literal["unsupported_llm", "agent_invocation_failed"]
+LLMExceptionCodes = Literal[
+    "unsupported_llm", "agent_invocation_failed", "deadline_exceeded"
+]
 
 
 class LLMGraphStateFailure(BaseModel):
-    def __init__(self, code: LLMExceptionCodes, cause: Exception | None = None):
-        self.code = code
-        self.cause = cause
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    code: LLMExceptionCodes
+    # Not checkpointed, exceptions don't serialize
+    cause: Exception | None = Field(default=None, exclude=True)
+
+    @classmethod
+    def from_agent_exception(cls, cause: Exception) -> "LLMGraphStateFailure":
+        if isinstance(cause, DeadlineExceededError):
+            return cls(code="deadline_exceeded", cause=cause)
+
+        return cls(code="agent_invocation_failed", cause=cause)
 
 
 class LLMGraphStateSuccess(BaseModel):
     ai_response: AIMessage
+    agent_name: str | None = None
 
 
 class LLMGraphConfig(TypedDict):
     database: "Databaseable"
+    owner_id: uuid.UUID
+    deadline: Deadline | None
 
 
 class LLMGraphState(BaseModel):
     question: ChatRoomMessage
-    messages: list[ChatRoomMessage]
+    messages: list[LLMMessageDict]
     result: LLMGraphStateSuccess | LLMGraphStateFailure | None
+    summary_prompt: str | None = None
 
     def with_error_result(self, error_result: LLMGraphStateFailure) -> "LLMGraphState":
         assert self.result is None
@@ -101,15 +135,11 @@ When the user asks about exchange rates or currency conversion, use the get_exch
 For all other questions, respond normally without using any tools.
 """.strip()
 
-LLM_AGENTS: dict[str, CompiledStateGraph[Any]] = reduce(
-    lambda acc, name: {
-        **acc,
-        name: create_react_agent(
-            name, tools=[get_exchange_rates_tool], prompt=LLM_AGENTS_SYSTEM_PROMPT
-        ),
-    },
-    {"openai:gpt-4o-mini"},
-    {},
+general_agent = routed_agent(
+    "general",
+    "generation",
+    tools=[get_exchange_rates_tool],
+    prompt=LLM_AGENTS_SYSTEM_PROMPT,
 )
 
 PLANNING_AGENT_PROMPT = """
@@ -134,110 +164,148 @@ Examples:
 Only respond with the single word: todo or general. Do not provide any explanation or additional text.
 """.strip()
 
-planning_agent = create_react_agent(
-    "openai:gpt-4o-mini", tools=[], prompt=PLANNING_AGENT_PROMPT
+planning_agent = routed_agent(
+    "llm_planning", "classification", tools=[], prompt=PLANNING_AGENT_PROMPT
 )
 
 
 async def llm_entry_node(
     state: LLMGraphState, config: RunnableConfig
 ) -> LLMExchangeGraphCommand:
-    try:
-        planning_response = await planning_agent.ainvoke(
-            {"messages": [state.question.as_llm_message.model_dump(mode="json")]}
+    configurable: LLMGraphConfig = config["configurable"]  # type: ignore
+    deadline = get_deadline(config)
+
+    todos_command = parse_todos_command(state.question.content)
+    if todos_command is not None:
+        record_route("todos_command")
+        await emit_chat_event("route", route="todos_command")
+        # Reads and writes the database synchronously, kept off the event loop
+        todos_command_result = await asyncio.to_thread(
+            todos_command_invoke,
+            database=configurable["database"],
+            owner_id=configurable["owner_id"],
+            user_input=state.question.content,
+            command=todos_command,
+            deadline=deadline,
         )
-    except Exception as e:
+
+        return LLMExchangeGraphCommand(
+            update=state.with_success_result(
+                LLMGraphStateSuccess(
+                    ai_response=AIMessage(
+                        content=render_todos_response(todos_command_result)
+                    )
+                )
+            ),
+            goto="llm_finish_node",
+        )
+
+    if not get_agent_registry().has_model(state.question.agent_name):
         return LLMExchangeGraphCommand(
             update=state.with_error_result(
-                LLMGraphStateFailure(code="agent_invocation_failed", cause=e)
+                LLMGraphStateFailure(code="unsupported_llm")
             ),
             goto="llm_finish_node",
         )
 
+    # Agent failures propagate, a checkpointed run resumes from the last
+    # node that completed
+    planning_response = await planning_agent.ainvoke(
+        {"messages": [state.question.as_llm_message.model_dump(mode="json")]},
+        config=deadline_config(deadline),
+    )
+
     planning_messages = planning_response["messages"]
     planning_ai_message = planning_messages[-1]
 
     assert isinstance(planning_ai_message, AIMessage)
     assert isinstance(planning_ai_message.content, str)
 
-    agent = LLM_AGENTS.get(state.question.agent_name)
-    if agent is None:
+    if planning_ai_message.content == "todo":
+        return LLMExchangeGraphCommand(goto="llm_todo_node")
+
+    return LLMExchangeGraphCommand(goto="llm_general_node")
+
+
+async def llm_todo_node(
+    state: LLMGraphState, config: RunnableConfig
+) -> LLMExchangeGraphCommand:
+    configurable: LLMGraphConfig = config["configurable"]  # type: ignore
+    deadline = get_deadline(config)
+
+    record_route("todo")
+    await emit_chat_event("route", route="todo")
+    todo_result = await todos_graph_invoke(
+        database=configurable["database"],
+        owner_id=configurable["owner_id"],
+        user_input=state.question.content,
+        deadline=deadline,
+    )
+
+    if not todo_result.is_ok:
+        # Failed to perform todo action, let's pass through and try something else
+        return LLMExchangeGraphCommand(goto="llm_general_node")
+
+    # Summarizing is optional, skip it when the request is short on time
+    should_summarize = settings.llm_summarize_todo_responses and (
+        deadline is None
+        or deadline.has_budget_for(settings.llm_summary_min_budget_seconds)
+    )
+    if not should_summarize:
         return LLMExchangeGraphCommand(
-            update=state.with_error_result(
-                LLMGraphStateFailure(code="unsupported_llm")
+            update=state.with_success_result(
+                LLMGraphStateSuccess(
+                    ai_response=AIMessage(content=render_todos_response(todo_result))
+                )
             ),
             goto="llm_finish_node",
         )
 
-    if planning_ai_message.content == "todo":
-        configurable: LLMGraphConfig = config["configurable"]  # type: ignore
-        todo_result = await todos_graph_invoke(
-            database=configurable["database"], user_input=state.question.content
-        )
+    return LLMExchangeGraphCommand(
+        update={
+            "summary_prompt": todos_summary_prompt(
+                user_input=state.question.content, todos_state=todo_result
+            )
+        },
+        goto="llm_summary_node",
+    )
 
-        if todo_result.is_ok:
-            todo_ok_result = todo_result.ok_result
-            assert todo_ok_result is not None
-
-            if todo_ok_result.action == "create":
-                if todo_result.new_todo:
-                    summary_prompt = f"The user asked: '{state.question.content}'. I successfully created a new todo item with the title '{todo_result.new_todo.title}'. Please provide a helpful response confirming the todo was created."
-                else:
-                    summary_prompt = f"The user asked: '{state.question.content}'. I determined this was a todo creation request, but no todo was actually created. Please explain this to the user."
-            elif todo_ok_result.action == "list":
-                if todo_result.todos:
-                    todos_list = "\n".join(
-                        [f"- {todo.title}" for todo in todo_result.todos]
-                    )
-                    summary_prompt = f"The user asked: '{state.question.content}'. Here are their current todos:\n{todos_list}\n\nPlease provide a helpful response showing them their todo list."
-                else:
-                    summary_prompt = f"The user asked: '{state.question.content}'. They currently have no todos in their list. Please let them know their todo list is empty."
-            else:
-                summary_prompt = f"The user asked: '{state.question.content}'. I determined this was a todo-related request but the action '{todo_ok_result.action}' is not supported. Please explain this to the user."
-
-            summary_messages = [{"role": "user", "content": summary_prompt}]
-
-            try:
-                summary_response = await agent.ainvoke({"messages": summary_messages})
-            except Exception as e:
-                return LLMExchangeGraphCommand(
-                    update=state.with_error_result(
-                        LLMGraphStateFailure(code="agent_invocation_failed", cause=e)
-                    ),
-                    goto="llm_finish_node",
-                )
 
-            summary_ai_message = summary_response["messages"][-1]
+async def llm_summary_node(
+    state: LLMGraphState, config: RunnableConfig
+) -> LLMExchangeGraphCommand:
+    assert state.summary_prompt is not None
+
+    summary_response = await general_agent.ainvoke(
+        {"messages": [{"role": "user", "content": state.summary_prompt}]},
+        config=deadline_config(get_deadline(config)),
+    )
+
+    summary_ai_message = summary_response["messages"][-1]
 
-            assert isinstance(summary_ai_message, AIMessage)
+    assert isinstance(summary_ai_message, AIMessage)
 
-            return LLMExchangeGraphCommand(
-                update=state.with_success_result(
-                    LLMGraphStateSuccess(ai_response=summary_ai_message)
-                ),
-                goto="llm_finish_node",
+    return LLMExchangeGraphCommand(
+        update=state.with_success_result(
+            LLMGraphStateSuccess(
+                ai_response=summary_ai_message,
+                agent_name=summary_response[AGENT_NAME_RESPONSE_KEY],
             )
-        else:
-            # Failed to perform todo action, let's pass through and try something else
-            pass
-
-    # Handle general case
-    input_messages = list(
-        map(
-            lambda message: message.model_dump(mode="json"),
-            state.messages + [state.question.as_llm_message],
-        )
+        ),
+        goto="llm_finish_node",
     )
 
-    try:
-        response = await agent.ainvoke({"messages": input_messages})
-    except Exception as e:
-        return LLMExchangeGraphCommand(
-            update=state.with_error_result(
-                LLMGraphStateFailure(code="agent_invocation_failed", cause=e)
-            ),
-            goto="llm_finish_node",
-        )
+
+async def llm_general_node(
+    state: LLMGraphState, config: RunnableConfig
+) -> LLMExchangeGraphCommand:
+    record_route("general")
+    await emit_chat_event("route", route="general")
+    input_messages = [*state.messages, state.question.as_llm_message_dict]
+
+    response = await general_agent.ainvoke(
+        {"messages": input_messages}, config=deadline_config(get_deadline(config))
+    )
 
     messages = response["messages"]
     ai_message = messages[-1]
@@ -245,7 +313,11 @@ async def llm_entry_node(
     assert isinstance(ai_message, AIMessage)
 
     return LLMExchangeGraphCommand(
-        update=state.with_success_result(LLMGraphStateSuccess(ai_response=ai_message)),
+        update=state.with_success_result(
+            LLMGraphStateSuccess(
+                ai_response=ai_message, agent_name=response[AGENT_NAME_RESPONSE_KEY]
+            )
+        ),
         goto="llm_finish_node",
     )
 
@@ -259,6 +331,9 @@ def llm_finish_node(state: LLMGraphState) -> LLMGraphState:
 llm_graph = (
     StateGraph(LLMGraphState, config_schema=LLMGraphConfig)
     .add_node("llm_entry_node", llm_entry_node)
+    .add_node("llm_todo_node", llm_todo_node)
+    .add_node("llm_summary_node", llm_summary_node)
+    .add_node("llm_general_node", llm_general_node)
     .add_node("llm_finish_node", llm_finish_node)
     .set_entry_point("llm_entry_node")
     .set_finish_point("llm_finish_node")
@@ -267,14 +342,34 @@ llm_graph = (
 
 
 async def llm_graph_invoke_question(
-    database: "Databaseable", question: ChatRoomMessage, messages: list[ChatRoomMessage]
+    database: "Databaseable",
+    owner_id: uuid.UUID,
+    question: ChatRoomMessage,
+    messages: list[LLMMessageDict],
+    deadline: Deadline | None = None,
+    thread_id: str | None = None,
 ) -> LLMGraphState:
+    """
+    Answer the question. With a `thread_id` the run is checkpointed, invoking
+    again with the same one resumes a run that failed midway.
+    """
     state = LLMGraphState(question=question, messages=messages, result=None)
-    config = {"configurable": {"database": database}}
-    end_state = await llm_graph.ainvoke(
-        input=state,  # type: ignore
-        config=config,  # type: ignore
-    )
+    config: dict[str, Any] = {
+        "configurable": {
+            "database": database,
+            "owner_id": owner_id,
+            "deadline": deadline,
+        }
+    }
+    if current_chat_events.get() is not None:
+        # Nested agents inherit the callbacks, so their tokens reach the client
+        config["callbacks"] = [ChatEventsCallbackHandler()]
+    try:
+        end_state = await ainvoke_checkpointed(
+            graph=llm_graph, input=state, config=config, thread_id=thread_id
+        )
+    except llm_call_errors() as e:
+        return state.with_error_result(LLMGraphStateFailure.from_agent_exception(e))
     validated_end_state = LLMGraphState(**end_state)
 
     assert validated_end_state.result is not None
@@ -0,0 +1,122 @@
+import hashlib
+import re
+from collections.abc import Sequence
+from functools import cache
+from typing import Protocol
+
+import numpy as np
+import numpy.typing as npt
+
+from llm.conf import settings
+
+EmbeddingMatrix = npt.NDArray[np.float32]
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class Embedder(Protocol):
+    # Stored with every room index, so switching embedders rebuilds them
+    name: str
+    dimensions: int
+
+    def embed(self, texts: Sequence[str]) -> EmbeddingMatrix: ...
+
+
+class HashingEmbedder(Embedder):
+    """
+    Offline embedder hashing the words and word pairs of a text into a fixed
+    number of signed buckets. Needs no model or network, which makes it the
+    default and the one to use in tests.
+    """
+
+    def __init__(self, dimensions: int) -> None:
+        self.name = f"hashing-{dimensions}"
+        self.dimensions = dimensions
+
+    def embed(self, texts: Sequence[str]) -> EmbeddingMatrix:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = TOKEN_PATTERN.findall(text.lower())
+            features = [
+                *tokens,
+                *(f"{first} {second}" for first, second in zip(tokens, tokens[1:])),
+            ]
+            for feature in features:
+                digest = int.from_bytes(
+                    hashlib.blake2b(feature.encode(), digest_size=8).digest()
+                )
+                sign = 1.0 if digest >> 63 else -1.0
+                vectors[row, digest % self.dimensions] += sign
+
+        return normalized(vectors)
+
+
+class OpenAIEmbedder(Embedder):
+    def __init__(self, model: str, dimensions: int) -> None:
+        self.name = f"openai:{model}-{dimensions}"
+        self.dimensions = dimensions
+        # Deferred, the OpenAI client is slow to import and usually unused
+        from langchain_openai import OpenAIEmbeddings
+
+        self.__embeddings = OpenAIEmbeddings(model=model, dimensions=dimensions)
+
+    def embed(self, texts: Sequence[str]) -> EmbeddingMatrix:
+        if not texts:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+
+        vectors = self.__embeddings.embed_documents(list(texts))
+
+        return normalized(np.asarray(vectors, dtype=np.float32))
+
+
+@cache
+def get_embedder() -> Embedder:
+    if settings.llm_memory_embedder == "openai":
+        return OpenAIEmbedder(
+            model=settings.llm_memory_embedding_model,
+            dimensions=settings.llm_memory_dimensions,
+        )
+
+    return HashingEmbedder(dimensions=settings.llm_memory_dimensions)
+
+
+def normalized(vectors: EmbeddingMatrix) -> EmbeddingMatrix:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    # Empty texts stay zero vectors, which score 0 against everything
+    norms[norms == 0] = 1.0
+
+    return vectors / norms
+
+
+def cosine_top_k(
+    queries: EmbeddingMatrix,
+    embeddings: EmbeddingMatrix,
+    k: int,
+    mask: npt.NDArray[np.bool_] | None = None,
+) -> tuple[npt.NDArray[np.intp], npt.NDArray[np.float32]]:
+    """
+    Best `k` rows of `embeddings` for every query, as (indices, scores) sorted
+    by descending score. Both sides are unit vectors, so cosine similarity is
+    a single matrix product for the whole batch. Rows outside `mask` are never
+    returned.
+    """
+    candidates = embeddings.shape[0] if mask is None else int(mask.sum())
+    k = min(k, candidates)
+    if k == 0:
+        return (
+            np.empty((queries.shape[0], 0), dtype=np.intp),
+            np.empty((queries.shape[0], 0), dtype=np.float32),
+        )
+
+    scores = queries @ embeddings.T
+    if mask is not None:
+        scores[:, ~mask] = -np.inf
+
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+
+    return (
+        np.take_along_axis(top, order, axis=1),
+        np.take_along_axis(top_scores, order, axis=1),
+    )
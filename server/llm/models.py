@@ -1,20 +1,84 @@
+import base64
+import binascii
 import uuid
-from datetime import datetime
-from typing import Any, Sequence
+from collections.abc import Iterator
+from datetime import datetime, timedelta
+from typing import Any, Sequence, cast
 
+import numpy as np
+import orjson
+import zstandard
+from common.cache import VersionedCache
 from common.datetime_utils import datetime_now_with_timezone
-from common.exceptions import AgentsPlayBadRequestError
-from sqlalchemy import ARRAY, JSON, Column, DateTime
+from common.exceptions import AgentsPlayBadRequestError, AgentsPlayNotFoundError
+from database.database import OWNER_HASH_PARTITIONED
+from pydantic import BaseModel
+from sqlalchemy import (
+    ARRAY,
+    JSON,
+    Column,
+    ColumnElement,
+    Computed,
+    Connection,
+    DateTime,
+    ForeignKeyConstraint,
+    Index,
+    LargeBinary,
+    Table,
+    Text,
+    delete,
+    event,
+    func,
+    literal,
+    literal_column,
+    text,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import REAL, TSVECTOR
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.orm import defer
+from sqlalchemy.orm.interfaces import ORMOption
 from sqlmodel import Field, SQLModel, Session, col, select
 
-from llm.schemas import ChatRoomMessage, CreateChatRoomPayload
+from llm.conf import settings
+from llm.memory import Embedder, EmbeddingMatrix, cosine_top_k, get_embedder
+from llm.schemas import (
+    ChatMessageSearchHit,
+    ChatRoomMessage,
+    ChatRoomMessageDict,
+    CreateChatRoomPayload,
+    LLMMessageDict,
+    SearchChatMessagesPayload,
+    chat_room_messages_adapter,
+)
 
 CHAT_ROOM_MAX_TITLE_LENGTH = 255
 
+CHAT_ARCHIVE_SUMMARY_QUESTIONS = 5
+CHAT_ARCHIVE_SUMMARY_QUESTION_LENGTH = 80
+CHAT_ARCHIVE_SUMMARY_MAX_LINES = 10
+
+CHAT_SEARCH_HEADLINE_OPTIONS = (
+    "StartSel=<<, StopSel=>>, MaxWords=24, MinWords=8, MaxFragments=2"
+)
+
+# The text search configuration is filled in when the table is created
+CHAT_SEARCH_VECTOR_SQL = "to_tsvector('{text_config}'::regconfig, content)"
+
+
+class ChatRoomVersion(BaseModel):
+    id: uuid.UUID
+    updated_at: datetime
+    message_count: int
+
 
 class ChatRoom(SQLModel, table=True):
     __tablename__: str = "chat_room"  # type: ignore
+    __table_args__ = OWNER_HASH_PARTITIONED
 
+    # Part of the primary key, Postgres wants the partition key in it
+    owner_id: uuid.UUID = Field(primary_key=True)
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     updated_at: datetime = Field(
         sa_column=Column(
@@ -28,40 +92,278 @@ class ChatRoom(SQLModel, table=True):
     messages: list[dict[str, Any]] = Field(
         default_factory=list, sa_column=Column(ARRAY(JSON), nullable=False)
     )
+    # Kept next to `messages`, counting the array would read all of it
+    message_count: int = Field(default=0)
+    # Older messages live in `chat_room_archive`, segments numbered from 0
+    archived_segments: int = Field(default=0)
+    archive_summary: str | None = None
+
+    @property
+    def latest_archive_segment(self) -> int | None:
+        return self.archived_segments - 1 if self.archived_segments > 0 else None
 
     def validated_messages(self) -> list[ChatRoomMessage]:
+        return list(self.__parsed_messages())
+
+    def json_messages(self) -> list[ChatRoomMessageDict]:
+        """
+        The stored messages in date order, as they are. Serving them needs no
+        parsing, they were dumped to JSON when stored.
+        """
         return sorted(
-            map(lambda message: ChatRoomMessage(**message), self.messages),
-            key=lambda message: message.date,
-            reverse=False,
+            cast(list[ChatRoomMessageDict], self.messages),
+            key=_stored_message_date,
         )
 
+    def llm_messages(self) -> list[LLMMessageDict]:
+        return [message.as_llm_message_dict for message in self.__parsed_messages()]
+
     def add_messages(
-        self, messages: list[ChatRoomMessage], session: Session
+        self, messages: list[ChatRoomMessage], session: Session, commit: bool = True
     ) -> "ChatRoom":
-        all_messages = self.validated_messages()
-        all_messages.extend(messages)
-        self.messages = list(
-            map(lambda message: message.model_dump(mode="json"), all_messages)
+        """
+        Append `messages` to the room as stored, re-read under a row lock: the
+        room in hand may predate a compaction, writing its array back would
+        restore the archived messages. Returns the locked room.
+        """
+        room = ChatRoom.get(
+            session=session, owner_id=self.owner_id, room_id=self.id, for_update=True
         )
+        if room is None:
+            raise AgentsPlayNotFoundError
 
-        session.add(self)
-        session.commit()
+        parsed_messages = get_chat_room_messages_cache().get(
+            key=room.id, version=room.updated_at
+        )
+        # Stored messages are already JSON, only the new ones need dumping
+        room.messages = [
+            *room.messages,
+            *chat_room_messages_adapter.dump_python(messages, mode="json"),
+        ]
+        room.message_count = len(room.messages)
 
-        room = self
+        session.add(room)
+        ChatMessageSearch.index_messages(
+            owner_id=room.owner_id, room_id=room.id, messages=messages, session=session
+        )
+        if settings.llm_memory_enabled:
+            ChatRoomEmbedding.index_messages(
+                owner_id=room.owner_id,
+                room_id=room.id,
+                stored_messages=room.messages,
+                session=session,
+            )
+        if not commit:
+            return room
+
+        session.commit()
         session.refresh(room)
 
+        if parsed_messages is not None:
+            get_chat_room_messages_cache().set(
+                key=room.id,
+                version=room.updated_at,
+                value=_sorted_messages([*parsed_messages, *messages]),
+            )
+
         return room
 
+    def memory_llm_messages(self, query: str, session: Session) -> list[LLMMessageDict]:
+        """
+        The most recent messages plus the older turns most relevant to `query`,
+        so the prompt stays about the same size however long the room gets.
+        """
+        messages = self.__parsed_messages()
+        recent_start = max(len(messages) - settings.llm_memory_recent_messages, 0)
+        if (
+            not settings.llm_memory_enabled
+            or recent_start <= 2 * settings.llm_memory_top_k
+        ):
+            return self.llm_messages()
+
+        older_messages = messages[:recent_start]
+        older_message_ids = {str(message.id) for message in older_messages}
+
+        embedder = get_embedder()
+        message_ids, embeddings = ChatRoomEmbedding.load(
+            session=session, owner_id=self.owner_id, room_id=self.id, embedder=embedder
+        )
+        indexed_ids = set(message_ids)
+        unindexed_messages = [
+            message for message in older_messages if str(message.id) not in indexed_ids
+        ]
+        if unindexed_messages:
+            # Embedded for this read only, reads never write, the room's next
+            # turn stores them
+            message_ids = [
+                *message_ids,
+                *(str(message.id) for message in unindexed_messages),
+            ]
+            embeddings = np.concatenate(
+                [
+                    embeddings,
+                    embedder.embed([message.content for message in unindexed_messages]),
+                ]
+            )
+
+        mask = np.fromiter(
+            (message_id in older_message_ids for message_id in message_ids),
+            dtype=np.bool_,
+            count=len(message_ids),
+        )
+        indices, scores = cosine_top_k(
+            embedder.embed([query]),
+            embeddings,
+            k=settings.llm_memory_top_k,
+            mask=mask,
+        )
+        recalled_ids = [
+            message_ids[index]
+            for index, score in zip(indices[0], scores[0])
+            if score >= settings.llm_memory_min_score
+        ]
+
+        # Recall whole turns, a question means little without its answer
+        positions = {
+            str(message.id): position for position, message in enumerate(older_messages)
+        }
+        recalled_positions: set[int] = set()
+        for message_id in recalled_ids:
+            position = positions[message_id]
+            if older_messages[position].role == "user":
+                recalled_positions.update({position, position + 1})
+            else:
+                recalled_positions.update({position - 1, position})
+
+        recalled_messages = [
+            older_messages[position]
+            for position in sorted(recalled_positions)
+            if 0 <= position < recent_start
+        ]
+
+        return [
+            message.as_llm_message_dict
+            for message in [*recalled_messages, *messages[recent_start:]]
+        ]
+
+    def __parsed_messages(self) -> tuple[ChatRoomMessage, ...]:
+        parsed_messages = get_chat_room_messages_cache().get(
+            key=self.id, version=self.updated_at
+        )
+        if parsed_messages is None:
+            parsed_messages = _sorted_messages(
+                chat_room_messages_adapter.validate_python(self.messages)
+            )
+            get_chat_room_messages_cache().set(
+                key=self.id, version=self.updated_at, value=parsed_messages
+            )
+
+        return parsed_messages
+
+    @staticmethod
+    def get(
+        session: Session,
+        owner_id: uuid.UUID,
+        room_id: uuid.UUID,
+        for_update: bool = False,
+        with_messages: bool = True,
+    ) -> "ChatRoom | None":
+        return session.get(
+            ChatRoom,
+            {"owner_id": owner_id, "id": room_id},
+            with_for_update=for_update,
+            # A locked read must see the row as committed, not as loaded before
+            populate_existing=for_update,
+            options=_room_load_options(with_messages),
+        )
+
     @staticmethod
-    def list(session: Session) -> Sequence["ChatRoom"]:
-        query = select(ChatRoom).order_by(col(ChatRoom.updated_at).desc())
+    def messages_after(
+        session: Session, owner_id: uuid.UUID, room_id: uuid.UUID, message_id: uuid.UUID
+    ) -> list[ChatRoomMessageDict] | None:
+        """
+        The room's stored messages after `message_id`, sliced out of the array
+        by the database. None when the message isn't in the room.
+        """
+        stored = (
+            func.unnest(col(ChatRoom.messages))
+            .table_valued("message", with_ordinality="position")
+            .render_derived(name="stored")
+        )
+        position = (
+            select(stored.c.position)
+            .where(stored.c.message.op("->>")("id") == str(message_id))
+            .scalar_subquery()
+        )
+        query = (
+            select(col(ChatRoom.messages)[position + 1 : col(ChatRoom.message_count)])
+            .where(col(ChatRoom.owner_id) == owner_id)
+            .where(col(ChatRoom.id) == room_id)
+        )
+        messages = session.execute(query).scalar()
+        if messages is None:
+            return None
+
+        return sorted(
+            cast(list[ChatRoomMessageDict], messages), key=_stored_message_date
+        )
+
+    @staticmethod
+    def list(session: Session, owner_id: uuid.UUID) -> Sequence["ChatRoom"]:
+        query = (
+            select(ChatRoom)
+            .where(col(ChatRoom.owner_id) == owner_id)
+            .order_by(col(ChatRoom.updated_at).desc())
+        )
 
         return session.exec(query).all()
 
+    @staticmethod
+    def latest(
+        session: Session, owner_id: uuid.UUID, with_messages: bool = True
+    ) -> "ChatRoom | None":
+        query = (
+            select(ChatRoom)
+            .options(*_room_load_options(with_messages))
+            .where(col(ChatRoom.owner_id) == owner_id)
+            .order_by(col(ChatRoom.updated_at).desc())
+            .limit(1)
+        )
+
+        return session.exec(query).first()
+
+    @staticmethod
+    def version(
+        session: Session, owner_id: uuid.UUID, room_id: uuid.UUID | None = None
+    ) -> ChatRoomVersion | None:
+        """
+        Version of the given room, or of the owner's latest one, read without
+        loading the messages themselves.
+        """
+        query = select(
+            col(ChatRoom.id), col(ChatRoom.updated_at), col(ChatRoom.message_count)
+        ).where(col(ChatRoom.owner_id) == owner_id)
+        if room_id is not None:
+            query = query.where(col(ChatRoom.id) == room_id)
+        else:
+            query = query.order_by(col(ChatRoom.updated_at).desc()).limit(1)
+
+        row = session.exec(query).first()
+        if row is None:
+            return None
+
+        id, updated_at, message_count = row
+
+        return ChatRoomVersion(
+            id=id, updated_at=updated_at, message_count=message_count
+        )
+
     @staticmethod
     def create(
-        payload: CreateChatRoomPayload, session: Session, commit: bool = True
+        payload: CreateChatRoomPayload,
+        owner_id: uuid.UUID,
+        session: Session,
+        commit: bool = True,
     ) -> "ChatRoom":
         if len(payload.question.content.strip()) == 0:
             raise AgentsPlayBadRequestError
@@ -72,12 +374,531 @@ class ChatRoom(SQLModel, table=True):
         ]
 
         room = ChatRoom(
-            title=payload.question.content.strip()[:CHAT_ROOM_MAX_TITLE_LENGTH],
+            owner_id=owner_id,
+            title=chat_room_title(payload.question),
             messages=messages,
+            message_count=len(messages),
         )
+        if payload.room_id is not None:
+            room.id = payload.room_id
 
         session.add(room)
+        # Flushed first, the search rows reference the room
+        session.flush()
+        ChatMessageSearch.index_messages(
+            owner_id=owner_id,
+            room_id=room.id,
+            messages=[payload.question, payload.answer],
+            session=session,
+        )
+        if settings.llm_memory_enabled:
+            ChatRoomEmbedding.index_messages(
+                owner_id=owner_id,
+                room_id=room.id,
+                stored_messages=messages,
+                session=session,
+            )
         if commit:
             session.commit()
 
         return room
+
+
+class ChatRoomEmbedding(SQLModel, table=True):
+    """
+    Embedding of one chat message, a float32 vector, kept next to the room so
+    relevant past turns can be recalled without sending the whole history to
+    the agent. A row per message, a turn only inserts its own vectors.
+    """
+
+    __tablename__: str = "chat_room_embedding"  # type: ignore
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["owner_id", "room_id"], ["chat_room.owner_id", "chat_room.id"]
+        ),
+        OWNER_HASH_PARTITIONED,
+    )
+
+    owner_id: uuid.UUID = Field(primary_key=True)
+    room_id: uuid.UUID = Field(primary_key=True)
+    message_id: uuid.UUID = Field(primary_key=True)
+    # Vectors of a different embedder are not comparable, they are replaced
+    embedder: str
+    embedding: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+
+    @staticmethod
+    def load(
+        session: Session, owner_id: uuid.UUID, room_id: uuid.UUID, embedder: Embedder
+    ) -> tuple[list[str], EmbeddingMatrix]:
+        """The room's message ids and their vectors, a row each."""
+        rows = session.exec(
+            select(col(ChatRoomEmbedding.message_id), col(ChatRoomEmbedding.embedding))
+            .where(col(ChatRoomEmbedding.owner_id) == owner_id)
+            .where(col(ChatRoomEmbedding.room_id) == room_id)
+            .where(col(ChatRoomEmbedding.embedder) == embedder.name)
+        ).all()
+        matrix = np.frombuffer(
+            b"".join(embedding for _, embedding in rows), dtype=np.float32
+        ).reshape(-1, embedder.dimensions)
+
+        return [str(message_id) for message_id, _ in rows], matrix
+
+    @staticmethod
+    def index_messages(
+        owner_id: uuid.UUID,
+        room_id: uuid.UUID,
+        stored_messages: Sequence[dict[str, Any]],
+        session: Session,
+        embedder: Embedder | None = None,
+    ) -> None:
+        """
+        Embed the stored messages not indexed yet and insert their rows. Those
+        of rooms written before the index existed, or indexed by a different
+        embedder, are caught up with the room's next turn.
+        """
+        if embedder is None:
+            embedder = get_embedder()
+
+        indexed_ids: set[str] = set()
+        outdated_ids: list[uuid.UUID] = []
+        for message_id, message_embedder in session.exec(
+            select(col(ChatRoomEmbedding.message_id), col(ChatRoomEmbedding.embedder))
+            .where(col(ChatRoomEmbedding.owner_id) == owner_id)
+            .where(col(ChatRoomEmbedding.room_id) == room_id)
+        ):
+            if message_embedder == embedder.name:
+                indexed_ids.add(str(message_id))
+            else:
+                outdated_ids.append(message_id)
+
+        if outdated_ids:
+            session.execute(
+                delete(ChatRoomEmbedding)
+                .where(col(ChatRoomEmbedding.owner_id) == owner_id)
+                .where(col(ChatRoomEmbedding.room_id) == room_id)
+                .where(col(ChatRoomEmbedding.message_id).in_(outdated_ids))
+            )
+
+        new_messages = [
+            message for message in stored_messages if message["id"] not in indexed_ids
+        ]
+        if not new_messages:
+            return
+
+        embeddings = embedder.embed([message["content"] for message in new_messages])
+        # Replayed turns insert their messages again, those are skipped
+        session.execute(
+            postgresql_insert(ChatRoomEmbedding)
+            .values(
+                [
+                    {
+                        "owner_id": owner_id,
+                        "room_id": room_id,
+                        "message_id": uuid.UUID(message["id"]),
+                        "embedder": embedder.name,
+                        "embedding": embedding.astype(np.float32).tobytes(),
+                    }
+                    for message, embedding in zip(new_messages, embeddings)
+                ]
+            )
+            .on_conflict_do_nothing()
+        )
+
+
+class ChatMessageSearch(SQLModel, table=True):
+    """
+    One row per chat message with its text search vector, written with the
+    turn adding the message, so searching an owner's rooms never reads their
+    `messages` arrays. Postgres only.
+    """
+
+    __tablename__: str = "chat_message_search"  # type: ignore
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["owner_id", "room_id"], ["chat_room.owner_id", "chat_room.id"]
+        ),
+        OWNER_HASH_PARTITIONED,
+    )
+
+    owner_id: uuid.UUID = Field(primary_key=True)
+    room_id: uuid.UUID = Field(primary_key=True)
+    message_id: uuid.UUID = Field(primary_key=True)
+    role: str
+    date: datetime = Field(sa_column=Column(DateTime(timezone=True), nullable=False))
+    content: str = Field(sa_column=Column(Text, nullable=False))
+    # The archive segment holding the message, None while it is in the room
+    archive_segment: int | None = None
+    search_vector: str | None = Field(
+        default=None,
+        sa_column=Column(
+            TSVECTOR,
+            Computed(
+                CHAT_SEARCH_VECTOR_SQL.format(text_config="english"), persisted=True
+            ),
+        ),
+    )
+
+    @staticmethod
+    def index_messages(
+        owner_id: uuid.UUID,
+        room_id: uuid.UUID,
+        messages: Sequence[ChatRoomMessage],
+        session: Session,
+    ) -> None:
+        if not messages:
+            return
+
+        # Replayed turns insert their messages again, those are skipped
+        session.execute(
+            postgresql_insert(ChatMessageSearch)
+            .values(
+                [
+                    {
+                        "owner_id": owner_id,
+                        "room_id": room_id,
+                        "message_id": message.id,
+                        "role": message.role,
+                        "date": message.date,
+                        "content": message.content,
+                    }
+                    for message in messages
+                ]
+            )
+            .on_conflict_do_nothing()
+        )
+
+    @staticmethod
+    def search(
+        session: Session, owner_id: uuid.UUID, payload: SearchChatMessagesPayload
+    ) -> tuple[list[ChatMessageSearchHit], str | None]:
+        """
+        The owner's messages matching `payload.q`, best ranked first, then
+        newest first. Pages are keyset paginated on that order.
+        """
+        text_config: ColumnElement[Any] = literal_column(
+            f"'{settings.llm_search_text_config}'::regconfig"
+        )
+        content = col(ChatMessageSearch.content)
+        if payload.match == "fuzzy":
+            if not settings.llm_search_trigram_enabled:
+                raise AgentsPlayBadRequestError
+
+            rank = func.word_similarity(payload.q, content)
+            matches = literal(payload.q).op("<%")(content)
+            headline_query = func.plainto_tsquery(text_config, payload.q)
+        else:
+            headline_query = func.websearch_to_tsquery(text_config, payload.q)
+            rank = func.ts_rank_cd(col(ChatMessageSearch.search_vector), headline_query)
+            matches = col(ChatMessageSearch.search_vector).op("@@")(headline_query)
+
+        # Pins the query to the owner's partition
+        filters: list[Any] = [col(ChatMessageSearch.owner_id) == owner_id, matches]
+        if payload.cursor is not None:
+            cursor_rank, cursor_date, cursor_message_id = _decode_search_cursor(
+                payload.cursor
+            )
+            filters.append(
+                tuple_(
+                    rank,
+                    col(ChatMessageSearch.date),
+                    col(ChatMessageSearch.message_id),
+                )
+                < tuple_(
+                    # Ranks are reals, compared as doubles no tie would match
+                    literal(cursor_rank).cast(REAL),
+                    literal(cursor_date, DateTime(timezone=True)),
+                    literal(cursor_message_id),
+                )
+            )
+
+        # Postgres builds the headlines after the limit, only for the page
+        query = (
+            select(  # type: ignore[call-overload]
+                col(ChatMessageSearch.room_id),
+                col(ChatMessageSearch.message_id),
+                col(ChatMessageSearch.role),
+                col(ChatMessageSearch.date),
+                col(ChatMessageSearch.archive_segment),
+                func.ts_headline(
+                    text_config, content, headline_query, CHAT_SEARCH_HEADLINE_OPTIONS
+                ).label("snippet"),
+                rank.label("rank"),
+            )
+            .where(*filters)
+            .order_by(
+                rank.desc(),
+                col(ChatMessageSearch.date).desc(),
+                col(ChatMessageSearch.message_id).desc(),
+            )
+            .limit(payload.limit + 1)
+        )
+        hits = [
+            ChatMessageSearchHit.model_validate(row._mapping)
+            for row in session.execute(query)
+        ]
+
+        next_cursor: str | None = None
+        if len(hits) > payload.limit:
+            hits = hits[: payload.limit]
+            next_cursor = _encode_search_cursor(hits[-1])
+
+        return hits, next_cursor
+
+
+class ChatRoomArchive(SQLModel, table=True):
+    """
+    Older messages of a room, moved out of its row so reading and writing the
+    room stays proportional to its recent history. Every segment is a zstd
+    compressed JSON array of stored messages, only read when a client pages
+    back that far.
+    """
+
+    __tablename__: str = "chat_room_archive"  # type: ignore
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["owner_id", "room_id"], ["chat_room.owner_id", "chat_room.id"]
+        ),
+        OWNER_HASH_PARTITIONED,
+    )
+
+    owner_id: uuid.UUID = Field(primary_key=True)
+    room_id: uuid.UUID = Field(primary_key=True)
+    segment: int = Field(primary_key=True)
+    message_count: int
+    first_message_date: datetime = Field(
+        sa_column=Column(DateTime(timezone=True), nullable=False)
+    )
+    last_message_date: datetime = Field(
+        sa_column=Column(DateTime(timezone=True), nullable=False)
+    )
+    summary: str
+    messages_zstd: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+
+    @property
+    def previous_segment(self) -> int | None:
+        return self.segment - 1 if self.segment > 0 else None
+
+    def iter_messages_json(self) -> Iterator[bytes]:
+        """The segment's JSON array, decompressed a chunk at a time."""
+        yield from zstandard.ZstdDecompressor().read_to_iter(self.messages_zstd)
+
+    @staticmethod
+    def get(
+        session: Session, owner_id: uuid.UUID, room_id: uuid.UUID, segment: int
+    ) -> "ChatRoomArchive | None":
+        return session.get(
+            ChatRoomArchive,
+            {"owner_id": owner_id, "room_id": room_id, "segment": segment},
+        )
+
+    @staticmethod
+    def compact(
+        room: ChatRoom,
+        session: Session,
+        archive_before: datetime,
+        keep_recent: int,
+        min_messages: int,
+        segment_messages: int,
+        zstd_level: int,
+    ) -> int:
+        """
+        Move the room's messages older than `archive_before` into new archive
+        segments, keeping at least the `keep_recent` latest messages and never
+        splitting a turn. Nothing moves until `min_messages` would, so
+        segments don't end up tiny. Returns the number of messages moved.
+
+        The room should be locked, a turn written meanwhile would put the
+        archived messages back.
+        """
+        messages = room.json_messages()
+        archived_count = 0
+        for message in messages[: max(len(messages) - keep_recent, 0)]:
+            if _stored_message_date(message) >= archive_before:
+                break
+            archived_count += 1
+        # A question stays with its answer
+        while archived_count > 0 and messages[archived_count - 1]["role"] == "user":
+            archived_count -= 1
+        if archived_count < min_messages:
+            return 0
+
+        compressor = zstandard.ZstdCompressor(level=zstd_level)
+        for start in range(0, archived_count, segment_messages):
+            segment_messages_json = messages[
+                start : min(start + segment_messages, archived_count)
+            ]
+            # Search hits keep finding the messages, in their segment now
+            session.execute(
+                update(ChatMessageSearch)
+                .where(col(ChatMessageSearch.owner_id) == room.owner_id)
+                .where(col(ChatMessageSearch.room_id) == room.id)
+                .where(
+                    col(ChatMessageSearch.message_id).in_(
+                        [uuid.UUID(message["id"]) for message in segment_messages_json]
+                    )
+                )
+                .values(archive_segment=room.archived_segments)
+            )
+            session.add(
+                ChatRoomArchive(
+                    owner_id=room.owner_id,
+                    room_id=room.id,
+                    segment=room.archived_segments,
+                    message_count=len(segment_messages_json),
+                    first_message_date=_stored_message_date(segment_messages_json[0]),
+                    last_message_date=_stored_message_date(segment_messages_json[-1]),
+                    summary=_archive_summary(segment_messages_json),
+                    messages_zstd=compressor.compress(
+                        orjson.dumps(segment_messages_json)
+                    ),
+                )
+            )
+            room.archived_segments += 1
+
+        # Memories are only recalled from the room, the archive's are dropped
+        session.execute(
+            delete(ChatRoomEmbedding)
+            .where(col(ChatRoomEmbedding.owner_id) == room.owner_id)
+            .where(col(ChatRoomEmbedding.room_id) == room.id)
+            .where(
+                col(ChatRoomEmbedding.message_id).in_(
+                    [uuid.UUID(message["id"]) for message in messages[:archived_count]]
+                )
+            )
+        )
+
+        room.archive_summary = _archive_summary(
+            messages[:archived_count], previous_summary=room.archive_summary
+        )
+        room.messages = cast(list[dict[str, Any]], messages[archived_count:])
+        room.message_count = len(room.messages)
+        # Compaction is no activity, the room must not become the owner's
+        # latest, but cached messages still have to see a new version
+        room.updated_at = room.updated_at + timedelta(microseconds=1)
+        session.add(room)
+
+        return archived_count
+
+
+Index(
+    "ix_chat_message_search_vector",
+    col(ChatMessageSearch.search_vector),
+    postgresql_using="gin",
+)
+
+
+def _configure_chat_message_search(target: Table, *args: Any, **kwargs: Any) -> None:
+    """Settings are read when the table is created, not when this is imported."""
+    computed = target.c.search_vector.computed
+    assert computed is not None
+    computed.sqltext = text(
+        CHAT_SEARCH_VECTOR_SQL.format(text_config=settings.llm_search_text_config)
+    )
+
+
+def _create_chat_message_search_trigram_index(
+    target: Table, connection: Connection, **kwargs: Any
+) -> None:
+    if not settings.llm_search_trigram_enabled:
+        return
+
+    Index(
+        "ix_chat_message_search_content_trgm",
+        target.c.content,
+        postgresql_using="gin",
+        postgresql_ops={"content": "gin_trgm_ops"},
+    ).create(connection)
+
+
+_chat_message_search_table = SQLModel.metadata.tables[ChatMessageSearch.__tablename__]
+event.listen(
+    _chat_message_search_table, "before_create", _configure_chat_message_search
+)
+event.listen(
+    _chat_message_search_table,
+    "after_create",
+    _create_chat_message_search_trigram_index,
+)
+
+
+Index(
+    "ix_chat_room_owner_id_updated_at",
+    col(ChatRoom.owner_id),
+    col(ChatRoom.updated_at).desc(),
+)
+
+
+__chat_room_messages_cache: VersionedCache[tuple[ChatRoomMessage, ...]] | None = None
+
+
+def get_chat_room_messages_cache() -> VersionedCache[tuple[ChatRoomMessage, ...]]:
+    """Parsed messages per room, valid for as long as the room's `updated_at` is."""
+    global __chat_room_messages_cache
+
+    if __chat_room_messages_cache is None:
+        __chat_room_messages_cache = VersionedCache(
+            max_entries=settings.llm_messages_cache_max_entries
+        )
+
+    return __chat_room_messages_cache
+
+
+def _room_load_options(with_messages: bool) -> list[ORMOption]:
+    return [] if with_messages else [defer(ChatRoom.messages)]  # type: ignore[arg-type]
+
+
+def _sorted_messages(messages: list[ChatRoomMessage]) -> tuple[ChatRoomMessage, ...]:
+    return tuple(sorted(messages, key=lambda message: message.date))
+
+
+def _stored_message_date(message: ChatRoomMessageDict) -> datetime:
+    return datetime.fromisoformat(message["date"])
+
+
+def _encode_search_cursor(hit: ChatMessageSearchHit) -> str:
+    raw_cursor = f"{hit.rank!r}|{hit.date.isoformat()}|{hit.message_id}"
+
+    return base64.urlsafe_b64encode(raw_cursor.encode()).decode()
+
+
+def _decode_search_cursor(cursor: str) -> tuple[float, datetime, uuid.UUID]:
+    try:
+        raw_cursor = base64.urlsafe_b64decode(cursor.encode()).decode()
+        raw_rank, raw_date, raw_message_id = raw_cursor.split("|", 2)
+
+        return (
+            float(raw_rank),
+            datetime.fromisoformat(raw_date),
+            uuid.UUID(raw_message_id),
+        )
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise AgentsPlayBadRequestError
+
+
+def _archive_summary(
+    messages: list[ChatRoomMessageDict], previous_summary: str | None = None
+) -> str:
+    """
+    The dates of the archived messages and the first few questions asked in
+    them, enough for a client to tell whether paging back is worth it.
+    """
+    questions = [
+        message["content"].strip()[:CHAT_ARCHIVE_SUMMARY_QUESTION_LENGTH]
+        for message in messages
+        if message["role"] == "user"
+    ][:CHAT_ARCHIVE_SUMMARY_QUESTIONS]
+    summary = (
+        f"{len(messages)} messages from {messages[0]['date'][:10]} "
+        f"to {messages[-1]['date'][:10]}: {'; '.join(questions)}"
+    )
+    if previous_summary is None:
+        return summary
+
+    # One line per compaction, the oldest ones drop off
+    lines = [*previous_summary.splitlines(), summary]
+
+    return "\n".join(lines[-CHAT_ARCHIVE_SUMMARY_MAX_LINES:])
+
+
+def chat_room_title(question: ChatRoomMessage) -> str:
+    return question.content.strip()[:CHAT_ROOM_MAX_TITLE_LENGTH]
@@ -0,0 +1,24 @@
+from todos.graph import TodosGraphState
+
+
+def todos_summary_prompt(user_input: str, todos_state: TodosGraphState) -> str:
+    todos_ok_result = todos_state.ok_result
+    assert todos_ok_result is not None
+
+    if todos_ok_result.action == "create":
+        if todos_state.new_todo:
+            return f"The user asked: '{user_input}'. I successfully created a new todo item with the title '{todos_state.new_todo.title}'. Please provide a helpful response confirming the todo was created."
+
+        return f"The user asked: '{user_input}'. I determined this was a todo creation request, but no todo was actually created. Please explain this to the user."
+
+    if todos_ok_result.action == "list":
+        if not todos_state.todos:
+            return f"The user asked: '{user_input}'. They currently have no todos in their list. Please let them know their todo list is empty."
+
+        todos_list = "\n".join([f"- {todo.title}" for todo in todos_state.todos])
+        if todos_state.todos_remaining > 0:
+            todos_list += f"\n(and {todos_state.todos_remaining} more not shown)"
+
+        return f"The user asked: '{user_input}'. Here are their most recently updated todos:\n{todos_list}\n\nPlease provide a helpful response showing them their todo list, including how many more todos exist if some were not shown."
+
+    return f"The user asked: '{user_input}'. I determined this was a todo-related request but the action '{todos_ok_result.action}' is not supported. Please explain this to the user."
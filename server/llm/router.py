@@ -1,27 +1,46 @@
+import uuid
 from http import HTTPStatus
 from typing import Annotated
 
+from common.disconnects import cancel_on_disconnect
 from common.exceptions import ErrorResponse
-from fastapi import APIRouter, Depends
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    Query,
+    Request,
+    Response,
+    WebSocket,
+)
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
+from llm.chat_socket import ChatSocket
 from llm.controller import LLMControllable, get_llm_controller
 from llm.schemas import (
+    ChatArchiveSegmentResponse,
     CreateChatMessagePayload,
     CreateChatMessageResponse,
     ListChatMessagesResponse,
+    SearchChatMessagesPayload,
+    SearchChatMessagesResponse,
 )
 
-llm_router = APIRouter(prefix="/llm")
+llm_router = APIRouter(prefix="/llm", default_response_class=ORJSONResponse)
 
 
 @llm_router.get(
     "/chats/messages",
     status_code=HTTPStatus.OK,
+    response_model=ListChatMessagesResponse,
     responses={
         HTTPStatus.OK: {
             "model": ListChatMessagesResponse,
             "description": "Returns the requesting users chat rooms",
         },
+        HTTPStatus.NOT_MODIFIED: {
+            "description": "Chat messages did not change since the given ETag",
+        },
         HTTPStatus.UNAUTHORIZED: {
             "model": ErrorResponse,
             "description": "Resources requested while unauthorized",
@@ -34,8 +53,83 @@ llm_router = APIRouter(prefix="/llm")
 )
 def list_chat_messages(
     controller: Annotated[LLMControllable, Depends(get_llm_controller)],
-) -> ListChatMessagesResponse:
-    return controller.list_chat_messages()
+    since: uuid.UUID | None = None,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> Response:
+    etag = controller.chat_messages_etag()
+    if if_none_match is not None and _etag_matches(if_none_match, etag):
+        # Compressed or not depending on the client, caches must key on it
+        return Response(
+            status_code=HTTPStatus.NOT_MODIFIED,
+            headers={"ETag": etag, "Vary": "Accept-Encoding"},
+        )
+
+    # The body's own ETag, it may be read from another replica than the one
+    # checked above
+    chat_messages, etag = controller.list_chat_messages(since=since)
+
+    # Already JSON, returned as a response so FastAPI does not validate every
+    # message against `ListChatMessagesResponse` again
+    return ORJSONResponse(
+        content=chat_messages, headers={"ETag": etag, "Vary": "Accept-Encoding"}
+    )
+
+
+@llm_router.get(
+    "/chats/{room_id}/archive/{segment}",
+    status_code=HTTPStatus.OK,
+    response_model=ChatArchiveSegmentResponse,
+    responses={
+        HTTPStatus.OK: {
+            "model": ChatArchiveSegmentResponse,
+            "description": "Returns one archived segment of a chat room's history",
+        },
+        HTTPStatus.UNAUTHORIZED: {
+            "model": ErrorResponse,
+            "description": "Resources requested while unauthorized",
+        },
+        HTTPStatus.NOT_FOUND: {
+            "model": ErrorResponse,
+            "description": "Chat room or archive segment not found",
+        },
+    },
+)
+def read_chat_archive_segment(
+    room_id: uuid.UUID,
+    segment: int,
+    controller: Annotated[LLMControllable, Depends(get_llm_controller)],
+) -> Response:
+    # Messages are streamed as they decompress, see `ListChatMessagesResponse`
+    # for where paging back starts
+    return StreamingResponse(
+        controller.stream_chat_archive_segment(room_id=room_id, segment=segment),
+        media_type="application/json",
+    )
+
+
+@llm_router.get(
+    "/chats/search",
+    status_code=HTTPStatus.OK,
+    responses={
+        HTTPStatus.OK: {
+            "model": SearchChatMessagesResponse,
+            "description": "Returns the best matching chat messages with snippets",
+        },
+        HTTPStatus.BAD_REQUEST: {
+            "model": ErrorResponse,
+            "description": "Invalid cursor, or fuzzy matching is not enabled",
+        },
+        HTTPStatus.UNAUTHORIZED: {
+            "model": ErrorResponse,
+            "description": "Resources requested while unauthorized",
+        },
+    },
+)
+def search_chat_messages(
+    payload: Annotated[SearchChatMessagesPayload, Query()],
+    controller: Annotated[LLMControllable, Depends(get_llm_controller)],
+) -> SearchChatMessagesResponse:
+    return controller.search_chat_messages(payload)
 
 
 @llm_router.post(
@@ -58,10 +152,49 @@ def list_chat_messages(
             "model": ErrorResponse,
             "description": "Something unexpected went wrong",
         },
+        HTTPStatus.GATEWAY_TIMEOUT: {
+            "model": ErrorResponse,
+            "description": "The chat response could not be produced in time",
+        },
     },
 )
 async def create_chat_message(
+    request: Request,
     payload: CreateChatMessagePayload,
     controller: Annotated[LLMControllable, Depends(get_llm_controller)],
+    idempotency_key: Annotated[str | None, Header(max_length=255)] = None,
 ) -> CreateChatMessageResponse:
-    return await controller.create_chat_message(payload)
+    """
+    Retrying with the same `Idempotency-Key` header resumes the failed run
+    from its last completed step when checkpointing is enabled.
+    """
+    return await cancel_on_disconnect(
+        request,
+        controller.create_chat_message(payload, idempotency_key=idempotency_key),
+    )
+
+
+@llm_router.websocket("/ws")
+async def chat_socket(
+    websocket: WebSocket,
+    controller: Annotated[LLMControllable, Depends(get_llm_controller)],
+) -> None:
+    """
+    Chat over one long-lived connection. The client sends
+    `{"type": "message", "id": ..., "message": ...}` frames, any number of
+    them in flight, and `{"type": "cancel", "id": ...}` to drop one. Every
+    frame sent back carries the id of its message: `accepted`, `route`,
+    `tool_start`, `tool_end`, `token`, then `message` with the stored answer
+    or `error`. Pings must be answered with `{"type": "pong"}`.
+    """
+    await ChatSocket(websocket, controller).serve()
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+
+    return any(
+        candidate.strip().removeprefix("W/") == etag
+        for candidate in if_none_match.split(",")
+    )
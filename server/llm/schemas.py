@@ -1,9 +1,9 @@
 import uuid
 from datetime import datetime
-from typing import Literal
+from typing import Annotated, Any, Literal, TypedDict
 
 from common.schemas import CreatedResponse, OKResponse
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, TypeAdapter, field_validator
 
 AssistantMessageRole = Literal["assistant"]
 MessageRoles = Literal["user"] | AssistantMessageRole
@@ -14,6 +14,11 @@ class LLMMessage(BaseModel):
     content: str
 
 
+class LLMMessageDict(TypedDict):
+    role: MessageRoles
+    content: str
+
+
 class ChatRoomMessage(LLMMessage):
     id: uuid.UUID
     llm_provider: str
@@ -28,6 +33,13 @@ class ChatRoomMessage(LLMMessage):
     def as_llm_message(self) -> LLMMessage:
         return LLMMessage(role=self.role, content=self.content)
 
+    @property
+    def as_llm_message_dict(self) -> LLMMessageDict:
+        return {"role": self.role, "content": self.content}
+
+
+chat_room_messages_adapter = TypeAdapter(list[ChatRoomMessage])
+
 
 class CreateChatMessagePayload(BaseModel):
     message: str = Field(..., min_length=1)
@@ -41,6 +53,7 @@ class CreateChatMessagePayload(BaseModel):
 class CreateChatRoomPayload(BaseModel):
     question: ChatRoomMessage
     answer: ChatRoomMessage
+    room_id: uuid.UUID | None = None
 
 
 class CreateChatMessageResponse(CreatedResponse, ChatRoomMessage):
@@ -51,3 +64,121 @@ class CreateChatMessageResponse(CreatedResponse, ChatRoomMessage):
 
 class ListChatMessagesResponse(OKResponse):
     data: list[ChatRoomMessage]
+    cursor: uuid.UUID | None = None
+    room_id: uuid.UUID | None = None
+    # Older messages are paged in from the archive, latest segment first
+    archive_segment: int | None = None
+    archive_summary: str | None = None
+
+
+class ChatArchiveSegmentResponse(OKResponse):
+    previous_segment: int | None = None
+    summary: str
+    data: list[ChatRoomMessage]
+
+
+class ChatRoomMessageDict(LLMMessageDict):
+    """A `ChatRoomMessage` dumped to JSON, as chat rooms store them."""
+
+    id: str
+    llm_provider: str
+    llm_key: str
+    date: str
+
+
+class ListChatMessagesDict(TypedDict):
+    """A `ListChatMessagesResponse` ready to be serialized as it is."""
+
+    detail: Literal["OK"]
+    data: list[ChatRoomMessageDict]
+    cursor: str | None
+    room_id: str | None
+    archive_segment: int | None
+    archive_summary: str | None
+
+
+CHAT_SEARCH_MAX_LIMIT = 100
+
+# `words` matches stemmed words, `fuzzy` matches misspelled and partial words
+# too and needs the trigram index
+ChatSearchMatch = Literal["words", "fuzzy"]
+
+
+class SearchChatMessagesPayload(BaseModel):
+    q: str = Field(..., min_length=1, max_length=256)
+    match: ChatSearchMatch = "words"
+    limit: int = Field(default=20, ge=1, le=CHAT_SEARCH_MAX_LIMIT)
+    cursor: str | None = None
+
+    @field_validator("q", mode="before")
+    @classmethod
+    def strip_whitespaces(cls, v: str) -> str:
+        return v.strip()
+
+
+class ChatMessageSearchHit(BaseModel):
+    room_id: uuid.UUID
+    message_id: uuid.UUID
+    role: MessageRoles
+    date: datetime
+    # Matched words are wrapped in `<<` and `>>`
+    snippet: str
+    rank: float
+    # Set once the message moved out of the room into this archive segment
+    archive_segment: int | None = None
+
+
+class SearchChatMessagesResponse(OKResponse):
+    data: list[ChatMessageSearchHit]
+    next_cursor: str | None = None
+
+
+class ChatSocketMessageFrame(CreateChatMessagePayload):
+    type: Literal["message"]
+    # Chosen by the client, tags every frame sent back about this message
+    id: str = Field(..., min_length=1, max_length=64)
+
+
+class ChatSocketCancelFrame(BaseModel):
+    type: Literal["cancel"]
+    id: str
+
+
+class ChatSocketPingFrame(BaseModel):
+    type: Literal["ping"]
+
+
+class ChatSocketPongFrame(BaseModel):
+    type: Literal["pong"]
+
+
+ChatSocketClientFrame = Annotated[
+    ChatSocketMessageFrame
+    | ChatSocketCancelFrame
+    | ChatSocketPingFrame
+    | ChatSocketPongFrame,
+    Field(discriminator="type"),
+]
+
+chat_socket_client_frame_adapter: TypeAdapter[ChatSocketClientFrame] = TypeAdapter(
+    ChatSocketClientFrame
+)
+
+ChatSocketServerFrameType = Literal[
+    "accepted",
+    "route",
+    "tool_start",
+    "tool_end",
+    "token",
+    "message",
+    "cancelled",
+    "error",
+    "ping",
+    "pong",
+]
+
+
+class ChatSocketServerFrame(BaseModel):
+    type: ChatSocketServerFrameType
+    id: str | None = None
+    data: Any = None
@@ -1,10 +1,14 @@
+from common.deadlines import get_deadline
 from foreign_exchange.currencies import Currencies
 from foreign_exchange.graph import foreign_exchange_rate_invoke
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
 
 
 @tool
-async def get_exchange_rates_tool(user_request: str) -> dict[Currencies, float] | str:
+async def get_exchange_rates_tool(
+    user_request: str, config: RunnableConfig
+) -> dict[Currencies, float] | str:
     """
     Get current foreign exchange rates for various currencies based on user request.
 
@@ -35,7 +39,9 @@ async def get_exchange_rates_tool(user_request: str) -> dict[Currencies, float]
         If there's an error fetching the rates, a descriptive error message is returned.
     """
 
-    result = await foreign_exchange_rate_invoke(request=user_request)
+    result = await foreign_exchange_rate_invoke(
+        request=user_request, deadline=get_deadline(config)
+    )
     if result.failure_message is not None:
         return result.failure_message
 
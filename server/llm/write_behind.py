@@ -0,0 +1,416 @@
+import asyncio
+import fcntl
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import IO
+
+from common.exceptions import AgentsPlayServiceUnavailableError
+from common.flusher import BackgroundFlusher
+from database.database import Databaseable, get_database
+from pydantic import BaseModel
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlmodel import Session
+
+from llm.conf import settings
+from llm.models import ChatRoom
+from llm.schemas import ChatRoomMessage, CreateChatRoomPayload
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_PREFIX = "chat_turns"
+
+# Failures of the database itself rather than of the turns written, they
+# are retried without counting against the turns
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, PoolTimeoutError)
+
+
+class PendingChatTurn(BaseModel):
+    owner_id: uuid.UUID
+    room_id: uuid.UUID
+    question: ChatRoomMessage
+    answer: ChatRoomMessage
+
+
+class ChatTurnsWriteBehindStats(BaseModel):
+    queue_depth: int
+    max_pending: int
+    flushed_turns: int
+    flush_failures: int
+    dead_lettered_turns: int
+    recovered_turns: int
+    last_flush_batch_size: int
+    last_flush_seconds: float | None
+
+
+class ChatTurnsWriteBehind:
+    """
+    Takes chat turns off the response path. Turns are first appended to a
+    local SQLite journal, so they survive a crash, and then written to the
+    database by a background flusher in the order they were enqueued, each
+    room in its own transaction so a failing room doesn't hold up the others.
+
+    Every worker process journals to its own file, held under an exclusive
+    lock while the worker lives. Journals whose lock is free belong to a
+    worker that died, the next worker to start takes their turns over.
+    """
+
+    def __init__(
+        self,
+        database: Databaseable,
+        journal_dir: Path,
+        batch_size: int,
+        flush_interval_seconds: float,
+        max_pending: int,
+        max_attempts: int,
+    ) -> None:
+        self.database = database
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+
+        journal_dir.mkdir(parents=True, exist_ok=True)
+        journal_path = journal_dir / f"{JOURNAL_PREFIX}.{os.getpid()}.sqlite3"
+        # Locked before the journal exists, others never take it for an orphan
+        journal_lock = _lock_journal(journal_path)
+        if journal_lock is None:
+            raise RuntimeError(f"{journal_path} is locked by another process")
+        self.__journal_lock = journal_lock
+
+        self.__journal = sqlite3.connect(
+            journal_path, check_same_thread=False, isolation_level=None
+        )
+        self.__journal.execute("PRAGMA journal_mode=WAL")
+        self.__journal.execute(
+            "CREATE TABLE IF NOT EXISTS chat_turn "
+            "(seq INTEGER PRIMARY KEY AUTOINCREMENT, turn TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.__journal.execute(
+            "CREATE TABLE IF NOT EXISTS chat_turn_dead_letter "
+            "(seq INTEGER PRIMARY KEY AUTOINCREMENT, turn TEXT NOT NULL, "
+            "error TEXT NOT NULL, failed_at REAL NOT NULL)"
+        )
+        self.__lock = threading.Lock()
+        self.__flush_lock = threading.Lock()
+
+        self.recovered_turns = sum(
+            self.__recover_orphan(orphan_path)
+            for orphan_path in sorted(journal_dir.glob(f"{JOURNAL_PREFIX}*.sqlite3"))
+            if orphan_path != journal_path
+        )
+
+        self.__pending: dict[int, PendingChatTurn] = {}
+        self.__attempts: dict[int, int] = {}
+        for seq, turn, attempts in self.__journal.execute(
+            "SELECT seq, turn, attempts FROM chat_turn ORDER BY seq"
+        ):
+            self.__pending[seq] = PendingChatTurn.model_validate_json(turn)
+            self.__attempts[seq] = attempts
+        self.__flusher = BackgroundFlusher(self.flush, flush_interval_seconds)
+
+        self.flushed_turns = 0
+        self.flush_failures = 0
+        self.dead_lettered_turns = 0
+        self.last_flush_batch_size = 0
+        self.last_flush_seconds: float | None = None
+
+    def check_capacity(self) -> None:
+        """
+        Refuses new turns while the journal is full, before their answers are
+        generated for nothing.
+        """
+        with self.__lock:
+            queue_depth = len(self.__pending)
+
+        if queue_depth >= self.max_pending:
+            raise AgentsPlayServiceUnavailableError(
+                retry_after_seconds=math.ceil(self.flush_interval_seconds)
+            )
+
+    def enqueue(self, turn: PendingChatTurn) -> None:
+        """Journals the turn, blocks until it is on disk so call it off the loop."""
+        with self.__lock:
+            if len(self.__pending) >= self.max_pending:
+                raise AgentsPlayServiceUnavailableError(
+                    retry_after_seconds=math.ceil(self.flush_interval_seconds)
+                )
+
+            cursor = self.__journal.execute(
+                "INSERT INTO chat_turn (turn) VALUES (?)", (turn.model_dump_json(),)
+            )
+            assert cursor.lastrowid is not None
+
+            self.__pending[cursor.lastrowid] = turn
+            self.__attempts[cursor.lastrowid] = 0
+            queue_depth = len(self.__pending)
+
+        if queue_depth >= self.batch_size:
+            self.__flusher.wake()
+
+    def pending_turns(
+        self, owner_id: uuid.UUID, room_id: uuid.UUID
+    ) -> list[PendingChatTurn]:
+        with self.__lock:
+            return [
+                turn
+                for turn in self.__pending.values()
+                if turn.owner_id == owner_id and turn.room_id == room_id
+            ]
+
+    def latest_pending_room_id(self, owner_id: uuid.UUID) -> uuid.UUID | None:
+        with self.__lock:
+            return next(
+                (
+                    turn.room_id
+                    for turn in reversed(self.__pending.values())
+                    if turn.owner_id == owner_id
+                ),
+                None,
+            )
+
+    def stats(self) -> ChatTurnsWriteBehindStats:
+        with self.__lock:
+            queue_depth = len(self.__pending)
+
+        return ChatTurnsWriteBehindStats(
+            queue_depth=queue_depth,
+            max_pending=self.max_pending,
+            flushed_turns=self.flushed_turns,
+            flush_failures=self.flush_failures,
+            dead_lettered_turns=self.dead_lettered_turns,
+            recovered_turns=self.recovered_turns,
+            last_flush_batch_size=self.last_flush_batch_size,
+            last_flush_seconds=self.last_flush_seconds,
+        )
+
+    async def start(self) -> None:
+        await self.__flusher.start()
+
+    async def stop(self) -> None:
+        await self.__flusher.stop()
+
+        left = await asyncio.to_thread(self.flush_all)
+        if left:
+            # Kept in the journal, whichever worker starts next takes them over
+            logger.error(
+                "Stopped with %d chat turns not flushed, left in the journal", left
+            )
+
+    def flush_all(self) -> int:
+        """
+        Flushes until the journal is empty or a flush makes no progress,
+        returns how many turns are left.
+        """
+        while self.flush() > 0:
+            pass
+
+        with self.__lock:
+            return len(self.__pending)
+
+    def flush(self) -> int:
+        """
+        Writes the next batch, returns how many turns left the journal, either
+        written or moved to the dead letters.
+        """
+        with self.__flush_lock:
+            with self.__lock:
+                batch = list(self.__pending.items())[: self.batch_size]
+            if not batch:
+                return 0
+
+            start = time.perf_counter()
+            turns_by_room: dict[
+                tuple[uuid.UUID, uuid.UUID], list[tuple[int, PendingChatTurn]]
+            ] = {}
+            for seq, turn in batch:
+                turns_by_room.setdefault((turn.owner_id, turn.room_id), []).append(
+                    (seq, turn)
+                )
+
+            written_seqs: list[int] = []
+            dead_seqs: list[tuple[int, str]] = []
+            failed_seqs: list[int] = []
+            for (owner_id, room_id), room_turns in turns_by_room.items():
+                try:
+                    self.__write_room(
+                        owner_id=owner_id,
+                        room_id=room_id,
+                        turns=[turn for _, turn in room_turns],
+                    )
+                except TRANSIENT_ERRORS:
+                    self.flush_failures += 1
+                    logger.exception("Failed to flush the chat turns of %s", room_id)
+                    # The database is likely unreachable, the other rooms
+                    # would fail the same way
+                    break
+                except Exception as e:
+                    self.flush_failures += 1
+                    logger.exception("Failed to flush the chat turns of %s", room_id)
+                    with self.__lock:
+                        for seq, _ in room_turns:
+                            self.__attempts[seq] += 1
+                            if self.__attempts[seq] >= self.max_attempts:
+                                dead_seqs.append((seq, repr(e)))
+                            else:
+                                failed_seqs.append(seq)
+                    continue
+
+                written_seqs.extend(seq for seq, _ in room_turns)
+                self.database.record_write("chat_room", owner_id, room_id)
+
+            with self.__lock:
+                self.__journal.execute("BEGIN")
+                self.__journal.executemany(
+                    "UPDATE chat_turn SET attempts = attempts + 1 WHERE seq = ?",
+                    [(seq,) for seq in failed_seqs],
+                )
+                self.__journal.executemany(
+                    "INSERT INTO chat_turn_dead_letter (turn, error, failed_at) "
+                    "SELECT turn, ?, ? FROM chat_turn WHERE seq = ?",
+                    [(error, time.time(), seq) for seq, error in dead_seqs],
+                )
+                self.__journal.executemany(
+                    "DELETE FROM chat_turn WHERE seq = ?",
+                    [(seq,) for seq in written_seqs] + [(seq,) for seq, _ in dead_seqs],
+                )
+                self.__journal.execute("COMMIT")
+                for seq in written_seqs + [seq for seq, _ in dead_seqs]:
+                    del self.__pending[seq]
+                    del self.__attempts[seq]
+
+            if dead_seqs:
+                logger.error(
+                    "Moved %d chat turns to the dead letters after %d attempts",
+                    len(dead_seqs),
+                    self.max_attempts,
+                )
+
+            self.flushed_turns += len(written_seqs)
+            self.dead_lettered_turns += len(dead_seqs)
+            self.last_flush_batch_size = len(written_seqs)
+            self.last_flush_seconds = time.perf_counter() - start
+
+            return len(written_seqs) + len(dead_seqs)
+
+    def __write_room(
+        self, owner_id: uuid.UUID, room_id: uuid.UUID, turns: list[PendingChatTurn]
+    ) -> None:
+        messages = [
+            message for turn in turns for message in (turn.question, turn.answer)
+        ]
+        with Session(self.database.engine) as session:
+            room = ChatRoom.get(session=session, owner_id=owner_id, room_id=room_id)
+            if room is None:
+                room = ChatRoom.create(
+                    payload=CreateChatRoomPayload(
+                        question=turns[0].question,
+                        answer=turns[0].answer,
+                        room_id=room_id,
+                    ),
+                    owner_id=owner_id,
+                    session=session,
+                    commit=False,
+                )
+                messages = messages[2:]
+
+            if messages:
+                room.add_messages(messages=messages, session=session, commit=False)
+
+            session.commit()
+
+    def __recover_orphan(self, orphan_path: Path) -> int:
+        orphan_lock = _lock_journal(orphan_path)
+        if orphan_lock is None:
+            # Its worker is alive
+            return 0
+
+        try:
+            if not orphan_path.exists():
+                # Taken over by another worker meanwhile
+                return 0
+
+            orphan = sqlite3.connect(
+                f"file:{orphan_path}?mode=rw", uri=True, isolation_level=None
+            )
+            try:
+                turns = orphan.execute(
+                    "SELECT turn FROM chat_turn ORDER BY seq"
+                ).fetchall()
+                dead_letters: list[tuple[str, str, float]] = []
+                if orphan.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'chat_turn_dead_letter'"
+                ).fetchone():
+                    dead_letters = orphan.execute(
+                        "SELECT turn, error, failed_at FROM chat_turn_dead_letter "
+                        "ORDER BY seq"
+                    ).fetchall()
+            finally:
+                orphan.close()
+
+            self.__journal.execute("BEGIN")
+            self.__journal.executemany("INSERT INTO chat_turn (turn) VALUES (?)", turns)
+            self.__journal.executemany(
+                "INSERT INTO chat_turn_dead_letter (turn, error, failed_at) "
+                "VALUES (?, ?, ?)",
+                dead_letters,
+            )
+            self.__journal.execute("COMMIT")
+
+            for suffix in ("", "-wal", "-shm"):
+                Path(f"{orphan_path}{suffix}").unlink(missing_ok=True)
+            if turns:
+                logger.warning(
+                    "Took over %d chat turns of the orphaned journal %s",
+                    len(turns),
+                    orphan_path,
+                )
+
+            return len(turns)
+        finally:
+            orphan_path.with_suffix(".lock").unlink(missing_ok=True)
+            orphan_lock.close()
+
+
+def _lock_journal(journal_path: Path) -> IO[bytes] | None:
+    """
+    Takes the exclusive lock of a journal, None if another process holds it.
+    The lock goes away with its process, however it ends.
+    """
+    lock_file = open(journal_path.with_suffix(".lock"), "wb")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+
+    return lock_file
+
+
+__chat_turns_write_behind: ChatTurnsWriteBehind | None = None
+
+
+def get_chat_turns_write_behind() -> ChatTurnsWriteBehind | None:
+    global __chat_turns_write_behind
+
+    if not settings.llm_write_behind_enabled:
+        return None
+
+    if __chat_turns_write_behind is None:
+        __chat_turns_write_behind = ChatTurnsWriteBehind(
+            database=get_database(),
+            journal_dir=settings.llm_write_behind_journal_dir,
+            batch_size=settings.llm_write_behind_batch_size,
+            flush_interval_seconds=settings.llm_write_behind_flush_interval_seconds,
+            max_pending=settings.llm_write_behind_max_pending,
+            max_attempts=settings.llm_write_behind_max_attempts,
+        )
+
+    return __chat_turns_write_behind
@@ -0,0 +1,144 @@
+import os
+import uuid
+from collections.abc import Callable, Iterator
+from datetime import timedelta
+from typing import TYPE_CHECKING, cast
+
+import pytest
+from common.datetime_utils import datetime_now_with_timezone
+from sqlalchemy import Engine
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, Session, create_engine
+
+if TYPE_CHECKING:
+    from database.database import ReplicaStats
+
+# Settings are read on first use, the required ones only need to be present
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("FOREX_BASE_API_URL", "https://forex.example.com")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+
+class FakeDatabase:
+    """A single SQLite engine standing in for the writer and the replicas."""
+
+    def __init__(self, engine: Engine) -> None:
+        self.engine = engine
+        self.writes: list[tuple[str, uuid.UUID, uuid.UUID | None]] = []
+
+    def reader_engine(
+        self, scope: str, owner_id: uuid.UUID, room_id: uuid.UUID | None = None
+    ) -> Engine:
+        return self.engine
+
+    def record_write(
+        self, scope: str, owner_id: uuid.UUID, room_id: uuid.UUID | None = None
+    ) -> None:
+        self.writes.append((scope, owner_id, room_id))
+
+    def replicas_stats(self) -> list["ReplicaStats"]:
+        return []
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+class RecordingSession:
+    """Keeps the statements and objects a model method sends, for Postgres."""
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.statements = []
+        self.added = []
+
+    def execute(self, statement):
+        self.statements.append(statement)
+
+        return iter(self.rows)
+
+    def add(self, instance):
+        self.added.append(instance)
+
+    def sql(self):
+        return [
+            str(statement.compile(dialect=postgresql.dialect()))
+            for statement in self.statements
+        ]
+
+
+def create_tables(engine: Engine, *models: type[SQLModel]) -> None:
+    SQLModel.metadata.create_all(
+        engine,
+        tables=[
+            SQLModel.metadata.tables[cast(str, model.__tablename__)] for model in models
+        ],
+    )
+
+
+@pytest.fixture
+def sqlite_engine() -> Iterator[Callable[..., Engine]]:
+    """
+    In-memory SQLite engines with the tables of the given models, one
+    connection shared by every thread. Tables using Postgres only types can't
+    be created here.
+    """
+    engines: list[Engine] = []
+
+    def create(*models: type[SQLModel]) -> Engine:
+        engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        create_tables(engine, *models)
+        engines.append(engine)
+
+        return engine
+
+    yield create
+
+    for engine in engines:
+        engine.dispose()
+
+
+@pytest.fixture
+def owner_id() -> uuid.UUID:
+    return uuid.uuid4()
+
+
+@pytest.fixture
+def todos_engine(sqlite_engine: Callable[..., Engine], owner_id: uuid.UUID) -> Engine:
+    """Todos of the owner, two sharing a timestamp, and one of someone else."""
+    # Imported once the settings above are in place
+    from todos.models import Todo, TodosVersion, get_todos_list_cache
+
+    engine = sqlite_engine(Todo, TodosVersion)
+    now = datetime_now_with_timezone()
+    with Session(engine) as session:
+        for index, (title, completed) in enumerate(
+            [
+                ("Buy milk", False),
+                ("Call mom", True),
+                ("Buy bread", False),
+                ("Pay bills", True),
+                ("Buy 100% juice", False),
+            ]
+        ):
+            session.add(
+                Todo(
+                    owner_id=owner_id,
+                    title=title,
+                    completed=completed,
+                    updated_at=now - timedelta(minutes=index // 2),
+                )
+            )
+        session.add(Todo(owner_id=uuid.uuid4(), title="Buy someone else's"))
+        session.commit()
+
+    get_todos_list_cache().invalidate()
+
+    return engine
@@ -0,0 +1,150 @@
+import asyncio
+
+import pytest
+from common.exceptions import AgentsPlayServiceUnavailableError
+from llm.admission import AdmissionController
+
+
+async def _hold(admission, priority, started, release, order):
+    async with admission.admit(priority):
+        order.append(priority)
+        started.set()
+        await release.wait()
+
+
+def test_turns_over_the_limit_queue_cheap_ones_first():
+    admission = AdmissionController(max_in_flight=1, max_wait_seconds=5)
+    order: list[str] = []
+
+    async def run():
+        release = asyncio.Event()
+        first_started = asyncio.Event()
+        first = asyncio.create_task(
+            _hold(admission, "expensive", first_started, release, order)
+        )
+        await first_started.wait()
+
+        queued = [
+            asyncio.create_task(
+                _hold(admission, priority, asyncio.Event(), release, order)
+            )
+            for priority in ("expensive", "cheap")
+        ]
+        await asyncio.sleep(0.01)
+        stats = admission.stats()
+        assert stats.in_flight == 1
+        assert stats.queue_depth == {"cheap": 1, "expensive": 1}
+
+        release.set()
+        await asyncio.gather(first, *queued)
+
+    asyncio.run(run())
+
+    assert order == ["expensive", "cheap", "expensive"]
+    stats = admission.stats()
+    assert stats.in_flight == 0
+    assert stats.admitted == {"cheap": 1, "expensive": 2}
+
+
+def test_waiting_past_the_slo_times_out_with_retry_after():
+    admission = AdmissionController(max_in_flight=1, max_wait_seconds=0.05)
+
+    async def run():
+        release = asyncio.Event()
+        started = asyncio.Event()
+        holder = asyncio.create_task(
+            _hold(admission, "expensive", started, release, [])
+        )
+        await started.wait()
+
+        with pytest.raises(AgentsPlayServiceUnavailableError) as error:
+            async with admission.admit("expensive"):
+                pass
+
+        release.set()
+        await holder
+
+        return error.value
+
+    error = asyncio.run(run())
+
+    assert int(error.headers["Retry-After"]) >= 1
+    stats = admission.stats()
+    assert stats.timed_out["expensive"] == 1
+    assert stats.queue_depth == {"cheap": 0, "expensive": 0}
+    assert stats.in_flight == 0
+
+
+def test_turns_are_shed_up_front_when_the_estimated_wait_is_too_long():
+    admission = AdmissionController(max_in_flight=1, max_wait_seconds=1)
+    admission.run_seconds_ewma = 5.0
+
+    async def run():
+        release = asyncio.Event()
+        started = asyncio.Event()
+        holder = asyncio.create_task(
+            _hold(admission, "expensive", started, release, [])
+        )
+        await started.wait()
+
+        with pytest.raises(AgentsPlayServiceUnavailableError) as error:
+            async with admission.admit("cheap"):
+                pass
+
+        release.set()
+        await holder
+
+        return error.value
+
+    error = asyncio.run(run())
+
+    assert error.headers["Retry-After"] == "5"
+    assert admission.stats().shed["cheap"] == 1
+    assert admission.stats().admitted["cheap"] == 0
+
+
+def test_a_cancelled_waiter_gives_its_slot_back():
+    admission = AdmissionController(max_in_flight=1, max_wait_seconds=5)
+
+    async def run():
+        release = asyncio.Event()
+        started = asyncio.Event()
+        holder = asyncio.create_task(
+            _hold(admission, "expensive", started, release, [])
+        )
+        await started.wait()
+
+        waiter = asyncio.create_task(
+            _hold(admission, "cheap", asyncio.Event(), release, [])
+        )
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        release.set()
+        await holder
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+        # The freed slot is usable right away
+        async with admission.admit("expensive"):
+            assert admission.in_flight == 1
+
+    asyncio.run(run())
+
+    assert admission.in_flight == 0
+
+
+def test_a_failing_turn_releases_its_slot():
+    admission = AdmissionController(max_in_flight=1, max_wait_seconds=5)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            async with admission.admit("expensive"):
+                raise RuntimeError("agent failed")
+
+        async with admission.admit("expensive"):
+            pass
+
+    asyncio.run(run())
+
+    assert admission.in_flight == 0
+    assert admission.run_seconds_ewma is not None
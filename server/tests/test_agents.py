@@ -0,0 +1,258 @@
+import asyncio
+import uuid
+from datetime import UTC, datetime
+
+import httpx
+import pytest
+from common.agents import AgentRegistry
+from common.conf import LLMModelSettings
+from common.deadlines import Deadline, DeadlineExceededError, deadline_config
+from common.usage import count_tokens, llm_usage_scope
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.runnables import RunnableLambda
+from llm.graph import LLMGraphStateFailure, llm_graph_invoke_question
+from llm.schemas import ChatRoomMessage
+
+QUESTION = {"messages": [{"role": "user", "content": "Hi"}]}
+
+
+def _ai_message(content="Hello", input_tokens=10, output_tokens=5):
+    return AIMessage(
+        content=content,
+        usage_metadata={
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        },
+    )
+
+
+class FakeModelAgent:
+    """A compiled agent making one fake model call, then maybe failing."""
+
+    def __init__(self, delay_seconds=0.0, error=None, model_calls=1):
+        self.delay_seconds = delay_seconds
+        self.error = error
+        self.model_calls = model_calls
+        self.invocations = 0
+
+    def runnable(self):
+        async def invoke(input, config):
+            self.invocations += 1
+            model = GenericFakeChatModel(
+                messages=iter([_ai_message() for _ in range(self.model_calls)])
+            )
+            answers = [
+                await model.ainvoke("Hi", config) for _ in range(self.model_calls)
+            ]
+            await asyncio.sleep(self.delay_seconds)
+            if self.error is not None:
+                raise self.error
+
+            return {"messages": [*input["messages"], *answers]}
+
+        return RunnableLambda(invoke)
+
+
+def _registry(*models):
+    return AgentRegistry(models=list(models))
+
+
+def _routed_agent(registry, fake_agents):
+    agent = registry.agent("test", "generation", tools=[])
+    agent._RoutedAgent__agent = lambda name: fake_agents[name].runnable()
+
+    return agent
+
+
+def _ainvoke(agent, config=None, sink=None):
+    async def run():
+        with llm_usage_scope(sink, request_id=uuid.uuid4()):
+            return await agent.ainvoke(QUESTION, config)
+
+    return asyncio.run(run())
+
+
+def test_cheaper_model_ranks_first_until_measured():
+    registry = _registry(
+        LLMModelSettings(name="costly", cost_per_million_tokens=10.0),
+        LLMModelSettings(name="cheap", cost_per_million_tokens=1.0),
+    )
+
+    assert [m.name for m in registry.candidates("generation")] == ["cheap", "costly"]
+
+
+def test_untried_backup_never_outranks_a_fast_primary(monkeypatch):
+    monkeypatch.setattr("common.agents.settings.llm_routing_min_samples", 3)
+    registry = _registry(
+        LLMModelSettings(name="primary", latency_slo_seconds=10.0),
+        LLMModelSettings(name="backup", latency_slo_seconds=10.0),
+    )
+
+    # Too few calls to count, the primary is scored as if at its SLO
+    for _ in range(2):
+        registry.record_success("primary", latency_seconds=1.0, output_messages=[])
+    assert [m.name for m in registry.candidates("generation")] == [
+        "primary",
+        "backup",
+    ]
+
+    # Measured fast, it stays ahead of the unmeasured backup
+    registry.record_success("primary", latency_seconds=1.0, output_messages=[])
+    assert registry.candidates("generation")[0].name == "primary"
+
+
+def test_slow_measured_model_loses_to_an_unmeasured_one(monkeypatch):
+    monkeypatch.setattr("common.agents.settings.llm_routing_min_samples", 1)
+    registry = _registry(
+        LLMModelSettings(name="primary", latency_slo_seconds=1.0),
+        LLMModelSettings(name="backup", latency_slo_seconds=1.0),
+    )
+
+    registry.record_success("primary", latency_seconds=3.0, output_messages=[])
+
+    assert registry.candidates("generation")[0].name == "backup"
+
+
+def test_recent_failures_demote_a_model():
+    registry = _registry(
+        LLMModelSettings(name="primary"), LLMModelSettings(name="backup")
+    )
+
+    registry.record_failure("primary", latency_seconds=0.1, timed_out=False)
+
+    assert registry.candidates("generation")[0].name == "backup"
+    stats = {stats.name: stats for stats in registry.stats_snapshot()}
+    assert stats["primary"].failures == 1
+
+
+def test_success_counts_every_model_call_of_the_invocation():
+    registry = _registry(
+        LLMModelSettings(name="primary", cost_per_million_tokens=1_000_000.0)
+    )
+    # A tool calling invocation, two model calls with a tool result between
+    output_messages = [
+        _ai_message("", input_tokens=10, output_tokens=2),
+        ToolMessage(content="42", tool_call_id="call-1"),
+        _ai_message("It is 42", input_tokens=20, output_tokens=3),
+    ]
+
+    registry.record_success(
+        "primary", latency_seconds=1.0, output_messages=output_messages
+    )
+
+    stats = registry.stats_snapshot()[0]
+    assert stats.total_tokens == 35
+    assert stats.estimated_cost == 35.0
+
+
+def test_count_tokens_skips_messages_without_usage():
+    counts = count_tokens(
+        [HumanMessage(content="Hi"), AIMessage(content="no usage"), _ai_message()]
+    )
+
+    assert (counts.model_calls, counts.prompt_tokens, counts.completion_tokens) == (
+        1,
+        10,
+        5,
+    )
+
+
+def test_fails_over_when_a_model_breaches_its_latency_slo():
+    registry = _registry(
+        LLMModelSettings(name="primary", latency_slo_seconds=0.05),
+        LLMModelSettings(name="backup"),
+    )
+    fake_agents = {
+        "primary": FakeModelAgent(delay_seconds=1.0),
+        "backup": FakeModelAgent(),
+    }
+
+    response = _ainvoke(_routed_agent(registry, fake_agents))
+
+    assert response["agent_name"] == "backup"
+    stats = {stats.name: stats for stats in registry.stats_snapshot()}
+    assert stats["primary"].timeouts == 1
+    assert stats["backup"].calls == 1
+
+
+def test_the_last_candidate_error_propagates():
+    registry = _registry(LLMModelSettings(name="only"))
+    fake_agents = {"only": FakeModelAgent(error=RuntimeError("boom"))}
+
+    with pytest.raises(RuntimeError, match="boom"):
+        _ainvoke(_routed_agent(registry, fake_agents))
+
+    assert registry.stats_snapshot()[0].failures == 1
+
+
+def test_an_expired_deadline_is_not_blamed_on_the_model():
+    registry = _registry(
+        LLMModelSettings(name="primary"), LLMModelSettings(name="backup")
+    )
+    fake_agents = {
+        "primary": FakeModelAgent(delay_seconds=1.0),
+        "backup": FakeModelAgent(),
+    }
+
+    with pytest.raises(DeadlineExceededError):
+        _ainvoke(
+            _routed_agent(registry, fake_agents),
+            config=deadline_config(Deadline.from_timeout(0.05)),
+        )
+
+    assert fake_agents["backup"].invocations == 0
+    assert all(stats.failures == 0 for stats in registry.stats_snapshot())
+
+
+def test_an_already_expired_deadline_skips_the_models():
+    registry = _registry(LLMModelSettings(name="only"))
+    fake_agents = {"only": FakeModelAgent()}
+
+    with pytest.raises(DeadlineExceededError):
+        _ainvoke(
+            _routed_agent(registry, fake_agents),
+            config=deadline_config(Deadline.from_timeout(0)),
+        )
+
+    assert fake_agents["only"].invocations == 0
+
+
+def _invoke_question_failing_with(monkeypatch, error):
+    async def ainvoke_checkpointed(**kwargs):
+        raise error
+
+    monkeypatch.setattr("llm.graph.ainvoke_checkpointed", ainvoke_checkpointed)
+    question = ChatRoomMessage(
+        id=uuid.uuid4(),
+        role="user",
+        content="Hi",
+        llm_provider="openai",
+        llm_key="gpt-4o-mini",
+        date=datetime.now(UTC),
+    )
+
+    return asyncio.run(
+        llm_graph_invoke_question(
+            database=None,  # type: ignore[arg-type]
+            owner_id=uuid.uuid4(),
+            question=question,
+            messages=[],
+        )
+    )
+
+
+def test_a_failed_model_call_ends_the_question_with_a_failure(monkeypatch):
+    request = httpx.Request("POST", "https://llm.example.com/")
+    end_state = _invoke_question_failing_with(
+        monkeypatch, httpx.ConnectError("refused", request=request)
+    )
+
+    assert isinstance(end_state.result, LLMGraphStateFailure)
+    assert end_state.result.code == "agent_invocation_failed"
+
+
+def test_a_bug_answering_the_question_is_not_taken_for_a_model_failure(monkeypatch):
+    with pytest.raises(KeyError):
+        _invoke_question_failing_with(monkeypatch, KeyError("configurable"))
@@ -0,0 +1,185 @@
+import uuid
+from datetime import timedelta
+
+import orjson
+from common.datetime_utils import datetime_now_with_timezone
+from llm.models import ChatRoom, ChatRoomArchive
+from llm.schemas import ChatRoomMessage
+
+from tests.conftest import RecordingSession
+
+
+def _room(owner_id, message_count, days_old):
+    start = datetime_now_with_timezone() - timedelta(days=days_old)
+    messages = [
+        {
+            "id": str(uuid.uuid4()),
+            "role": "user" if index % 2 == 0 else "assistant",
+            "content": f"Question {index}" if index % 2 == 0 else f"Answer {index}",
+            "llm_provider": "openai",
+            "llm_key": "gpt",
+            "date": (start + timedelta(minutes=index)).isoformat(),
+        }
+        for index in range(message_count)
+    ]
+
+    return ChatRoom(
+        owner_id=owner_id,
+        title="Old room",
+        messages=messages,
+        message_count=message_count,
+    )
+
+
+def _message(role, content):
+    return ChatRoomMessage(
+        id=uuid.uuid4(),
+        role=role,
+        content=content,
+        llm_provider="openai",
+        llm_key="gpt",
+        date=datetime_now_with_timezone(),
+    )
+
+
+def _compact(room, session, **overrides):
+    arguments = {
+        "archive_before": datetime_now_with_timezone() - timedelta(days=1),
+        "keep_recent": 4,
+        "min_messages": 4,
+        "segment_messages": 4,
+        "zstd_level": 3,
+    }
+
+    return ChatRoomArchive.compact(
+        room=room, session=session, **{**arguments, **overrides}
+    )
+
+
+class StoredRoomSession(RecordingSession):
+    """Serves the room as stored, keeping how it was read."""
+
+    def __init__(self, stored_room):
+        super().__init__()
+        self.stored_room = stored_room
+        self.get_options = []
+
+    def get(self, entity, ident, **options):
+        self.get_options.append(options)
+
+        return self.stored_room
+
+
+def test_compaction_moves_old_turns_into_segments(owner_id):
+    room = _room(owner_id, message_count=14, days_old=10)
+    original_messages = list(room.messages)
+    updated_at = room.updated_at
+    session = RecordingSession()
+
+    archived = _compact(room, session)
+
+    segments = [added for added in session.added if isinstance(added, ChatRoomArchive)]
+    assert archived == 10
+    assert [segment.segment for segment in segments] == [0, 1, 2]
+    assert [segment.message_count for segment in segments] == [4, 4, 2]
+    assert room.archived_segments == 3
+    assert room.latest_archive_segment == 2
+    assert room.messages == original_messages[10:]
+    assert room.message_count == 4
+    assert room.updated_at > updated_at
+    assert room.archive_summary.startswith("10 messages from ")
+
+    restored = [
+        message
+        for segment in segments
+        for message in orjson.loads(b"".join(segment.iter_messages_json()))
+    ]
+    assert restored == original_messages[:10]
+    assert segments[1].previous_segment == 0
+    assert segments[0].previous_segment is None
+
+
+def test_compaction_repoints_search_rows_and_drops_archived_vectors(owner_id):
+    room = _room(owner_id, message_count=14, days_old=10)
+    session = RecordingSession()
+
+    _compact(room, session)
+
+    sql = session.sql()
+    search_updates = [s for s in sql if s.startswith("UPDATE chat_message_search")]
+    embedding_deletes = [
+        s for s in sql if s.startswith("DELETE FROM chat_room_embedding")
+    ]
+    assert len(search_updates) == 3
+    assert all("SET archive_segment=" in s for s in search_updates)
+    assert [
+        statement.compile().params["archive_segment"]
+        for statement in session.statements[:3]
+    ] == [0, 1, 2]
+    assert len(embedding_deletes) == 1
+
+
+def test_compaction_never_splits_a_turn_or_archives_too_little(owner_id):
+    room = _room(owner_id, message_count=12, days_old=10)
+
+    # Up to the question at index 6, which stays with its answer
+    split = _compact(room, RecordingSession(), keep_recent=5, min_messages=2)
+    assert split == 6
+    assert room.messages[0]["role"] == "user"
+
+    recent_room = _room(owner_id, message_count=12, days_old=0)
+    assert _compact(recent_room, RecordingSession()) == 0
+    assert len(recent_room.messages) == 12
+
+    small_room = _room(owner_id, message_count=8, days_old=10)
+    assert _compact(small_room, RecordingSession(), min_messages=6) == 0
+    assert small_room.archived_segments == 0
+
+
+def test_later_compactions_append_to_the_summary(owner_id):
+    room = _room(owner_id, message_count=14, days_old=10)
+    _compact(room, RecordingSession(), keep_recent=10)
+    first_summary = room.archive_summary
+
+    _compact(room, RecordingSession())
+
+    assert room.archived_segments == 3
+    assert room.archive_summary.splitlines()[0] == first_summary
+    assert len(room.archive_summary.splitlines()) == 2
+
+
+def test_a_turn_stored_after_compaction_keeps_the_archived_messages_out(
+    owner_id, monkeypatch
+):
+    monkeypatch.setattr("llm.models.settings.llm_memory_enabled", False)
+    stored_room = _room(owner_id, message_count=14, days_old=10)
+    # The writer read the room before the compaction committed
+    stale_room = ChatRoom(
+        owner_id=owner_id,
+        id=stored_room.id,
+        title=stored_room.title,
+        messages=list(stored_room.messages),
+        message_count=stored_room.message_count,
+    )
+    _compact(stored_room, RecordingSession())
+    compacted_messages = list(stored_room.messages)
+    turn = [_message("user", "New question"), _message("assistant", "New answer")]
+    session = StoredRoomSession(stored_room)
+
+    room = stale_room.add_messages(
+        messages=turn,
+        session=session,  # type: ignore[arg-type]
+        commit=False,
+    )
+
+    (get_options,) = session.get_options
+    assert get_options["with_for_update"] is True
+    assert get_options["populate_existing"] is True
+    assert room is stored_room
+    assert room.messages[:4] == compacted_messages
+    assert [message["content"] for message in room.messages[4:]] == [
+        "New question",
+        "New answer",
+    ]
+    assert room.message_count == 6
+    assert room.archived_segments == 3
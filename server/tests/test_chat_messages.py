@@ -0,0 +1,240 @@
+import uuid
+from datetime import timedelta
+
+import pytest
+from common.compression import CompressionMiddleware
+from common.datetime_utils import datetime_now_with_timezone
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from llm import controller as llm_controller
+from llm.controller import LLMController, get_llm_controller
+from llm.models import ChatRoom, ChatRoomVersion
+from llm.router import llm_router
+from sqlmodel import create_engine
+
+from tests.conftest import FakeDatabase, RecordingSession
+
+
+class FakeChatRoom:
+    """The owner's chat rooms, in place of the Postgres only table."""
+
+    rooms: list["FakeChatRoom"] = []
+
+    def __init__(self, owner_id, message_count):
+        self.owner_id = owner_id
+        self.id = uuid.uuid4()
+        self.updated_at = datetime_now_with_timezone()
+        self.latest_archive_segment = None
+        self.archive_summary = None
+        self.messages = []
+        self.add(message_count)
+
+    def add(self, message_count):
+        start = len(self.messages)
+        for index in range(start, start + message_count):
+            self.messages.append(
+                {
+                    "id": str(uuid.uuid4()),
+                    "role": "user" if index % 2 == 0 else "assistant",
+                    "content": f"Message {index} " + "lorem ipsum " * 20,
+                    "llm_provider": "openai",
+                    "llm_key": "gpt",
+                    "date": (self.updated_at + timedelta(seconds=index)).isoformat(),
+                }
+            )
+
+    @property
+    def message_count(self):
+        return len(self.messages)
+
+    def json_messages(self):
+        return list(self.messages)
+
+    @classmethod
+    def latest(cls, session, owner_id, with_messages=True):
+        rooms = [room for room in cls.rooms if room.owner_id == owner_id]
+
+        return rooms[-1] if rooms else None
+
+    @classmethod
+    def get(cls, session, owner_id, room_id, with_messages=True):
+        return next((room for room in cls.rooms if room.id == room_id), None)
+
+    @classmethod
+    def messages_after(cls, session, owner_id, room_id, message_id):
+        room = cls.get(session, owner_id, room_id)
+        ids = [message["id"] for message in room.messages]
+        if str(message_id) not in ids:
+            return None
+
+        return room.messages[ids.index(str(message_id)) + 1 :]
+
+    @classmethod
+    def version(cls, session, owner_id, room_id=None):
+        room = (
+            cls.get(session, owner_id, room_id)
+            if room_id
+            else cls.latest(session, owner_id)
+        )
+        if room is None:
+            return None
+
+        # The timestamp stays, a same-second write only changes the count
+        return ChatRoomVersion(
+            id=room.id, updated_at=room.updated_at, message_count=len(room.messages)
+        )
+
+
+@pytest.fixture
+def client(monkeypatch, owner_id):
+    monkeypatch.setattr(FakeChatRoom, "rooms", [])
+    monkeypatch.setattr(llm_controller, "ChatRoom", FakeChatRoom)
+
+    app = FastAPI()
+    app.include_router(llm_router)
+    app.add_middleware(
+        CompressionMiddleware,
+        path_prefixes=[llm_router.prefix],
+        min_bytes=200,
+        gzip_level=6,
+        brotli_quality=4,
+    )
+    database = FakeDatabase(create_engine("sqlite://"))
+    app.dependency_overrides[get_llm_controller] = lambda: LLMController(
+        database, owner_id=owner_id
+    )
+
+    return TestClient(app)
+
+
+MESSAGES_URL = "/llm/chats/messages"
+
+
+def test_etag_revalidation(client, owner_id):
+    room = FakeChatRoom(owner_id, message_count=2)
+    FakeChatRoom.rooms.append(room)
+
+    response = client.get(MESSAGES_URL, headers={"accept-encoding": "identity"})
+    etag = response.headers["etag"]
+
+    assert response.status_code == 200
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert len(response.json()["data"]) == 2
+
+    not_modified = client.get(MESSAGES_URL, headers={"if-none-match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["vary"] == "Accept-Encoding"
+    assert client.get(MESSAGES_URL, headers={"if-none-match": "*"}).status_code == 304
+
+    # Written within the same timestamp, the message count still changes it
+    room.add(2)
+    modified = client.get(MESSAGES_URL, headers={"if-none-match": etag})
+    assert modified.status_code == 200
+    assert modified.headers["etag"] != etag
+
+
+def test_an_empty_history_has_an_etag_too(client):
+    response = client.get(MESSAGES_URL)
+
+    assert response.status_code == 200
+    assert response.headers["etag"] == '"empty"'
+    assert response.json()["data"] == []
+    assert response.json()["cursor"] is None
+
+
+def test_delta_since_a_known_message(client, owner_id):
+    room = FakeChatRoom(owner_id, message_count=4)
+    FakeChatRoom.rooms.append(room)
+    ids = [message["id"] for message in room.messages]
+
+    delta = client.get(MESSAGES_URL, params={"since": ids[1]}).json()
+    up_to_date = client.get(MESSAGES_URL, params={"since": ids[-1]}).json()
+    unknown = client.get(MESSAGES_URL, params={"since": str(uuid.uuid4())}).json()
+
+    assert [message["id"] for message in delta["data"]] == ids[2:]
+    assert delta["cursor"] == ids[-1]
+    assert up_to_date["data"] == []
+    # An unknown cursor resyncs everything
+    assert [message["id"] for message in unknown["data"]] == ids
+
+
+def test_the_etag_is_the_one_of_the_messages_served(client, owner_id, monkeypatch):
+    room = FakeChatRoom(owner_id, message_count=2)
+    FakeChatRoom.rooms.append(room)
+    current_etag = client.get(MESSAGES_URL).headers["etag"]
+
+    # The version is checked on a replica still missing the latest turn
+    stale_version = ChatRoomVersion(
+        id=room.id, updated_at=room.updated_at, message_count=0
+    )
+    monkeypatch.setattr(
+        FakeChatRoom, "version", classmethod(lambda cls, *args, **kwargs: stale_version)
+    )
+    response = client.get(MESSAGES_URL, headers={"if-none-match": '"stale"'})
+
+    assert len(response.json()["data"]) == 2
+    assert response.headers["etag"] == current_etag
+
+
+class ScalarSession(RecordingSession):
+    def execute(self, statement):
+        super().execute(statement)
+
+        return self
+
+    def scalar(self):
+        return self.rows[0] if self.rows else None
+
+
+def test_the_delta_is_sliced_out_of_the_stored_array(owner_id):
+    room = FakeChatRoom(owner_id, message_count=3)
+    session = ScalarSession(rows=[list(reversed(room.messages[1:]))])
+
+    delta = ChatRoom.messages_after(
+        session,  # type: ignore[arg-type]
+        owner_id=owner_id,
+        room_id=room.id,
+        message_id=uuid.UUID(room.messages[0]["id"]),
+    )
+
+    (sql,) = session.sql()
+    assert "unnest(chat_room.messages) WITH ORDINALITY" in sql
+    assert "chat_room.messages[(SELECT stored.position" in sql
+    assert ":chat_room.message_count]" in sql
+    # Served in date order, as the whole room is
+    assert delta == room.messages[1:]
+    assert (
+        ChatRoom.messages_after(
+            ScalarSession(rows=[None]),  # type: ignore[arg-type]
+            owner_id=owner_id,
+            room_id=room.id,
+            message_id=uuid.uuid4(),
+        )
+        is None
+    )
+
+
+@pytest.mark.parametrize("accept_encoding", ["br", "gzip"])
+def test_compressed_responses_get_a_weak_etag(client, owner_id, accept_encoding):
+    FakeChatRoom.rooms.append(FakeChatRoom(owner_id, message_count=10))
+    plain = client.get(MESSAGES_URL, headers={"accept-encoding": "identity"})
+
+    compressed = client.get(MESSAGES_URL, headers={"accept-encoding": accept_encoding})
+
+    assert compressed.headers["content-encoding"] == accept_encoding
+    assert compressed.headers["etag"] == f"W/{plain.headers['etag']}"
+    assert compressed.headers["vary"] == "Accept-Encoding"
+    assert int(compressed.headers["content-length"]) < len(plain.content)
+    # The test client decodes gzip and brotli itself
+    assert compressed.content == plain.content
+    assert (
+        client.get(
+            MESSAGES_URL,
+            headers={
+                "accept-encoding": accept_encoding,
+                "if-none-match": compressed.headers["etag"],
+            },
+        ).status_code
+        == 304
+    )
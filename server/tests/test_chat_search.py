@@ -0,0 +1,73 @@
+import uuid
+from datetime import timedelta
+
+import pytest
+from common.datetime_utils import datetime_now_with_timezone
+from common.exceptions import AgentsPlayBadRequestError
+from llm.models import ChatMessageSearch
+from llm.schemas import SearchChatMessagesPayload
+from sqlalchemy.dialects import postgresql
+
+from tests.conftest import RecordingSession
+
+
+class Row:
+    def __init__(self, **mapping):
+        self._mapping = mapping
+
+
+def _hit(rank, minutes, segment=None):
+    return Row(
+        room_id=uuid.uuid4(),
+        message_id=uuid.uuid4(),
+        role="user",
+        date=datetime_now_with_timezone() - timedelta(minutes=minutes),
+        archive_segment=segment,
+        snippet="<<tax>> return",
+        rank=rank,
+    )
+
+
+def _search(session, owner_id, **payload):
+    return ChatMessageSearch.search(
+        session, owner_id, SearchChatMessagesPayload(**payload)
+    )
+
+
+def test_search_pages_by_rank_then_date_with_a_keyset_cursor(owner_id):
+    rows = [_hit(0.5, 1), _hit(0.5, 2, segment=3), _hit(0.1, 3)]
+    session = RecordingSession(rows=rows)
+
+    hits, next_cursor = _search(session, owner_id, q="tax", limit=2)
+
+    assert [hit.message_id for hit in hits] == [
+        row._mapping["message_id"] for row in rows[:2]
+    ]
+    assert hits[1].archive_segment == 3
+    assert next_cursor is not None
+    first_page_sql = session.sql()[0]
+    assert "websearch_to_tsquery" in first_page_sql
+    assert "chat_message_search.owner_id = " in first_page_sql
+    assert "LIMIT" in first_page_sql
+
+    next_session = RecordingSession(rows=rows[2:])
+    last_hits, last_cursor = _search(
+        next_session, owner_id, q="tax", limit=2, cursor=next_cursor
+    )
+    next_page = next_session.statements[0].compile(dialect=postgresql.dialect())
+
+    assert [hit.message_id for hit in last_hits] == [rows[2]._mapping["message_id"]]
+    assert last_cursor is None
+    # Continues strictly after the last hit of the previous page
+    assert ") < (CAST(" in str(next_page)
+    assert hits[-1].rank in next_page.params.values()
+    assert hits[-1].message_id in next_page.params.values()
+
+
+def test_search_rejects_bad_cursors_and_disabled_fuzzy_matching(owner_id, monkeypatch):
+    monkeypatch.setattr("llm.models.settings.llm_search_trigram_enabled", False)
+
+    with pytest.raises(AgentsPlayBadRequestError):
+        _search(RecordingSession(), owner_id, q="tax", cursor="bm9wZQ==")
+    with pytest.raises(AgentsPlayBadRequestError):
+        _search(RecordingSession(), owner_id, q="tax", match="fuzzy")
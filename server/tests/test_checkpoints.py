@@ -0,0 +1,221 @@
+import asyncio
+from datetime import timedelta
+from typing import TypedDict
+
+import pytest
+from checkpoints.models import GraphCheckpoint, GraphCheckpointWrite, GraphRunResponse
+from checkpoints.saver import DatabaseCheckpointSaver, ainvoke_checkpointed
+from common.datetime_utils import datetime_now_with_timezone
+from langchain_core.messages import AIMessage
+from langgraph.graph import END, START, StateGraph
+from llm.controller import LLMController
+from llm.graph import LLMGraphState, LLMGraphStateSuccess
+from llm.schemas import CreateChatMessagePayload, CreateChatMessageResponse
+from sqlalchemy import update
+from sqlmodel import Session, col, create_engine, select
+
+from tests.conftest import FakeDatabase, create_tables
+
+
+class StepsState(TypedDict):
+    steps: list[str]
+
+
+def _graph(calls, fail_times):
+    """Two nodes, the second failing its first `fail_times` runs."""
+
+    def first(state):
+        calls.append("first")
+
+        return {"steps": [*state["steps"], "first"]}
+
+    def second(state):
+        calls.append("second")
+        if calls.count("second") <= fail_times:
+            raise RuntimeError("provider down")
+
+        return {"steps": [*state["steps"], "second"]}
+
+    builder = StateGraph(StepsState)
+    builder.add_node("first", first)
+    builder.add_node("second", second)
+    builder.add_edge(START, "first")
+    builder.add_edge("first", "second")
+    builder.add_edge("second", END)
+
+    return builder.compile()
+
+
+@pytest.fixture
+def checkpointer(tmp_path, monkeypatch):
+    # On a file, puts LangGraph runs in the background each get a connection
+    engine = create_engine(f"sqlite:///{tmp_path / 'checkpoints.db'}")
+    create_tables(engine, GraphCheckpoint, GraphCheckpointWrite, GraphRunResponse)
+    checkpointer = DatabaseCheckpointSaver(
+        FakeDatabase(engine), ttl_seconds=60, gc_interval_seconds=60, zstd_level=3
+    )
+    monkeypatch.setattr(
+        "checkpoints.saver.get_graph_checkpointer", lambda: checkpointer
+    )
+
+    yield checkpointer
+
+    engine.dispose()
+
+
+def test_a_failed_run_resumes_from_its_last_completed_node(checkpointer):
+    calls: list[str] = []
+    graph = _graph(calls, fail_times=1)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await ainvoke_checkpointed(graph, {"steps": []}, {}, thread_id="turn-1")
+
+        return await ainvoke_checkpointed(graph, {"steps": []}, {}, thread_id="turn-1")
+
+    result = asyncio.run(run())
+
+    assert result == {"steps": ["first", "second"]}
+    # The first node isn't run again on retry
+    assert calls == ["first", "second", "second"]
+
+
+def test_a_finished_run_returns_its_end_state_without_running(checkpointer):
+    calls: list[str] = []
+    graph = _graph(calls, fail_times=0)
+
+    async def run():
+        first = await ainvoke_checkpointed(graph, {"steps": []}, {}, thread_id="turn-1")
+        replayed = await ainvoke_checkpointed(
+            graph, {"steps": []}, {}, thread_id="turn-1"
+        )
+        other = await ainvoke_checkpointed(
+            graph, {"steps": ["other"]}, {}, thread_id="turn-2"
+        )
+
+        return first, replayed, other
+
+    first, replayed, other = asyncio.run(run())
+
+    assert first == replayed == {"steps": ["first", "second"]}
+    assert other == {"steps": ["other", "first", "second"]}
+    assert calls == ["first", "second", "first", "second"]
+
+
+def test_only_the_latest_checkpoint_is_kept_and_released(checkpointer):
+    graph = _graph([], fail_times=0)
+    config = {"configurable": {"thread_id": "turn-1"}}
+
+    asyncio.run(ainvoke_checkpointed(graph, {"steps": []}, {}, thread_id="turn-1"))
+
+    with Session(checkpointer.database.engine) as session:
+        assert len(session.exec(select(GraphCheckpoint)).all()) == 1
+    checkpoint_tuple = checkpointer.get_tuple(config)
+    assert checkpoint_tuple is not None
+    assert checkpoint_tuple.checkpoint["channel_values"]["steps"] == [
+        "first",
+        "second",
+    ]
+    assert list(checkpointer.list(config)) == [checkpoint_tuple]
+
+    asyncio.run(checkpointer.adelete_thread("turn-1"))
+
+    with Session(checkpointer.database.engine) as session:
+        assert session.exec(select(GraphCheckpoint)).all() == []
+        assert session.exec(select(GraphCheckpointWrite)).all() == []
+
+
+def test_expired_runs_are_collected(checkpointer):
+    graph = _graph([], fail_times=0)
+    asyncio.run(ainvoke_checkpointed(graph, {"steps": []}, {}, thread_id="old"))
+    asyncio.run(ainvoke_checkpointed(graph, {"steps": []}, {}, thread_id="new"))
+    checkpointer.finish_thread("answered", b"{}")
+
+    with Session(checkpointer.database.engine) as session:
+        an_hour_ago = datetime_now_with_timezone() - timedelta(hours=1)
+        session.execute(
+            update(GraphCheckpoint)
+            .where(col(GraphCheckpoint.thread_id) == "old")
+            .values(created_at=an_hour_ago)
+        )
+        session.execute(update(GraphRunResponse).values(created_at=an_hour_ago))
+        session.commit()
+
+    assert checkpointer.get_response("answered") is None
+    assert checkpointer.delete_expired() == 1
+    with Session(checkpointer.database.engine) as session:
+        assert session.exec(select(GraphCheckpoint.thread_id)).all() == ["new"]
+        assert session.exec(select(GraphRunResponse)).all() == []
+
+
+def test_runs_are_not_checkpointed_without_a_thread(checkpointer):
+    calls: list[str] = []
+    graph = _graph(calls, fail_times=1)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await ainvoke_checkpointed(graph, {"steps": []}, {}, thread_id=None)
+
+        return await ainvoke_checkpointed(graph, {"steps": []}, {}, thread_id=None)
+
+    asyncio.run(run())
+
+    assert calls == ["first", "second", "first", "second"]
+    with Session(checkpointer.database.engine) as session:
+        assert session.exec(select(GraphCheckpoint)).all() == []
+
+
+def test_a_retry_after_a_stored_turn_gets_the_same_response(
+    checkpointer, owner_id, monkeypatch
+):
+    runs: list[str] = []
+    stored_questions: list[str] = []
+
+    async def invoke_question(question, thread_id, **kwargs):
+        runs.append(thread_id)
+
+        return LLMGraphState(
+            question=question,
+            messages=[],
+            result=LLMGraphStateSuccess(
+                ai_response=AIMessage(content="Added milk"), agent_name="openai:gpt"
+            ),
+        )
+
+    def store_chat_turn(self, existing_room, room_id, question, response, **kwargs):
+        stored_questions.append(question.content)
+
+        return CreateChatMessageResponse(
+            **response.model_dump(),
+            detail="Created",
+            room_id=room_id,
+            title="Groceries",
+            updated_at=response.date,
+        )
+
+    monkeypatch.setattr("llm.controller.llm_graph_invoke_question", invoke_question)
+    monkeypatch.setattr(
+        LLMController,
+        "_LLMController__turn_context",
+        lambda self, payload, deadline, connection_state=None: (None, []),
+    )
+    monkeypatch.setattr(
+        LLMController, "_LLMController__store_chat_turn", store_chat_turn
+    )
+    controller = LLMController(checkpointer.database, owner_id=owner_id)
+    payload = CreateChatMessagePayload(message="Add milk")
+
+    async def run():
+        first = await controller.create_chat_message(payload, idempotency_key="key-1")
+        # The first response never reached the client
+        retried = await controller.create_chat_message(payload, idempotency_key="key-1")
+
+        return first, retried
+
+    first, retried = asyncio.run(run())
+
+    assert retried == first
+    assert runs == [f"llm:{owner_id}:key-1"]
+    assert stored_questions == ["Add milk"]
+    with Session(checkpointer.database.engine) as session:
+        assert session.exec(select(GraphCheckpoint)).all() == []
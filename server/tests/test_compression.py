@@ -0,0 +1,89 @@
+import pytest
+from common.compression import CompressionMiddleware, negotiate_encoding
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+LARGE_TEXT = "lorem ipsum " * 100
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.add_middleware(
+        CompressionMiddleware,
+        path_prefixes=["/text"],
+        min_bytes=200,
+        gzip_level=6,
+        brotli_quality=4,
+    )
+
+    @app.get("/text/small")
+    def small():
+        return PlainTextResponse("ok")
+
+    @app.get("/text/large")
+    def large():
+        return PlainTextResponse(LARGE_TEXT)
+
+    @app.get("/text/streamed")
+    def streamed():
+        return StreamingResponse(
+            (f"chunk {index} " * 50 for index in range(5)),
+            media_type="text/plain",
+            headers={"content-length": str(len("chunk 0 " * 50) * 5)},
+        )
+
+    @app.get("/other/large")
+    def other():
+        return PlainTextResponse(LARGE_TEXT)
+
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("accept_encoding", ["br", "gzip"])
+def test_large_responses_are_compressed(client, accept_encoding):
+    response = client.get("/text/large", headers={"accept-encoding": accept_encoding})
+
+    assert response.headers["content-encoding"] == accept_encoding
+    assert int(response.headers["content-length"]) < len(LARGE_TEXT)
+    # The test client decodes gzip and brotli itself
+    assert response.text == LARGE_TEXT
+
+
+def test_small_responses_are_not_compressed(client):
+    response = client.get("/text/small", headers={"accept-encoding": "gzip"})
+
+    assert "content-encoding" not in response.headers
+    assert response.text == "ok"
+
+
+def test_responses_outside_the_prefixes_are_not_compressed(client):
+    response = client.get("/other/large", headers={"accept-encoding": "gzip"})
+
+    assert "content-encoding" not in response.headers
+    assert response.text == LARGE_TEXT
+
+
+def test_streamed_responses_are_compressed_chunk_by_chunk(client):
+    response = client.get("/text/streamed", headers={"accept-encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert response.text == "".join(f"chunk {index} " * 50 for index in range(5))
+
+
+@pytest.mark.parametrize(
+    ("accept_encoding", "expected"),
+    [
+        ("gzip, deflate, br", "br"),
+        ("gzip;q=1.0, br;q=0.5", "gzip"),
+        ("br;q=0, gzip", "gzip"),
+        ("*", "br"),
+        ("*;q=0", None),
+        ("identity", None),
+        ("", None),
+    ],
+)
+def test_negotiate_encoding(accept_encoding, expected):
+    assert negotiate_encoding(accept_encoding) == expected
@@ -0,0 +1,176 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+from database.database import BaseDatabase
+from database.read_your_writes import (
+    LAST_WRITE_COOKIE,
+    LAST_WRITE_HEADER,
+    ClientWrites,
+    ReadScope,
+    ReadYourWritesMiddleware,
+    current_client_writes,
+)
+from sqlmodel import create_engine
+
+
+@pytest.fixture
+def database():
+    database = BaseDatabase(
+        engine=create_engine("sqlite://"),
+        replica_engines=[create_engine("sqlite://"), create_engine("sqlite://")],
+        read_your_writes_seconds=60.0,
+        replica_max_lag_seconds=1.0,
+    )
+    database.check_replicas_lag()
+
+    return database
+
+
+def test_reads_spread_over_healthy_replicas(database, owner_id):
+    replica_engines = {replica.engine for replica in database.replicas}
+
+    engines = {database.reader_engine("todo", owner_id) for _ in range(4)}
+
+    assert engines == replica_engines
+
+
+def test_unhealthy_replicas_are_left_out(database, owner_id):
+    database.replicas[0].healthy = False
+
+    for _ in range(3):
+        assert database.reader_engine("todo", owner_id) is database.replicas[1].engine
+
+    database.replicas[1].healthy = False
+
+    assert database.reader_engine("todo", owner_id) is database.engine
+
+
+def test_writes_pin_reads_of_that_owner_and_room_to_the_writer(database, owner_id):
+    room_id, other_room_id = uuid.uuid4(), uuid.uuid4()
+
+    database.record_write("chat_room", owner_id, room_id)
+
+    assert database.reader_engine("chat_room", owner_id, room_id) is database.engine
+    # Reads that don't know their room yet, e.g. listing the rooms
+    assert database.reader_engine("chat_room", owner_id) is database.engine
+    # The owner-wide key is freshened too, so are the owner's other rooms
+    assert (
+        database.reader_engine("chat_room", owner_id, other_room_id) is database.engine
+    )
+    # Other owners and other scopes still use the replicas
+    assert database.reader_engine("chat_room", uuid.uuid4()) is not database.engine
+    assert database.reader_engine("todo", owner_id) is not database.engine
+
+
+def test_writes_expire_after_the_window(owner_id):
+    database = BaseDatabase(
+        engine=create_engine("sqlite://"),
+        replica_engines=[create_engine("sqlite://")],
+        read_your_writes_seconds=0.01,
+    )
+    database.check_replicas_lag()
+
+    database.record_write("todo", owner_id)
+    time.sleep(0.02)
+
+    assert database.reader_engine("todo", owner_id) is database.replicas[0].engine
+
+
+def test_client_writes_from_another_worker_pin_reads(database, owner_id):
+    token = current_client_writes.set(ClientWrites({"todo": time.time()}))
+    try:
+        assert database.reader_engine("todo", owner_id) is database.engine
+        assert database.reader_engine("chat_room", owner_id) is not database.engine
+    finally:
+        current_client_writes.reset(token)
+
+
+def test_client_writes_parse_skips_unknown_and_malformed_parts():
+    client_writes = ClientWrites.parse("todo:12.5|nope:1|chat_room:x|usage:3")
+
+    assert client_writes.written_at == {"todo": 12.5, "usage": 3.0}
+    assert ClientWrites.parse(client_writes.serialize()).written_at == (
+        client_writes.written_at
+    )
+
+
+def test_lag_checker_marks_replicas_healthy_in_the_background(owner_id):
+    database = BaseDatabase(
+        engine=create_engine("sqlite://"),
+        replica_engines=[create_engine("sqlite://")],
+        replica_lag_check_interval_seconds=0.01,
+    )
+
+    async def run():
+        assert database.reader_engine("todo", owner_id) is database.engine
+        await database.start()
+        try:
+            for _ in range(100):
+                if database.replicas[0].healthy:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await database.stop()
+
+    asyncio.run(run())
+
+    assert database.reader_engine("todo", owner_id) is database.replicas[0].engine
+
+
+def _run_middleware(headers, write_scope=None):
+    sent = []
+
+    async def app(scope, receive, send):
+        if write_scope is not None:
+            client_writes = current_client_writes.get()
+            assert client_writes is not None
+            client_writes.record(write_scope, 100.0)
+        client_writes = current_client_writes.get()
+        assert client_writes is not None
+        seen.append(client_writes.written_at.copy())
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(message):
+        sent.append(message)
+
+    seen: list[dict[ReadScope, float]] = []
+    middleware = ReadYourWritesMiddleware(app, max_age_seconds=30)
+    asyncio.run(middleware({"type": "http", "headers": headers}, receive, send))
+
+    return seen[0], dict(sent[0]["headers"])
+
+
+def test_middleware_reads_the_cookie_and_header():
+    from_cookie, _ = _run_middleware(
+        [(b"cookie", f"{LAST_WRITE_COOKIE}=todo:5".encode())]
+    )
+    from_header, _ = _run_middleware(
+        [
+            (b"cookie", f"{LAST_WRITE_COOKIE}=todo:5".encode()),
+            (LAST_WRITE_HEADER.encode(), b"todo:7"),
+        ]
+    )
+
+    assert from_cookie == {"todo": 5.0}
+    assert from_header == {"todo": 7.0}
+
+
+def test_middleware_sends_the_cookie_back_only_after_a_write():
+    _, unchanged_headers = _run_middleware([])
+    _, written_headers = _run_middleware(
+        [(LAST_WRITE_HEADER.encode(), b"todo:5")], write_scope="chat_room"
+    )
+
+    assert b"set-cookie" not in unchanged_headers
+    assert (
+        written_headers[LAST_WRITE_HEADER.encode()] == b"todo:5.000|chat_room:100.000"
+    )
+    assert written_headers[b"set-cookie"].startswith(
+        b"last_write=todo:5.000|chat_room:100.000; Max-Age=30;"
+    )
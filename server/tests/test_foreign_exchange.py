@@ -0,0 +1,173 @@
+import asyncio
+import io
+
+import orjson
+import pytest
+from agents_play import forex_batch
+from common.deadlines import Deadline, DeadlineExceededError
+from foreign_exchange.client import ForeignExchangeClient
+from foreign_exchange.graph import ForeignExchangeGraphState
+from foreign_exchange.responses import RatesResponse
+
+
+class FakeRatesApi:
+    def __init__(self, delay_seconds=0.0, error=None):
+        self.delay_seconds = delay_seconds
+        self.error = error
+        self.fetches = 0
+        self.deadlines: list[Deadline | None] = []
+
+    async def fetch_rates(self, base, deadline):
+        self.fetches += 1
+        self.deadlines.append(deadline)
+        await asyncio.sleep(self.delay_seconds)
+        if self.error is not None:
+            raise self.error
+
+        return RatesResponse(base=base, date="2025-01-01", rates={"EUR": 0.9})
+
+
+def _client(rates_api, rates_ttl_seconds=60.0, shared_fetch_timeout_seconds=10.0):
+    client = ForeignExchangeClient(
+        rates_ttl_seconds=rates_ttl_seconds,
+        shared_fetch_timeout_seconds=shared_fetch_timeout_seconds,
+    )
+    client._ForeignExchangeClient__fetch_rates = rates_api.fetch_rates  # type: ignore[attr-defined]
+
+    return client
+
+
+def test_concurrent_callers_share_one_fetch_then_the_cache():
+    rates_api = FakeRatesApi(delay_seconds=0.05)
+    client = _client(rates_api)
+
+    async def run():
+        responses = await asyncio.gather(*(client.get_rates("USD") for _ in range(10)))
+        responses.append(await client.get_rates("USD"))
+        await client.get_rates("GBP")
+
+        return responses
+
+    responses = asyncio.run(run())
+
+    assert {response.rates["EUR"] for response in responses} == {0.9}
+    assert rates_api.fetches == 2
+
+
+def test_without_a_ttl_every_call_fetches_on_its_own_deadline():
+    rates_api = FakeRatesApi()
+    client = _client(rates_api, rates_ttl_seconds=0)
+    deadline = Deadline.from_timeout(5)
+
+    async def run():
+        await asyncio.gather(*(client.get_rates("USD", deadline) for _ in range(3)))
+
+    asyncio.run(run())
+
+    assert rates_api.fetches == 3
+    assert rates_api.deadlines == [deadline] * 3
+
+
+def test_a_short_deadline_caller_gives_up_without_cancelling_the_fetch():
+    rates_api = FakeRatesApi(delay_seconds=0.1)
+    client = _client(rates_api)
+
+    async def run():
+        patient = asyncio.create_task(client.get_rates("USD", Deadline.from_timeout(5)))
+        await asyncio.sleep(0)
+        with pytest.raises(DeadlineExceededError):
+            await client.get_rates("USD", Deadline.from_timeout(0.01))
+
+        return await patient
+
+    response = asyncio.run(run())
+
+    assert response.rates == {"EUR": 0.9}
+    assert rates_api.fetches == 1
+    # The shared fetch runs on its own timeout, not the first caller's deadline
+    shared_deadline = rates_api.deadlines[0]
+    assert shared_deadline is not None
+    assert shared_deadline.remaining_seconds > 5
+
+
+def test_the_shared_fetch_timing_out_is_not_a_deadline_error():
+    rates_api = FakeRatesApi(error=TimeoutError())
+    client = _client(rates_api)
+
+    async def run():
+        await client.get_rates("USD", Deadline.from_timeout(5))
+
+    with pytest.raises(TimeoutError) as error:
+        asyncio.run(run())
+
+    assert not isinstance(error.value, DeadlineExceededError)
+
+
+def test_a_failed_fetch_is_not_cached():
+    rates_api = FakeRatesApi(error=RuntimeError("down"))
+    client = _client(rates_api)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await client.get_rates("USD")
+        rates_api.error = None
+
+        return await client.get_rates("USD")
+
+    assert asyncio.run(run()).rates == {"EUR": 0.9}
+    assert rates_api.fetches == 2
+
+
+def test_batch_query_parsing():
+    assert forex_batch.BatchQuery.parse(1, "USD rates").query == "USD rates"
+
+    query = forex_batch.BatchQuery.parse(2, '{"query": "EUR", "id": 7}')
+    assert (query.line, query.query, query.id) == (2, "EUR", 7)
+
+    with pytest.raises(ValueError):
+        forex_batch.BatchQuery.parse(3, '{"id": 7}')
+
+
+def test_batch_writes_one_result_per_query(monkeypatch):
+    async def fake_invoke(request, deadline=None, interactive=False):
+        assert deadline is not None
+        if request == "boom":
+            raise RuntimeError("graph failed")
+        if request == "nonsense":
+            return ForeignExchangeGraphState(
+                raw_user_input=request,
+                user_currency_input=None,
+                failure_message="Could not identify a valid currency",
+                rates={},
+            )
+        return ForeignExchangeGraphState(
+            raw_user_input=request,
+            user_currency_input=request,
+            failure_message=None,
+            rates={"EUR": 0.9},
+        )
+
+    monkeypatch.setattr(forex_batch, "foreign_exchange_rate_invoke", fake_invoke)
+    source = io.StringIO(
+        'USD\n\n{"query": "GBP", "id": "a"}\nboom\n{"id": 1}\nnonsense\n'
+    )
+    output = io.BytesIO()
+
+    queries, failed = asyncio.run(
+        forex_batch.run_batch(source, output, concurrency=2, timeout_seconds=5)
+    )
+
+    results = {
+        result["line"]: result
+        for result in map(orjson.loads, output.getvalue().splitlines())
+    }
+    assert (queries, failed) == (5, 3)
+    assert sorted(results) == [1, 3, 4, 5, 6]
+    assert results[1]["rates"] == {"EUR": 0.9}
+    assert (results[3]["id"], results[3]["base"]) == ("a", "GBP")
+    assert results[4]["error"] == "graph failed"
+    assert results[5]["error"] == 'JSON queries need a "query" string'
+    assert (results[6]["rates"], results[6]["error"]) == (
+        None,
+        "Could not identify a valid currency",
+    )
@@ -0,0 +1,91 @@
+import asyncio
+
+import httpx
+import pytest
+from common.llm_clients import CountingTransport, LLMClientFactory
+
+
+class SlowTransport(httpx.AsyncBaseTransport):
+    """Answers after a delay, failing the paths starting with /fail."""
+
+    def __init__(self, delay_seconds: float) -> None:
+        self.delay_seconds = delay_seconds
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(self.delay_seconds)
+        if request.url.path.startswith("/fail"):
+            raise httpx.ConnectError("refused", request=request)
+
+        return httpx.Response(200, stream=httpx.ByteStream(b"chunk " * 10))
+
+
+def test_counts_requests_in_flight_until_the_response_is_closed():
+    transport = CountingTransport(SlowTransport(delay_seconds=0.01))
+
+    async def run():
+        async with httpx.AsyncClient(transport=transport) as client:
+            responses = await asyncio.gather(
+                *(client.get("https://llm.example.com/") for _ in range(3))
+            )
+            assert transport.peak_in_flight == 3
+
+            async with client.stream("GET", "https://llm.example.com/") as streamed:
+                # Still holding its connection while it streams
+                assert transport.in_flight == 1
+                await streamed.aread()
+            assert transport.in_flight == 0
+
+            with pytest.raises(httpx.ConnectError):
+                await client.get("https://llm.example.com/fail")
+
+        return responses
+
+    responses = asyncio.run(run())
+
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert transport.in_flight == 0
+    assert transport.requests == 5
+    assert transport.failures == 1
+
+
+def test_pool_stats_report_waiting_requests(monkeypatch):
+    monkeypatch.setattr("common.llm_clients.settings.llm_http_max_connections", 2)
+    factory = LLMClientFactory()
+
+    assert factory.stats().in_flight == 0
+
+    client = factory.http_client()
+    transport = client._transport
+    assert isinstance(transport, CountingTransport)
+    transport.in_flight = 3
+    transport.peak_in_flight = 5
+
+    stats = factory.stats()
+    assert stats.max_connections == 2
+    assert stats.waiting == 1
+    assert stats.peak_waiting == 3
+    assert stats.utilization == 1.0
+
+
+def test_agents_share_one_client_reopened_after_close():
+    factory = LLMClientFactory()
+
+    client = factory.http_client()
+    model = factory.chat_model("openai:gpt-4o-mini")
+
+    assert factory.http_client() is client
+    assert factory.chat_model("openai:gpt-4o-mini") is model
+    assert model.http_async_client is client  # type: ignore[attr-defined]
+    assert model.max_retries == factory.chat_model("openai:gpt-4o").max_retries  # type: ignore[attr-defined]
+
+    asyncio.run(factory.aclose())
+
+    assert client.is_closed
+    reopened = factory.http_client()
+    rebuilt = factory.chat_model("openai:gpt-4o-mini")
+    assert reopened is not client
+    assert not reopened.is_closed
+    # The models holding the closed client are rebuilt
+    assert rebuilt is not model
+    assert rebuilt.http_async_client is reopened  # type: ignore[attr-defined]
+    asyncio.run(factory.aclose())
@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+from common.loop_monitor import (
+    ALL_ROUTES,
+    IDLE_ROUTE,
+    EventLoopMonitor,
+    LoopMonitorMiddleware,
+    _percentile,
+)
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+
+
+def _monitor(debug=False):
+    return EventLoopMonitor(
+        interval_seconds=0.01,
+        max_samples=100,
+        debug=debug,
+        blocking_threshold_seconds=0.05,
+        max_blocking_calls=10,
+    )
+
+
+def _block_the_loop_for(seconds):
+    time.sleep(seconds)
+
+
+def test_lag_is_charged_to_the_routes_in_flight():
+    monitor = _monitor()
+    app = FastAPI()
+    app.add_middleware(LoopMonitorMiddleware, monitor=monitor)
+
+    @app.get("/items/{item_id}")
+    async def blocking(item_id: int):
+        await asyncio.sleep(0.02)
+        _block_the_loop_for(0.1)
+
+        return {"item_id": item_id}
+
+    async def run():
+        await monitor.start()
+        await asyncio.sleep(0.05)
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            response = await client.get("/items/1")
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+
+        return response
+
+    assert asyncio.run(run()).status_code == 200
+
+    lag = {stats.route: stats for stats in monitor.stats().lag}
+    assert set(lag) == {ALL_ROUTES, IDLE_ROUTE, "GET /items/{item_id}"}
+    assert lag["GET /items/{item_id}"].max_seconds >= 0.08
+    assert lag[IDLE_ROUTE].max_seconds < 0.08
+    assert lag[ALL_ROUTES].samples >= lag[IDLE_ROUTE].samples
+
+
+def test_the_debug_watchdog_records_where_the_loop_is_stuck():
+    monitor = _monitor(debug=True)
+
+    async def run():
+        await monitor.start()
+        await asyncio.sleep(0.03)
+        _block_the_loop_for(0.2)
+        await asyncio.sleep(0.03)
+        await monitor.stop()
+
+    asyncio.run(run())
+
+    [blocking_call] = monitor.stats().blocking_calls
+    assert blocking_call.routes == [IDLE_ROUTE]
+    assert any("_block_the_loop_for" in frame for frame in blocking_call.stack)
+    # Updated with the full duration once the loop ran again
+    assert blocking_call.blocked_seconds >= 0.15
+
+
+def test_stop_is_idempotent_and_stats_start_empty():
+    monitor = _monitor(debug=True)
+
+    asyncio.run(monitor.stop())
+
+    stats = monitor.stats()
+    assert stats.lag == []
+    assert stats.blocking_calls == []
+
+
+def test_percentiles_use_the_nearest_rank():
+    values = [float(value) for value in range(1, 101)]
+
+    assert _percentile(values, 50) == 50.0
+    assert _percentile(values, 99) == 99.0
+    assert _percentile([0.5], 95) == 0.5
+    assert _percentile([], 50) == 0.0
@@ -0,0 +1,155 @@
+import uuid
+from datetime import timedelta
+
+import numpy as np
+import pytest
+from common.datetime_utils import datetime_now_with_timezone
+from llm.memory import HashingEmbedder, cosine_top_k, get_embedder
+from llm.models import ChatRoom, ChatRoomEmbedding
+from sqlmodel import Session, select
+
+TOPICS = [
+    "my cat Whiskers loves tuna and sleeping on the sofa",
+    "the quarterly tax return is due in April",
+    "plan a hiking trip to the Alps in July",
+    "bake sourdough bread with a long cold fermentation",
+    "fix the leaking kitchen faucet washer",
+    "learn the Spanish subjunctive for the exam",
+    "renew the car insurance before it lapses",
+    "repaint the garden fence dark green",
+]
+
+
+def _room(owner_id):
+    start = datetime_now_with_timezone()
+    messages = []
+    for index, topic in enumerate(TOPICS):
+        for offset, (role, content) in enumerate(
+            [
+                ("user", f"Let's talk about how to {topic}"),
+                ("assistant", f"Sure, {topic}."),
+            ]
+        ):
+            messages.append(
+                {
+                    "id": str(uuid.uuid4()),
+                    "role": role,
+                    "content": content,
+                    "llm_provider": "openai",
+                    "llm_key": "gpt",
+                    "date": (start + timedelta(seconds=2 * index + offset)).isoformat(),
+                }
+            )
+
+    return ChatRoom(
+        owner_id=owner_id, title="Everything", messages=messages, message_count=16
+    )
+
+
+@pytest.fixture
+def memory_settings(monkeypatch):
+    monkeypatch.setattr("llm.models.settings.llm_memory_enabled", True)
+    monkeypatch.setattr("llm.models.settings.llm_memory_recent_messages", 4)
+    monkeypatch.setattr("llm.models.settings.llm_memory_top_k", 2)
+    monkeypatch.setattr("llm.models.settings.llm_memory_min_score", 0.1)
+
+
+@pytest.fixture
+def embeddings_engine(sqlite_engine):
+    return sqlite_engine(ChatRoomEmbedding)
+
+
+def test_hashing_embedder_scores_related_texts_higher():
+    embedder = HashingEmbedder(dimensions=256)
+
+    vectors = embedder.embed(
+        ["feed the cat tuna", "my cat loves tuna", "file the tax return", ""]
+    )
+
+    assert np.allclose(np.linalg.norm(vectors[:3], axis=1), 1.0)
+    assert not vectors[3].any()
+    assert vectors[0] @ vectors[1] > vectors[0] @ vectors[2]
+
+
+def test_cosine_top_k_ranks_and_masks():
+    embeddings = np.eye(4, dtype=np.float32)
+    queries = np.array([[0.1, 0.9, 0.5, 0.0]], dtype=np.float32)
+
+    indices, scores = cosine_top_k(queries, embeddings, k=2)
+    masked_indices, _ = cosine_top_k(
+        queries, embeddings, k=2, mask=np.array([True, False, True, True])
+    )
+    none, _ = cosine_top_k(queries, embeddings, k=2, mask=np.zeros(4, dtype=bool))
+
+    assert indices.tolist() == [[1, 2]]
+    assert np.allclose(scores, [[0.9, 0.5]])
+    assert masked_indices.tolist() == [[2, 0]]
+    assert none.shape == (1, 0)
+
+
+def test_recalls_the_relevant_older_turn_and_the_recent_ones(
+    memory_settings, embeddings_engine, owner_id
+):
+    room = _room(owner_id)
+
+    with Session(embeddings_engine) as session:
+        recalled = room.memory_llm_messages("What does Whiskers like to eat?", session)
+        # Reads never write, the vectors are only stored with the next turn
+        assert session.exec(select(ChatRoomEmbedding)).all() == []
+
+    contents = [message["content"] for message in recalled]
+    # The whole cat turn, question and answer, then the 4 most recent messages
+    assert contents[:2] == [
+        f"Let's talk about how to {TOPICS[0]}",
+        f"Sure, {TOPICS[0]}.",
+    ]
+    assert contents[-4:] == [message["content"] for message in room.messages[-4:]]
+    assert len(contents) <= 2 * 2 + 4
+
+
+def test_indexing_is_idempotent_and_replaces_other_embedders(
+    memory_settings, embeddings_engine, owner_id
+):
+    room = _room(owner_id)
+    embedder = get_embedder()
+    other_embedder = HashingEmbedder(dimensions=8)
+
+    with Session(embeddings_engine) as session:
+        ChatRoomEmbedding.index_messages(
+            owner_id, room.id, room.messages[:4], session, embedder=other_embedder
+        )
+        ChatRoomEmbedding.index_messages(owner_id, room.id, room.messages, session)
+        # A replayed turn inserts nothing twice
+        ChatRoomEmbedding.index_messages(owner_id, room.id, room.messages, session)
+        session.commit()
+
+        message_ids, matrix = ChatRoomEmbedding.load(
+            session, owner_id, room.id, embedder
+        )
+        embedders = set(session.exec(select(ChatRoomEmbedding.embedder)).all())
+
+    assert sorted(message_ids) == sorted(message["id"] for message in room.messages)
+    assert matrix.shape == (16, embedder.dimensions)
+    assert embedders == {embedder.name}
+
+
+def test_indexed_and_unindexed_messages_recall_the_same(
+    memory_settings, embeddings_engine, owner_id
+):
+    room = _room(owner_id)
+    query = "When is the tax return due?"
+
+    with Session(embeddings_engine) as session:
+        unindexed = room.memory_llm_messages(query, session)
+        ChatRoomEmbedding.index_messages(owner_id, room.id, room.messages[:6], session)
+        partly_indexed = room.memory_llm_messages(query, session)
+
+    assert unindexed == partly_indexed
+    assert unindexed[0]["content"] == f"Let's talk about how to {TOPICS[1]}"
+
+
+def test_short_rooms_send_their_whole_history(memory_settings, owner_id):
+    room = _room(owner_id)
+    room.messages = room.messages[:6]
+
+    assert room.memory_llm_messages("anything", session=None) == room.llm_messages()
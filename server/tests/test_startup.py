@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from llm.models import (
+    ChatMessageSearch,
+    _configure_chat_message_search,
+)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
+from sqlmodel import SQLModel
+
+SERVER_DIRECTORY = Path(__file__).parents[1]
+
+# Runs without any of the environment the settings require
+SETTINGS_PROBE = """
+import agents_play.main
+import agents_play.compact_chats
+import agents_play.forex_batch
+from agents_play.conf import get_settings
+
+print(get_settings.cache_info().currsize)
+"""
+
+
+def test_importing_the_server_reads_no_settings():
+    output = subprocess.run(
+        [sys.executable, "-c", SETTINGS_PROBE],
+        env={"PATH": os.environ.get("PATH", ""), "PYTHONPATH": str(SERVER_DIRECTORY)},
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+
+    assert output.strip() == "0"
+
+
+def test_the_search_vector_uses_the_text_config_set_at_creation(monkeypatch):
+    table = SQLModel.metadata.tables[ChatMessageSearch.__tablename__]
+    monkeypatch.setattr("llm.models.settings.llm_search_text_config", "simple")
+
+    _configure_chat_message_search(table)
+    sql = str(CreateTable(table).compile(dialect=postgresql.dialect()))
+
+    monkeypatch.undo()
+    _configure_chat_message_search(table)
+
+    assert "GENERATED ALWAYS AS (to_tsvector('simple'::regconfig, content))" in sql
@@ -0,0 +1,64 @@
+import pytest
+from common.exceptions import AgentsPlayBadRequestError
+from sqlmodel import Session
+from todos.graph import _planned_list_payload
+from todos.models import Todo, TodoListPage
+from todos.schemas import TodoListPayload
+
+
+def _titles(todos_page: TodoListPage) -> list[str]:
+    return [todo.title for todo in todos_page.todos]
+
+
+def test_list_pages_with_keyset_cursor_without_gaps_or_repeats(todos_engine, owner_id):
+    with Session(todos_engine) as session:
+        everything = Todo.list(session, owner_id, TodoListPayload(limit=10)).todos
+
+        seen: list[str] = []
+        cursor: str | None = None
+        while True:
+            todos_page = Todo.list(
+                session, owner_id, TodoListPayload(limit=2, cursor=cursor)
+            )
+            seen.extend(_titles(todos_page))
+            if todos_page.next_cursor is None:
+                assert todos_page.remaining == 0
+                break
+            assert todos_page.remaining == len(everything) - len(seen)
+            cursor = todos_page.next_cursor
+
+    assert seen == [todo.title for todo in everything]
+    assert len(seen) == 5
+
+
+def test_list_filters_by_completed_and_escaped_search(todos_engine, owner_id):
+    with Session(todos_engine) as session:
+        done = Todo.list(session, owner_id, TodoListPayload(completed=True))
+        buying = Todo.list(session, owner_id, TodoListPayload(search=" buy "))
+        percent = Todo.list(session, owner_id, TodoListPayload(search="100%"))
+        wildcard = Todo.list(session, owner_id, TodoListPayload(search="%"))
+
+    assert sorted(_titles(done)) == ["Call mom", "Pay bills"]
+    assert sorted(_titles(buying)) == ["Buy 100% juice", "Buy bread", "Buy milk"]
+    assert _titles(percent) == ["Buy 100% juice"]
+    # A literal percent sign, not a match-anything wildcard
+    assert _titles(wildcard) == ["Buy 100% juice"]
+
+
+def test_list_rejects_an_unreadable_cursor(todos_engine, owner_id):
+    with Session(todos_engine) as session:
+        with pytest.raises(AgentsPlayBadRequestError):
+            Todo.list(session, owner_id, TodoListPayload(cursor="not-a-cursor"))
+
+
+def test_planned_list_filters_keep_the_cursor_the_user_typed():
+    list_payload = _planned_list_payload(
+        "done groceries after:MjAyNQ", "Which groceries did I buy? after:MjAyNS0w"
+    )
+
+    assert list_payload.completed is True
+    assert list_payload.search == "groceries"
+    assert list_payload.cursor == "MjAyNS0w"
+    assert _planned_list_payload("", "Show me my todos") == TodoListPayload(
+        limit=list_payload.limit
+    )
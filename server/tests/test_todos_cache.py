@@ -0,0 +1,61 @@
+import uuid
+
+from sqlalchemy.dialects import postgresql
+from sqlmodel import Session
+from todos.models import Todo, TodoListPage, TodosVersion
+from todos.schemas import TodoListPayload
+
+
+def _titles(todos_page: TodoListPage) -> list[str]:
+    return [todo.title for todo in todos_page.todos]
+
+
+def test_cached_pages_are_served_until_the_version_is_bumped(todos_engine, owner_id):
+    payload = TodoListPayload(limit=10)
+    with Session(todos_engine) as session:
+        first = Todo.list(session, owner_id, payload)
+
+        # Written behind the cache's back, the stale page is still served
+        session.add(Todo(owner_id=owner_id, title="Walk the dog"))
+        session.commit()
+        assert Todo.list(session, owner_id, payload) == first
+
+        assert TodosVersion.bump(session, owner_id) == 1
+        assert TodosVersion.bump(session, owner_id) == 2
+        session.commit()
+        assert "Walk the dog" in _titles(Todo.list(session, owner_id, payload))
+
+
+def test_another_owners_write_keeps_the_cached_page(todos_engine, owner_id):
+    payload = TodoListPayload(limit=10)
+    with Session(todos_engine) as session:
+        first = Todo.list(session, owner_id, payload)
+        TodosVersion.bump(session, uuid.uuid4())
+        session.commit()
+
+        assert Todo.list(session, owner_id, payload) is first
+
+
+def test_version_bump_is_one_upsert():
+    owner_id = uuid.uuid4()
+
+    class RecordingSession:
+        def __init__(self):
+            self.queries = []
+
+        def execute(self, query):
+            self.queries.append(query)
+
+            class Result:
+                def scalar_one(self):
+                    return 7
+
+            return Result()
+
+    session = RecordingSession()
+
+    assert TodosVersion.bump(session, owner_id) == 7  # type: ignore[arg-type]
+    assert len(session.queries) == 1
+    sql = str(session.queries[0].compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (owner_id) DO UPDATE" in sql
+    assert "RETURNING" in sql
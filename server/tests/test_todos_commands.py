@@ -0,0 +1,49 @@
+import pytest
+from todos.commands import parse_todos_command, todos_next_page_command
+from todos.schemas import TodoListPayload
+
+
+@pytest.mark.parametrize(
+    ("user_input", "expected"),
+    [
+        ("/todos", {"completed": None, "search": None, "cursor": None}),
+        ("/todos done", {"completed": True, "search": None, "cursor": None}),
+        (
+            "/todo ls open groceries after:abc",
+            {"completed": False, "search": "groceries", "cursor": "abc"},
+        ),
+        (
+            "/todos milk and bread",
+            {"completed": None, "search": "milk and bread", "cursor": None},
+        ),
+    ],
+)
+def test_parse_list_commands(user_input, expected):
+    command = parse_todos_command(user_input)
+
+    assert command is not None
+    assert command.action == "list"
+    assert command.list_payload is not None
+    assert command.list_payload.model_dump(include=set(expected)) == expected
+
+
+def test_parse_create_and_non_commands():
+    command = parse_todos_command("/todo add Buy milk")
+
+    assert command is not None
+    assert command.action == "create"
+    assert command.title == "Buy milk"
+    assert parse_todos_command("/todo add") is None
+    assert parse_todos_command("/todo delete everything") is None
+    assert parse_todos_command("show me my todos") is None
+
+
+def test_next_page_command_keeps_the_filters():
+    list_payload = TodoListPayload(completed=False, search="groceries")
+
+    command = todos_next_page_command(list_payload, cursor="xyz")
+    parsed = parse_todos_command(command)
+
+    assert command == "/todos open groceries after:xyz"
+    assert parsed is not None
+    assert parsed.list_payload == list_payload.model_copy(update={"cursor": "xyz"})
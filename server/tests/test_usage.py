@@ -0,0 +1,259 @@
+import uuid
+
+import pytest
+from app_api.router import app_api_router
+from common.conf import LLMModelSettings
+from common.deadlines import Deadline, DeadlineExceededError, deadline_config
+from common.usage import LLMUsage
+from database.database import get_database
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import SecretStr
+from sqlalchemy import inspect
+from sqlmodel import Session, select
+from usage.meter import LLMUsageMeter
+from usage.models import LLMUsageRecord
+
+from tests.conftest import FakeDatabase, create_tables
+from tests.test_agents import FakeModelAgent, _ainvoke, _registry, _routed_agent
+
+ADMIN_TOKEN = "admin-secret"
+
+
+def _usage(owner_id, model="gpt", failed=False, prompt_tokens=100):
+    return LLMUsage(
+        request_id=uuid.uuid4(),
+        owner_id=owner_id,
+        room_id=None,
+        node="llm_general_node",
+        node_path="llm_general_node",
+        agent="general",
+        model=model,
+        model_calls=1,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=10,
+        cached_tokens=0,
+        latency_seconds=1.0,
+        estimated_cost=prompt_tokens / 1000,
+        failed=failed,
+    )
+
+
+class UsageSink:
+    def __init__(self):
+        self.usages = []
+
+    def add(self, usage):
+        self.usages.append(usage)
+
+
+def test_every_attempt_of_a_failover_is_metered():
+    registry = _registry(
+        LLMModelSettings(name="primary", latency_slo_seconds=0.05),
+        LLMModelSettings(name="backup"),
+    )
+    fake_agents = {
+        "primary": FakeModelAgent(delay_seconds=1.0),
+        "backup": FakeModelAgent(),
+    }
+    sink = UsageSink()
+
+    _ainvoke(_routed_agent(registry, fake_agents), sink=sink)
+
+    # The timed out attempt made a model call before stalling, it is metered
+    assert [(u.model, u.failed, u.model_calls) for u in sink.usages] == [
+        ("primary", True, 1),
+        ("backup", False, 1),
+    ]
+
+
+def test_the_last_candidate_error_propagates_and_is_metered():
+    registry = _registry(LLMModelSettings(name="only"))
+    fake_agents = {"only": FakeModelAgent(error=RuntimeError("boom"), model_calls=2)}
+    sink = UsageSink()
+
+    with pytest.raises(RuntimeError, match="boom"):
+        _ainvoke(_routed_agent(registry, fake_agents), sink=sink)
+
+    assert len(sink.usages) == 1
+    usage = sink.usages[0]
+    assert (usage.failed, usage.model_calls, usage.prompt_tokens) == (True, 2, 20)
+
+
+def test_an_attempt_cut_short_by_the_deadline_is_metered():
+    registry = _registry(LLMModelSettings(name="only"))
+    fake_agents = {"only": FakeModelAgent(delay_seconds=1.0)}
+    sink = UsageSink()
+
+    with pytest.raises(DeadlineExceededError):
+        _ainvoke(
+            _routed_agent(registry, fake_agents),
+            config=deadline_config(Deadline.from_timeout(0.05)),
+            sink=sink,
+        )
+
+    assert [(u.model, u.failed, u.model_calls) for u in sink.usages] == [
+        ("only", True, 1)
+    ]
+
+
+def test_meter_writes_in_batches_and_drops_the_oldest_when_full(
+    sqlite_engine, owner_id
+):
+    engine = sqlite_engine(LLMUsageRecord)
+    meter = LLMUsageMeter(
+        FakeDatabase(engine), batch_size=2, flush_interval_seconds=1, max_buffered=3
+    )
+    for prompt_tokens in range(1, 5):
+        meter.add(_usage(owner_id, prompt_tokens=prompt_tokens))
+
+    assert meter.stats().dropped == 1
+    meter.flush_all()
+
+    with Session(engine) as session:
+        written = session.exec(select(LLMUsageRecord.prompt_tokens)).all()
+    assert sorted(written) == [2, 3, 4]
+    assert meter.stats().written == 3
+    assert meter.stats().last_flush_batch_size == 1
+
+
+def test_meter_keeps_records_a_failed_flush_could_not_write(sqlite_engine, owner_id):
+    engine = sqlite_engine()
+    meter = LLMUsageMeter(
+        FakeDatabase(engine), batch_size=10, flush_interval_seconds=1, max_buffered=10
+    )
+    meter.add(_usage(owner_id))
+    meter.add(_usage(owner_id))
+
+    assert meter.flush() == 0
+    assert meter.stats().flush_failures == 1
+    assert meter.stats().buffered == 2
+
+    create_tables(engine, LLMUsageRecord)
+    assert inspect(engine).has_table("llm_usage")
+    meter.flush_all()
+
+    assert meter.stats().written == 2
+    assert meter.stats().dropped == 0
+
+
+@pytest.fixture
+def usage_client(sqlite_engine, owner_id, monkeypatch):
+    engine = sqlite_engine(LLMUsageRecord)
+    other_owner_id = uuid.uuid4()
+    with Session(engine) as session:
+        LLMUsageRecord.insert_many(
+            [
+                _usage(owner_id, model="gpt"),
+                _usage(owner_id, model="gpt", failed=True),
+                _usage(owner_id, model="claude"),
+                _usage(other_owner_id, model="gpt"),
+            ],
+            session=session,
+        )
+        session.commit()
+
+    monkeypatch.setattr(
+        "usage.admin.settings.usage_admin_token", SecretStr(ADMIN_TOKEN)
+    )
+    monkeypatch.setattr("common.owners.settings.owner_id_header_trusted", True)
+    app = FastAPI()
+    app.include_router(app_api_router)
+    app.dependency_overrides[get_database] = lambda: FakeDatabase(engine)
+    client = TestClient(app)
+    client.other_owner_id = other_owner_id  # type: ignore[attr-defined]
+
+    return client
+
+
+USAGE_URL = "/v1/web-api/usage/llm"
+
+
+def test_usage_is_served_under_the_api_prefix_only(usage_client):
+    assert usage_client.get("/usage/llm").status_code == 404
+
+
+def test_usage_is_scoped_to_the_caller(usage_client, owner_id):
+    response = usage_client.get(
+        USAGE_URL,
+        params={"group_by": ["owner_id", "model"]},
+        headers={"x-owner-id": str(owner_id)},
+    )
+
+    rows = {row["model"]: row for row in response.json()["data"]}
+    assert {row["owner_id"] for row in rows.values()} == {str(owner_id)}
+    assert rows["gpt"]["invocations"] == 2
+    assert rows["gpt"]["failed_invocations"] == 1
+    assert rows["claude"]["failed_invocations"] == 0
+
+
+def test_the_owner_header_is_ignored_unless_trusted(
+    usage_client, owner_id, monkeypatch
+):
+    monkeypatch.setattr("common.owners.settings.owner_id_header_trusted", False)
+
+    response = usage_client.get(
+        USAGE_URL,
+        params={"group_by": "owner_id"},
+        headers={"x-owner-id": str(owner_id)},
+    )
+
+    # Read as the default owner, who has no usage
+    assert response.json()["data"] == []
+
+
+def test_other_owners_usage_needs_the_admin_token(usage_client, owner_id):
+    other_owner_id = usage_client.other_owner_id
+    params = {"group_by": "owner_id", "owner_id": str(other_owner_id)}
+
+    refused = usage_client.get(
+        USAGE_URL, params=params, headers={"x-owner-id": str(owner_id)}
+    )
+    wrong_token = usage_client.get(
+        USAGE_URL,
+        params=params,
+        headers={"x-owner-id": str(owner_id), "x-usage-admin-token": "guess"},
+    )
+    allowed = usage_client.get(
+        USAGE_URL,
+        params=params,
+        headers={"x-owner-id": str(owner_id), "x-usage-admin-token": ADMIN_TOKEN},
+    )
+    everyone = usage_client.get(
+        USAGE_URL,
+        params={"group_by": "owner_id"},
+        headers={"x-usage-admin-token": ADMIN_TOKEN},
+    )
+
+    assert refused.status_code == 404
+    assert wrong_token.status_code == 404
+    assert [row["owner_id"] for row in allowed.json()["data"]] == [str(other_owner_id)]
+    assert {row["owner_id"] for row in everyone.json()["data"]} == {
+        str(owner_id),
+        str(other_owner_id),
+    }
+
+
+def test_meter_stats_need_the_admin_token(usage_client):
+    meter_url = f"{USAGE_URL}/meter"
+
+    assert usage_client.get(meter_url).status_code == 404
+    response = usage_client.get(meter_url, headers={"x-usage-admin-token": ADMIN_TOKEN})
+    assert response.status_code == 200
+    assert response.json()["detail"] == "OK"
+
+
+def test_the_profiling_token_reads_no_other_owners_usage(
+    usage_client, owner_id, monkeypatch
+):
+    monkeypatch.setattr(
+        "common.profiling.settings.profiling_admin_token", SecretStr("profiling")
+    )
+
+    response = usage_client.get(
+        USAGE_URL,
+        params={"group_by": "owner_id", "owner_id": str(usage_client.other_owner_id)},
+        headers={"x-owner-id": str(owner_id), "x-profile-token": "profiling"},
+    )
+
+    assert response.status_code == 404
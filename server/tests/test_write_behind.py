@@ -0,0 +1,238 @@
+import asyncio
+import sqlite3
+import uuid
+
+import pytest
+from common.datetime_utils import datetime_now_with_timezone
+from common.exceptions import AgentsPlayServiceUnavailableError
+from llm.schemas import ChatRoomMessage
+from llm.write_behind import ChatTurnsWriteBehind, PendingChatTurn
+from sqlalchemy.exc import OperationalError
+
+from tests.conftest import FakeDatabase
+
+
+class FakeRooms:
+    """Stands in for the chat room table, rooms can be made to fail."""
+
+    def __init__(self):
+        self.written: dict[uuid.UUID, list[str]] = {}
+        self.failing: dict[uuid.UUID, Exception] = {}
+
+    def write_room(self, owner_id, room_id, turns):
+        error = self.failing.get(room_id)
+        if error is not None:
+            raise error
+        self.written.setdefault(room_id, []).extend(
+            turn.question.content for turn in turns
+        )
+
+
+def _turn(owner_id, room_id, question):
+    def message(role, content):
+        return ChatRoomMessage(
+            id=uuid.uuid4(),
+            role=role,
+            content=content,
+            llm_provider="openai",
+            llm_key="gpt",
+            date=datetime_now_with_timezone(),
+        )
+
+    return PendingChatTurn(
+        owner_id=owner_id,
+        room_id=room_id,
+        question=message("user", question),
+        answer=message("assistant", f"Answer to {question}"),
+    )
+
+
+@pytest.fixture
+def create_write_behind(tmp_path, monkeypatch):
+    rooms = FakeRooms()
+
+    def create(pid=1000, max_pending=100, max_attempts=3, batch_size=100):
+        monkeypatch.setattr("os.getpid", lambda: pid)
+        write_behind = ChatTurnsWriteBehind(
+            database=FakeDatabase(engine=None),  # type: ignore[arg-type]
+            journal_dir=tmp_path,
+            batch_size=batch_size,
+            flush_interval_seconds=0.01,
+            max_pending=max_pending,
+            max_attempts=max_attempts,
+        )
+        write_behind._ChatTurnsWriteBehind__write_room = rooms.write_room  # type: ignore[attr-defined]
+
+        return write_behind
+
+    create.rooms = rooms  # type: ignore[attr-defined]
+
+    return create
+
+
+def _crash(write_behind):
+    # What a killed worker leaves: its journal, with the lock released
+    write_behind._ChatTurnsWriteBehind__journal.close()
+    write_behind._ChatTurnsWriteBehind__journal_lock.close()
+
+
+def test_flush_writes_turns_in_order_per_room(create_write_behind, owner_id):
+    write_behind = create_write_behind()
+    room_id, other_room_id = uuid.uuid4(), uuid.uuid4()
+    for question, room in [("a", room_id), ("b", other_room_id), ("c", room_id)]:
+        write_behind.enqueue(_turn(owner_id, room, question))
+
+    assert [
+        t.question.content for t in write_behind.pending_turns(owner_id, room_id)
+    ] == [
+        "a",
+        "c",
+    ]
+    assert write_behind.latest_pending_room_id(owner_id) == room_id
+
+    assert write_behind.flush_all() == 0
+    assert create_write_behind.rooms.written == {
+        room_id: ["a", "c"],
+        other_room_id: ["b"],
+    }
+    assert write_behind.pending_turns(owner_id, room_id) == []
+    assert write_behind.database.writes == [
+        ("chat_room", owner_id, room_id),
+        ("chat_room", owner_id, other_room_id),
+    ]
+
+
+def test_a_failing_room_does_not_hold_up_the_others(create_write_behind, owner_id):
+    write_behind = create_write_behind(max_attempts=2)
+    rooms = create_write_behind.rooms
+    bad_room_id, good_room_id = uuid.uuid4(), uuid.uuid4()
+    rooms.failing[bad_room_id] = ValueError("bad turn")
+    write_behind.enqueue(_turn(owner_id, bad_room_id, "bad"))
+    write_behind.enqueue(_turn(owner_id, good_room_id, "good"))
+
+    assert write_behind.flush() == 1
+    assert rooms.written == {good_room_id: ["good"]}
+    assert write_behind.stats().queue_depth == 1
+
+    # Out of attempts, the turn moves to the dead letters
+    assert write_behind.flush() == 1
+    stats = write_behind.stats()
+    assert stats.queue_depth == 0
+    assert stats.dead_lettered_turns == 1
+    assert stats.flush_failures == 2
+
+    journal = write_behind._ChatTurnsWriteBehind__journal
+    dead_letters = journal.execute(
+        "SELECT turn, error FROM chat_turn_dead_letter"
+    ).fetchall()
+    assert len(dead_letters) == 1
+    assert (
+        PendingChatTurn.model_validate_json(dead_letters[0][0]).room_id == bad_room_id
+    )
+    assert "bad turn" in dead_letters[0][1]
+
+
+def test_transient_failures_retry_without_spending_attempts(
+    create_write_behind, owner_id
+):
+    write_behind = create_write_behind(max_attempts=1)
+    rooms = create_write_behind.rooms
+    room_id = uuid.uuid4()
+    rooms.failing[room_id] = OperationalError("SELECT 1", {}, Exception("down"))
+    write_behind.enqueue(_turn(owner_id, room_id, "q"))
+
+    for _ in range(3):
+        assert write_behind.flush() == 0
+    assert write_behind.flush_all() == 1
+    assert write_behind.stats().dead_lettered_turns == 0
+
+    del rooms.failing[room_id]
+
+    assert write_behind.flush_all() == 0
+    assert rooms.written == {room_id: ["q"]}
+
+
+def test_the_queue_is_bounded(create_write_behind, owner_id):
+    write_behind = create_write_behind(max_pending=2)
+    room_id = uuid.uuid4()
+    write_behind.enqueue(_turn(owner_id, room_id, "a"))
+    write_behind.check_capacity()
+    write_behind.enqueue(_turn(owner_id, room_id, "b"))
+
+    with pytest.raises(AgentsPlayServiceUnavailableError):
+        write_behind.check_capacity()
+    with pytest.raises(AgentsPlayServiceUnavailableError):
+        write_behind.enqueue(_turn(owner_id, room_id, "c"))
+
+    write_behind.flush_all()
+    write_behind.check_capacity()
+
+
+def test_a_restarted_worker_recovers_its_journal(create_write_behind, owner_id):
+    room_id = uuid.uuid4()
+    write_behind = create_write_behind(pid=1000)
+    write_behind.enqueue(_turn(owner_id, room_id, "a"))
+    write_behind.enqueue(_turn(owner_id, room_id, "b"))
+    _crash(write_behind)
+
+    restarted = create_write_behind(pid=1000)
+
+    assert [t.question.content for t in restarted.pending_turns(owner_id, room_id)] == [
+        "a",
+        "b",
+    ]
+    assert restarted.flush_all() == 0
+    assert create_write_behind.rooms.written == {room_id: ["a", "b"]}
+
+
+def test_orphaned_journals_are_taken_over(create_write_behind, owner_id, tmp_path):
+    room_id = uuid.uuid4()
+    dead_worker = create_write_behind(pid=1000, max_attempts=1)
+    create_write_behind.rooms.failing[room_id] = ValueError("bad turn")
+    dead_worker.enqueue(_turn(owner_id, room_id, "dead"))
+    dead_worker.flush()
+    dead_worker.enqueue(_turn(owner_id, room_id, "pending"))
+    _crash(dead_worker)
+    del create_write_behind.rooms.failing[room_id]
+
+    live_worker = create_write_behind(pid=2000)
+    # A live worker's journal is locked, it is never taken over
+    other_live_worker = create_write_behind(pid=3000)
+
+    assert live_worker.stats().recovered_turns == 1
+    assert other_live_worker.stats().recovered_turns == 0
+    assert not (tmp_path / "chat_turns.1000.sqlite3").exists()
+    assert [
+        t.question.content for t in live_worker.pending_turns(owner_id, room_id)
+    ] == ["pending"]
+    journal = sqlite3.connect(tmp_path / "chat_turns.2000.sqlite3")
+    assert journal.execute("SELECT COUNT(*) FROM chat_turn_dead_letter").fetchone() == (
+        1,
+    )
+
+    assert live_worker.flush_all() == 0
+    assert create_write_behind.rooms.written == {room_id: ["pending"]}
+
+
+def test_the_background_flusher_writes_and_stop_flushes_the_rest(
+    create_write_behind, owner_id
+):
+    write_behind = create_write_behind(batch_size=1)
+    room_id = uuid.uuid4()
+
+    async def run():
+        await write_behind.start()
+        # Enqueued off the loop, like the controller does
+        await asyncio.to_thread(write_behind.enqueue, _turn(owner_id, room_id, "a"))
+        for _ in range(100):
+            if write_behind.stats().flushed_turns:
+                break
+            await asyncio.sleep(0.01)
+        assert write_behind.stats().flushed_turns == 1
+
+        write_behind.enqueue(_turn(owner_id, room_id, "b"))
+        await write_behind.stop()
+
+    asyncio.run(run())
+
+    assert create_write_behind.rooms.written == {room_id: ["a", "b"]}
@@ -0,0 +1,134 @@
+import uuid
+from typing import TYPE_CHECKING, Literal
+
+from common.deadlines import Deadline
+from database.database import apply_deadline
+from pydantic import BaseModel
+from sqlmodel import Session
+
+from todos.conf import settings
+from todos.graph import TodosGraphState, TodosGraphStateSuccess
+from todos.models import Todo
+from todos.schemas import (
+    TODOS_CURSOR_PREFIX,
+    TodoCreatePayload,
+    TodoListPayload,
+    parse_todos_list_arguments,
+)
+
+if TYPE_CHECKING:
+    from database.database import Databaseable
+
+TODOS_LIST_COMMAND = "/todos"
+TODO_COMMAND = "/todo"
+
+TODO_CREATE_SUBCOMMANDS = {"add", "new", "create"}
+TODO_LIST_SUBCOMMANDS = {"list", "ls", "show"}
+
+
+class TodosCommand(BaseModel):
+    action: Literal["create", "list"]
+    title: str | None = None
+    list_payload: TodoListPayload | None = None
+
+
+def parse_todos_command(user_input: str) -> TodosCommand | None:
+    """
+    Parse the direct todo command grammar, returning `None` when the input is
+    not a command so it can be handled by the agents instead.
+
+    /todos [all|open|pending|done|completed] [search terms] [after:<cursor>]
+    /todo [list|ls|show] [all|open|pending|done|completed] [search terms]
+        [after:<cursor>]
+    /todo add|new|create <title>
+    """
+    command, _, arguments = user_input.strip().partition(" ")
+    command = command.lower()
+    arguments = arguments.strip()
+
+    if command == TODOS_LIST_COMMAND:
+        return _parse_list_arguments(arguments)
+
+    if command != TODO_COMMAND:
+        return None
+
+    subcommand, _, subcommand_arguments = arguments.partition(" ")
+    subcommand = subcommand.lower()
+    subcommand_arguments = subcommand_arguments.strip()
+
+    if subcommand in TODO_CREATE_SUBCOMMANDS:
+        if not subcommand_arguments:
+            return None
+
+        return TodosCommand(action="create", title=subcommand_arguments)
+
+    if not subcommand or subcommand in TODO_LIST_SUBCOMMANDS:
+        return _parse_list_arguments(subcommand_arguments)
+
+    return None
+
+
+def todos_command_invoke(
+    database: "Databaseable",
+    owner_id: uuid.UUID,
+    user_input: str,
+    command: TodosCommand,
+    deadline: Deadline | None = None,
+) -> TodosGraphState:
+    state = TodosGraphState(
+        user_input=user_input,
+        action=command.action,
+        result=None,
+        todos=[],
+        list_payload=command.list_payload,
+        new_todo=None,
+    )
+
+    if command.action == "create":
+        assert command.title is not None
+
+        with Session(database.engine) as session:
+            apply_deadline(session=session, deadline=deadline)
+            new_todo = Todo.create(
+                payload=TodoCreatePayload(title=command.title),
+                owner_id=owner_id,
+                session=session,
+            )
+        database.record_write("todo", owner_id)
+
+        return state.with_success_result(
+            TodosGraphStateSuccess(action="create")
+        ).with_new_todo(new_todo=new_todo)
+
+    list_payload = command.list_payload
+    if list_payload is None:
+        list_payload = TodoListPayload(limit=settings.todos_list_limit)
+
+    with Session(database.reader_engine("todo", owner_id)) as session:
+        apply_deadline(session=session, deadline=deadline)
+        todos_page = Todo.list(session=session, owner_id=owner_id, payload=list_payload)
+
+    return state.with_success_result(TodosGraphStateSuccess(action="list")).with_todos(
+        todos_page
+    )
+
+
+def todos_next_page_command(list_payload: TodoListPayload, cursor: str) -> str:
+    """The list command showing the page after `cursor`, with the same filters."""
+    arguments = [TODOS_LIST_COMMAND]
+    if list_payload.completed is not None:
+        arguments.append("done" if list_payload.completed else "open")
+    if list_payload.search is not None:
+        arguments.append(list_payload.search)
+    arguments.append(f"{TODOS_CURSOR_PREFIX}{cursor}")
+
+    return " ".join(arguments)
+
+
+def _parse_list_arguments(arguments: str) -> TodosCommand:
+    return TodosCommand(
+        action="list",
+        list_payload=parse_todos_list_arguments(
+            arguments, limit=settings.todos_list_limit
+        ),
+    )
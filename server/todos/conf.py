@@ -1,7 +1,15 @@
-from common.conf import BaseSettings
+from typing import TYPE_CHECKING
 
+from common.conf import BaseSettings, lazy_settings
 
-class __Settings(BaseSettings): ...
+if TYPE_CHECKING:
+    from agents_play.conf import Settings
 
 
-settings = __Settings()  # type: ignore
+class TodosSettings(BaseSettings):
+    todos_list_limit: int = 20
+    todos_cache_enabled: bool = True
+    todos_cache_max_entries: int = 256
+
+
+settings: "Settings" = lazy_settings()
@@ -1,21 +1,35 @@
+import asyncio
+import logging
+import uuid
 from typing import TYPE_CHECKING, Literal, TypedDict
 
+from common.agents import routed_agent
+from common.deadlines import (
+    Deadline,
+    DeadlineExceededError,
+    deadline_config,
+    get_deadline,
+)
+from database.database import apply_deadline
 from langchain_core.messages import AIMessage
 from langchain_core.runnables import RunnableConfig
 from langgraph.graph.state import StateGraph
-from langgraph.prebuilt import create_react_agent
 from langgraph.types import Command as LanggraphCommand
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
 from sqlmodel import Session
 
 from todos.conf import settings
-from todos.models import Todo, TodoDataclass
-from todos.schemas import TodoCreatePayload
+from todos.models import Todo, TodoDataclass, TodoListPage
+from todos.schemas import (
+    TodoCreatePayload,
+    TodoListPayload,
+    parse_todos_list_arguments,
+)
 
 if TYPE_CHECKING:
     from database.database import Databaseable
 
-assert settings.openai_api_key
+logger = logging.getLogger(__name__)
 
 TodosGraphNodes = Literal[
     "todos_entry_node",
@@ -29,15 +43,26 @@ TodosGraphCommand = LanggraphCommand[TodosGraphNodes]
 
 class TodosGraphConfig(TypedDict):
     database: "Databaseable"
+    owner_id: uuid.UUID
+    deadline: Deadline | None
 
 
-TodosExceptionCodes = Literal["agent_invocation_failed"]
+TodosExceptionCodes = Literal["agent_invocation_failed", "deadline_exceeded"]
 
 
 class TodosGraphStateFailure(BaseModel):
-    def __init__(self, code: TodosExceptionCodes, cause: Exception | None = None):
-        self.code = code
-        self.cause = cause
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    code: TodosExceptionCodes
+    # Not checkpointed, exceptions don't serialize
+    cause: Exception | None = Field(default=None, exclude=True)
+
+    @classmethod
+    def from_agent_exception(cls, cause: Exception) -> "TodosGraphStateFailure":
+        if isinstance(cause, DeadlineExceededError):
+            return cls(code="deadline_exceeded", cause=cause)
+
+        return cls(code="agent_invocation_failed", cause=cause)
 
 
 TodosActionTaken = Literal["create", "list", "unknown"]
@@ -52,6 +77,9 @@ class TodosGraphState(BaseModel):
     action: TodosActionTaken | None
     result: TodosGraphStateSuccess | TodosGraphStateFailure | None
     todos: list[TodoDataclass]
+    todos_remaining: int = 0
+    todos_next_cursor: str | None = None
+    list_payload: TodoListPayload | None = None
     new_todo: TodoDataclass | None
 
     def with_error_result(
@@ -84,10 +112,17 @@ class TodosGraphState(BaseModel):
 
         return self
 
-    def with_todos(self, todos: list[TodoDataclass]) -> "TodosGraphState":
+    def with_list_payload(self, list_payload: TodoListPayload) -> "TodosGraphState":
+        self.list_payload = list_payload
+
+        return self
+
+    def with_todos(self, todos_page: TodoListPage) -> "TodosGraphState":
         assert self.action == "list"
 
-        self.todos = todos
+        self.todos = todos_page.todos
+        self.todos_remaining = todos_page.remaining
+        self.todos_next_cursor = todos_page.next_cursor
 
         return self
 
@@ -112,26 +147,31 @@ class TodosGraphState(BaseModel):
 PLANNING_AGENT_PROMPT = """
 You are a TODO management planning agent. Your job is to analyze user input and determine what action they want to take with their todos.
 
-Based on the user's input, you must respond with exactly ONE of these words:
+Based on the user's input, you must respond with exactly ONE of these actions:
 - "create" - if the user wants to add, create, make, or insert a new todo item
 - "list" - if the user wants to see, show, display, view, or get their existing todos
 - "unknown" - if the user's request doesn't match either of the above actions
 
+After "list", add "open" when the user only wants the todos still to do, or "done" when they only want the completed ones. Then add the words the todo titles must contain, when the user asks for particular todos.
+
 Examples:
 - "Add a new task to buy groceries" → create
 - "I need to create a reminder to call mom" → create
 - "Show me my todos" → list
 - "What tasks do I have?" → list
 - "List all my todo items" → list
+- "What do I still have to do?" → list open
+- "Which todos about groceries did I finish?" → list done groceries
+- "Show my todos about the car" → list car
 - "Delete my first todo" → unknown
 - "What's the weather like?" → unknown
 
-Only respond with the single word: create, list, or unknown. Do not provide any explanation or additional text.
+Only respond with the action and its filters: create, list, or unknown. Do not provide any explanation or additional text.
 """.strip()
 
 
-planning_agent = create_react_agent(
-    "openai:gpt-4o-mini", tools=[], prompt=PLANNING_AGENT_PROMPT
+planning_agent = routed_agent(
+    "todos_planning", "classification", tools=[], prompt=PLANNING_AGENT_PROMPT
 )
 
 
@@ -160,19 +200,26 @@ Examples:
 Only respond with the extracted title. Do not provide any explanation or additional text.
 """.strip()
 
-title_extracting_agent = create_react_agent(
-    "openai:gpt-4o-mini", tools=[], prompt=TITLE_EXTRACTING_AGENT_PROMPT
+title_extracting_agent = routed_agent(
+    "todos_title_extracting",
+    "extraction",
+    tools=[],
+    prompt=TITLE_EXTRACTING_AGENT_PROMPT,
 )
 
 
-async def todos_entry_node(state: TodosGraphState) -> TodosGraphCommand:
+async def todos_entry_node(
+    state: TodosGraphState, config: RunnableConfig
+) -> TodosGraphCommand:
     messages = [{"role": "user", "content": state.user_input}]
     try:
-        planning_response = await planning_agent.ainvoke({"messages": messages})
+        planning_response = await planning_agent.ainvoke(
+            {"messages": messages}, config=deadline_config(get_deadline(config))
+        )
     except Exception as e:
         return TodosGraphCommand(
             update=state.with_error_result(
-                TodosGraphStateFailure(code="agent_invocation_failed", cause=e)
+                TodosGraphStateFailure.from_agent_exception(e)
             )
         )
 
@@ -182,11 +229,17 @@ async def todos_entry_node(state: TodosGraphState) -> TodosGraphCommand:
     assert isinstance(ai_message, AIMessage)
     assert isinstance(ai_message.content, str)
 
-    if ai_message.content == "create":
+    action, _, plan_arguments = ai_message.content.strip().partition(" ")
+    if action == "create":
         return TodosGraphCommand(
             update=state.with_action("create"), goto="todos_create_node"
         )
-    elif ai_message.content == "list":
+    elif action == "list":
+        if state.list_payload is None:
+            state = state.with_list_payload(
+                _planned_list_payload(plan_arguments, state.user_input)
+            )
+
         return TodosGraphCommand(
             update=state.with_action("list"), goto="todos_list_node"
         )
@@ -200,13 +253,16 @@ async def todos_entry_node(state: TodosGraphState) -> TodosGraphCommand:
 async def todos_create_node(
     state: TodosGraphState, config: RunnableConfig
 ) -> TodosGraphCommand:
+    deadline = get_deadline(config)
     messages = [{"role": "user", "content": state.user_input}]
     try:
-        title_response = await title_extracting_agent.ainvoke({"messages": messages})
+        title_response = await title_extracting_agent.ainvoke(
+            {"messages": messages}, config=deadline_config(deadline)
+        )
     except Exception as e:
         return TodosGraphCommand(
             update=state.with_error_result(
-                TodosGraphStateFailure(code="agent_invocation_failed", cause=e)
+                TodosGraphStateFailure.from_agent_exception(e)
             ),
             goto="todos_finish_node",
         )
@@ -222,11 +278,18 @@ async def todos_create_node(
     configurable: TodosGraphConfig = config["configurable"]  # type: ignore
     database = configurable["database"]
 
-    new_todo: TodoDataclass
-    with Session(database.engine) as session:
-        new_todo = Todo.create(
-            payload=TodoCreatePayload(title=todo_title), session=session
-        )
+    def create_todo() -> TodoDataclass:
+        with Session(database.engine) as session:
+            apply_deadline(session=session, deadline=deadline)
+            return Todo.create(
+                payload=TodoCreatePayload(title=todo_title),
+                owner_id=configurable["owner_id"],
+                session=session,
+            )
+
+    # The database is used synchronously, kept off the event loop
+    new_todo = await asyncio.to_thread(create_todo)
+    database.record_write("todo", configurable["owner_id"])
 
     return TodosGraphCommand(
         update=state.with_success_result(
@@ -242,17 +305,41 @@ def todos_list_node(
     configurable: TodosGraphConfig = config["configurable"]  # type: ignore
     database = configurable["database"]
 
-    with Session(database.engine) as session:
-        todos = Todo.list(session=session)
+    list_payload = state.list_payload
+    if list_payload is None:
+        list_payload = TodoListPayload(limit=settings.todos_list_limit)
+
+    with Session(database.reader_engine("todo", configurable["owner_id"])) as session:
+        apply_deadline(session=session, deadline=get_deadline(config))
+        todos_page = Todo.list(
+            session=session, owner_id=configurable["owner_id"], payload=list_payload
+        )
 
     return TodosGraphCommand(
         update=state.with_success_result(
             TodosGraphStateSuccess(action="list")
-        ).with_todos(todos),
+        ).with_todos(todos_page),
         goto="todos_finish_node",
     )
 
 
+def _planned_list_payload(plan_arguments: str, user_input: str) -> TodoListPayload:
+    """
+    The filters the planning agent wrote after `list`. The cursor is taken
+    from the user input as typed, models don't copy it reliably.
+    """
+    limit = settings.todos_list_limit
+    try:
+        list_payload = parse_todos_list_arguments(plan_arguments, limit=limit)
+    except ValidationError:
+        logger.warning("Ignoring unusable todo list filters %r", plan_arguments)
+        list_payload = TodoListPayload(limit=limit)
+
+    cursor = parse_todos_list_arguments(user_input, limit=limit).cursor
+
+    return list_payload.model_copy(update={"cursor": cursor})
+
+
 def todos_finish_node(state: TodosGraphState) -> TodosGraphState:
     return state
 
@@ -270,12 +357,27 @@ todos_graph = (
 
 
 async def todos_graph_invoke(
-    database: "Databaseable", user_input: str
+    database: "Databaseable",
+    owner_id: uuid.UUID,
+    user_input: str,
+    list_payload: TodoListPayload | None = None,
+    deadline: Deadline | None = None,
 ) -> TodosGraphState:
     state = TodosGraphState(
-        user_input=user_input, action="unknown", result=None, todos=[], new_todo=None
+        user_input=user_input,
+        action="unknown",
+        result=None,
+        todos=[],
+        list_payload=list_payload,
+        new_todo=None,
     )
-    config = {"configurable": {"database": database}}
+    config = {
+        "configurable": {
+            "database": database,
+            "owner_id": owner_id,
+            "deadline": deadline,
+        }
+    }
     end_state = await todos_graph.ainvoke(
         input=state,  # type: ignore
         config=config,  # type: ignore
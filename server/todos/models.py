@@ -1,11 +1,20 @@
+import base64
+import binascii
 import uuid
 from datetime import datetime
+from typing import Any
 
+from common.cache import VersionedCache
 from common.datetime_utils import datetime_now_with_timezone
+from common.exceptions import AgentsPlayBadRequestError
+from database.database import OWNER_HASH_PARTITIONED
 from pydantic import BaseModel
+from sqlalchemy import Index, and_, func, or_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
 from sqlmodel import Column, DateTime, Field, SQLModel, Session, col, select
 
-from todos.schemas import TodoCreatePayload
+from todos.conf import settings
+from todos.schemas import TodoCreatePayload, TodoListPayload
 
 
 class TodoDataclass(BaseModel):
@@ -15,9 +24,51 @@ class TodoDataclass(BaseModel):
     completed: bool
 
 
+class TodoListPage(BaseModel):
+    todos: list[TodoDataclass]
+    next_cursor: str | None
+    remaining: int
+
+
+class TodosVersion(SQLModel, table=True):
+    """Version of one owner's todos, bumped by every write to them."""
+
+    __tablename__: str = "todos_version"  # type: ignore
+
+    owner_id: uuid.UUID = Field(primary_key=True)
+    version: int = Field(default=0)
+
+    @staticmethod
+    def current(session: Session, owner_id: uuid.UUID) -> int:
+        todos_version = session.get(TodosVersion, owner_id)
+        if todos_version is None:
+            return 0
+
+        return todos_version.version
+
+    @staticmethod
+    def bump(session: Session, owner_id: uuid.UUID) -> int:
+        """
+        Bump the owner's version in one statement, concurrent first writes of
+        an owner would otherwise both insert its row.
+        """
+        insert = postgresql_insert(TodosVersion).values(owner_id=owner_id, version=1)
+        query = insert.on_conflict_do_update(
+            index_elements=[col(TodosVersion.owner_id)],
+            set_={"version": col(TodosVersion.version) + 1},
+        ).returning(col(TodosVersion.version))
+
+        version: int = session.execute(query).scalar_one()
+
+        return version
+
+
 class Todo(SQLModel, table=True):
     __tablename__: str = "todo"  # type: ignore
+    __table_args__ = OWNER_HASH_PARTITIONED
 
+    # Part of the primary key, Postgres wants the partition key in it
+    owner_id: uuid.UUID = Field(primary_key=True)
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     updated_at: datetime = Field(
         sa_column=Column(
@@ -40,17 +91,139 @@ class Todo(SQLModel, table=True):
 
     @staticmethod
     def create(
-        payload: TodoCreatePayload, session: Session, commit: bool = True
+        payload: TodoCreatePayload,
+        owner_id: uuid.UUID,
+        session: Session,
+        commit: bool = True,
     ) -> "TodoDataclass":
-        todo = Todo(title=payload.title)
+        todo = Todo(owner_id=owner_id, title=payload.title)
         session.add(todo)
+        # Only this owner's cached pages go stale, the others stay valid
+        TodosVersion.bump(session=session, owner_id=owner_id)
         if commit:
             session.commit()
 
         return todo.to_dataclass()
 
     @staticmethod
-    def list(session: Session) -> list[TodoDataclass]:
-        query = select(Todo).order_by(col(Todo.updated_at).desc())
+    def list(
+        session: Session, owner_id: uuid.UUID, payload: TodoListPayload | None = None
+    ) -> TodoListPage:
+        if payload is None:
+            payload = TodoListPayload()
+
+        if not settings.todos_cache_enabled:
+            return Todo.__list(session=session, owner_id=owner_id, payload=payload)
+
+        # Read the version before the todos, a write landing in between will
+        # only make the cached page look older than it is, never newer
+        version = TodosVersion.current(session=session, owner_id=owner_id)
+        cache_key = (owner_id, payload.model_dump_json())
+        cached_todos_page = get_todos_list_cache().get(key=cache_key, version=version)
+        if cached_todos_page is not None:
+            return cached_todos_page
+
+        todos_page = Todo.__list(session=session, owner_id=owner_id, payload=payload)
+        get_todos_list_cache().set(key=cache_key, version=version, value=todos_page)
+
+        return todos_page
+
+    @staticmethod
+    def __list(
+        session: Session, owner_id: uuid.UUID, payload: TodoListPayload
+    ) -> TodoListPage:
+        # Pins the query to the owner's partition and leads every index
+        filters: list[Any] = [col(Todo.owner_id) == owner_id]
+        if payload.completed is not None:
+            filters.append(col(Todo.completed) == payload.completed)
+        if payload.search is not None:
+            filters.append(
+                col(Todo.title).ilike(f"%{_escape_like(payload.search)}%", escape="\\")
+            )
+        if payload.cursor is not None:
+            cursor_updated_at, cursor_id = _decode_cursor(payload.cursor)
+            filters.append(
+                or_(
+                    col(Todo.updated_at) < cursor_updated_at,
+                    and_(
+                        col(Todo.updated_at) == cursor_updated_at,
+                        col(Todo.id) < cursor_id,
+                    ),
+                )
+            )
+
+        query = (
+            select(Todo)
+            .where(*filters)
+            .order_by(col(Todo.updated_at).desc(), col(Todo.id).desc())
+            .limit(payload.limit)
+        )
+        todos = [todo.to_dataclass() for todo in session.exec(query).all()]
+
+        remaining = 0
+        if len(todos) == payload.limit:
+            count_query = select(func.count()).select_from(Todo).where(*filters)
+            remaining = max(session.exec(count_query).one() - len(todos), 0)
+
+        next_cursor: str | None = None
+        if remaining > 0:
+            next_cursor = _encode_cursor(todos[-1])
+
+        return TodoListPage(todos=todos, next_cursor=next_cursor, remaining=remaining)
+
+
+Index(
+    "ix_todo_owner_id_updated_at_id",
+    col(Todo.owner_id),
+    col(Todo.updated_at).desc(),
+    col(Todo.id).desc(),
+)
+Index(
+    "ix_todo_owner_id_completed_updated_at_id",
+    col(Todo.owner_id),
+    col(Todo.completed),
+    col(Todo.updated_at).desc(),
+    col(Todo.id).desc(),
+)
+# Led by the owner (btree_gin), so a title search only scans the owner's todos
+Index(
+    "ix_todo_owner_id_title_trgm",
+    col(Todo.owner_id),
+    col(Todo.title),
+    postgresql_using="gin",
+    postgresql_ops={"title": "gin_trgm_ops"},
+)
+
+
+__todos_list_cache: VersionedCache[TodoListPage] | None = None
+
+
+def get_todos_list_cache() -> VersionedCache[TodoListPage]:
+    global __todos_list_cache
+
+    if __todos_list_cache is None:
+        __todos_list_cache = VersionedCache(
+            max_entries=settings.todos_cache_max_entries
+        )
+
+    return __todos_list_cache
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _encode_cursor(todo: TodoDataclass) -> str:
+    raw_cursor = f"{todo.updated_at.isoformat()}|{todo.id}"
+
+    return base64.urlsafe_b64encode(raw_cursor.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    try:
+        raw_cursor = base64.urlsafe_b64decode(cursor.encode()).decode()
+        raw_updated_at, raw_id = raw_cursor.split("|", 1)
 
-        return list(map(lambda todo: todo.to_dataclass(), session.exec(query).all()))
+        return datetime.fromisoformat(raw_updated_at), uuid.UUID(raw_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise AgentsPlayBadRequestError
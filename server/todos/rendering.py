@@ -0,0 +1,85 @@
+import random
+
+from todos.commands import todos_next_page_command
+from todos.conf import settings
+from todos.graph import TodosGraphState
+from todos.models import TodoDataclass
+from todos.schemas import TodoListPayload
+
+TODO_CREATED_TEMPLATES = (
+    'Done! I added "{title}" to your todos.',
+    'Got it, "{title}" is now on your todo list.',
+    'I created a new todo: "{title}".',
+)
+
+TODO_NOT_CREATED_TEMPLATES = (
+    "I understood that you wanted to add a todo, but I couldn't create one. Could you rephrase what you'd like to add?",
+    "Sorry, I wasn't able to create that todo. Could you try describing the task again?",
+)
+
+TODOS_LISTED_TEMPLATES = (
+    "Here are your todos:\n{todos}",
+    "This is what's on your todo list:\n{todos}",
+    "Your current todos:\n{todos}",
+)
+
+TODOS_EMPTY_TEMPLATES = (
+    "Your todo list is empty.",
+    "You don't have any todos right now.",
+    "Nothing on your todo list at the moment.",
+)
+
+TODOS_REMAINING_TEMPLATES = (
+    "...and {remaining} more not shown.",
+    "There are {remaining} more todos not shown here.",
+)
+
+TODOS_NEXT_PAGE_TEMPLATE = "Send `{command}` to see the next ones."
+
+TODOS_UNKNOWN_ACTION_TEMPLATES = (
+    "I can add todos and show your todo list, but I can't do that yet.",
+    "Sorry, for now I can only create todos or list them.",
+)
+
+
+def render_todos_response(todos_state: TodosGraphState) -> str:
+    todos_ok_result = todos_state.ok_result
+    assert todos_ok_result is not None
+
+    if todos_ok_result.action == "create":
+        if todos_state.new_todo is None:
+            return random.choice(TODO_NOT_CREATED_TEMPLATES)
+
+        return random.choice(TODO_CREATED_TEMPLATES).format(
+            title=todos_state.new_todo.title
+        )
+
+    if todos_ok_result.action == "list":
+        if not todos_state.todos:
+            return random.choice(TODOS_EMPTY_TEMPLATES)
+
+        response = random.choice(TODOS_LISTED_TEMPLATES).format(
+            todos=_render_todos(todos_state.todos)
+        )
+        if todos_state.todos_remaining > 0:
+            response += "\n" + random.choice(TODOS_REMAINING_TEMPLATES).format(
+                remaining=todos_state.todos_remaining
+            )
+            if todos_state.todos_next_cursor is not None:
+                response += "\n" + TODOS_NEXT_PAGE_TEMPLATE.format(
+                    command=todos_next_page_command(
+                        list_payload=todos_state.list_payload
+                        or TodoListPayload(limit=settings.todos_list_limit),
+                        cursor=todos_state.todos_next_cursor,
+                    )
+                )
+
+        return response
+
+    return random.choice(TODOS_UNKNOWN_ACTION_TEMPLATES)
+
+
+def _render_todos(todos: list[TodoDataclass]) -> str:
+    return "\n".join(
+        f"- [{'x' if todo.completed else ' '}] {todo.title}" for todo in todos
+    )
@@ -1,5 +1,64 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator
+
+TODOS_LIST_MAX_LIMIT = 100
 
 
 class TodoCreatePayload(BaseModel):
     title: str
+
+
+class TodoListPayload(BaseModel):
+    limit: int = Field(default=20, ge=1, le=TODOS_LIST_MAX_LIMIT)
+    cursor: str | None = None
+    completed: bool | None = None
+    search: str | None = None
+
+    @field_validator("search", mode="before")
+    @classmethod
+    def strip_search(cls, v: str | None) -> str | None:
+        if v is None:
+            return None
+
+        stripped = v.strip()
+        if not stripped:
+            return None
+
+        return stripped
+
+
+# Continues a listing after the last todo shown, `after:<cursor>`
+TODOS_CURSOR_PREFIX = "after:"
+
+TODOS_COMPLETED_FILTERS: dict[str, bool | None] = {
+    "all": None,
+    "open": False,
+    "pending": False,
+    "done": True,
+    "completed": True,
+}
+
+
+def parse_todos_list_arguments(arguments: str, limit: int) -> TodoListPayload:
+    """
+    Parse `[all|open|pending|done|completed] [search terms] [after:<cursor>]`,
+    the filters of a todo listing.
+    """
+    cursor: str | None = None
+    words = []
+    for word in arguments.split():
+        if word.lower().startswith(TODOS_CURSOR_PREFIX):
+            cursor = word[len(TODOS_CURSOR_PREFIX) :] or None
+        else:
+            words.append(word)
+    arguments = " ".join(words)
+
+    completed: bool | None = None
+    completed_filter, _, search = arguments.partition(" ")
+    if completed_filter.lower() in TODOS_COMPLETED_FILTERS:
+        completed = TODOS_COMPLETED_FILTERS[completed_filter.lower()]
+    else:
+        search = arguments
+
+    return TodoListPayload(
+        limit=limit, cursor=cursor, completed=completed, search=search
+    )
@@ -0,0 +1,21 @@
+import hmac
+from typing import Annotated
+
+from fastapi import Header
+
+from usage.conf import settings
+
+USAGE_ADMIN_TOKEN_HEADER = "x-usage-admin-token"
+
+
+def is_usage_admin(
+    usage_admin_token: Annotated[
+        str | None, Header(alias=USAGE_ADMIN_TOKEN_HEADER)
+    ] = None,
+) -> bool:
+    """Whether the request may read every owner's usage and the meter's stats."""
+    admin_token = settings.usage_admin_token
+    if admin_token is None or usage_admin_token is None:
+        return False
+
+    return hmac.compare_digest(usage_admin_token, admin_token.get_secret_value())
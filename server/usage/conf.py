@@ -0,0 +1,19 @@
+from typing import TYPE_CHECKING
+
+from common.conf import BaseSettings, lazy_settings
+from pydantic import SecretStr
+
+if TYPE_CHECKING:
+    from agents_play.conf import Settings
+
+
+class UsageSettings(BaseSettings):
+    usage_metering_enabled: bool = True
+    usage_batch_size: int = 500
+    usage_flush_interval_seconds: float = 5.0
+    usage_buffer_max_records: int = 50_000
+    # Reads every owner's usage, unset no request can
+    usage_admin_token: SecretStr | None = None
+
+
+settings: "Settings" = lazy_settings()
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+
+from common.flusher import BackgroundFlusher
+from common.usage import LLMUsage, LLMUsageSink
+from database.database import Databaseable, get_database
+from pydantic import BaseModel
+from sqlmodel import Session
+
+from usage.conf import settings
+from usage.models import LLMUsageRecord
+
+logger = logging.getLogger(__name__)
+
+
+class LLMUsageMeterStats(BaseModel):
+    buffered: int
+    written: int
+    dropped: int
+    flush_failures: int
+    last_flush_batch_size: int
+    last_flush_seconds: float | None
+
+
+class LLMUsageMeter(LLMUsageSink):
+    """
+    Buffers the usage of agent invocations in memory and writes it to the
+    usage table in batches from a background flusher, so metering costs the
+    request path an append. Usage is best effort: a full buffer drops the
+    oldest records, and what is buffered at a crash is lost.
+    """
+
+    def __init__(
+        self,
+        database: Databaseable,
+        batch_size: int,
+        flush_interval_seconds: float,
+        max_buffered: int,
+    ) -> None:
+        self.database = database
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_buffered = max_buffered
+
+        self.__buffer: deque[LLMUsage] = deque()
+        self.__lock = threading.Lock()
+        self.__flush_lock = threading.Lock()
+        self.__flusher = BackgroundFlusher(self.flush, flush_interval_seconds)
+
+        self.written = 0
+        self.dropped = 0
+        self.flush_failures = 0
+        self.last_flush_batch_size = 0
+        self.last_flush_seconds: float | None = None
+
+    def add(self, usage: LLMUsage) -> None:
+        with self.__lock:
+            if len(self.__buffer) >= self.max_buffered:
+                self.__buffer.popleft()
+                self.dropped += 1
+            self.__buffer.append(usage)
+            buffered = len(self.__buffer)
+
+        if buffered >= self.batch_size:
+            self.__flusher.wake()
+
+    def stats(self) -> LLMUsageMeterStats:
+        with self.__lock:
+            buffered = len(self.__buffer)
+
+        return LLMUsageMeterStats(
+            buffered=buffered,
+            written=self.written,
+            dropped=self.dropped,
+            flush_failures=self.flush_failures,
+            last_flush_batch_size=self.last_flush_batch_size,
+            last_flush_seconds=self.last_flush_seconds,
+        )
+
+    async def start(self) -> None:
+        await self.__flusher.start()
+
+    async def stop(self) -> None:
+        await self.__flusher.stop()
+
+        await asyncio.to_thread(self.flush_all)
+
+    def flush_all(self) -> None:
+        while self.flush() > 0:
+            pass
+
+    def flush(self) -> int:
+        with self.__flush_lock:
+            with self.__lock:
+                batch = [
+                    self.__buffer.popleft()
+                    for _ in range(min(self.batch_size, len(self.__buffer)))
+                ]
+            if not batch:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                with Session(self.database.engine) as session:
+                    LLMUsageRecord.insert_many(batch, session=session)
+                    session.commit()
+            except Exception:
+                self.flush_failures += 1
+                logger.exception("Failed to write %d usage records", len(batch))
+                with self.__lock:
+                    # Retried with the next flush, unless newer usage filled up
+                    # the buffer meanwhile
+                    room = self.max_buffered - len(self.__buffer)
+                    self.__buffer.extendleft(reversed(batch[:room]))
+                    self.dropped += len(batch) - min(room, len(batch))
+                return 0
+
+            self.written += len(batch)
+            self.last_flush_batch_size = len(batch)
+            self.last_flush_seconds = time.perf_counter() - start
+
+            return len(batch)
+
+
+__llm_usage_meter: LLMUsageMeter | None = None
+
+
+def get_llm_usage_meter() -> LLMUsageMeter | None:
+    global __llm_usage_meter
+
+    if not settings.usage_metering_enabled:
+        return None
+
+    if __llm_usage_meter is None:
+        __llm_usage_meter = LLMUsageMeter(
+            database=get_database(),
+            batch_size=settings.usage_batch_size,
+            flush_interval_seconds=settings.usage_flush_interval_seconds,
+            max_buffered=settings.usage_buffer_max_records,
+        )
+
+    return __llm_usage_meter
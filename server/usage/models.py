@@ -0,0 +1,108 @@
+import uuid
+from datetime import datetime
+from typing import Any
+
+from common.datetime_utils import datetime_now_with_timezone
+from common.usage import LLMUsage
+from sqlalchemy import Index, func, insert
+from sqlmodel import Column, DateTime, Field, SQLModel, Session, col, select
+
+from usage.schemas import LLMUsageAggregate, LLMUsageGroupBy, LLMUsageQueryPayload
+
+
+class LLMUsageRecord(SQLModel, table=True):
+    __tablename__: str = "llm_usage"  # type: ignore
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    recorded_at: datetime = Field(
+        sa_column=Column(DateTime(timezone=True), nullable=False),
+        default_factory=datetime_now_with_timezone,
+    )
+    request_id: uuid.UUID | None = None
+    owner_id: uuid.UUID | None = None
+    room_id: uuid.UUID | None = None
+    node: str | None = None
+    node_path: str | None = None
+    agent: str
+    model: str
+    model_calls: int
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int
+    latency_seconds: float
+    estimated_cost: float
+    failed: bool = False
+
+    @staticmethod
+    def insert_many(usages: list[LLMUsage], session: Session) -> None:
+        # One multi-row INSERT, no ORM objects are needed for rows never read
+        session.execute(
+            insert(LLMUsageRecord),
+            [{"id": uuid.uuid4(), **usage.model_dump()} for usage in usages],
+        )
+
+    @staticmethod
+    def aggregate(
+        session: Session, payload: LLMUsageQueryPayload
+    ) -> list[LLMUsageAggregate]:
+        group_columns = {
+            group_by: _group_column(session, group_by) for group_by in payload.group_by
+        }
+
+        filters: list[Any] = []
+        if payload.since is not None:
+            filters.append(col(LLMUsageRecord.recorded_at) >= payload.since)
+        if payload.until is not None:
+            filters.append(col(LLMUsageRecord.recorded_at) < payload.until)
+        if payload.owner_id is not None:
+            filters.append(col(LLMUsageRecord.owner_id) == payload.owner_id)
+
+        query = (
+            select(  # type: ignore[call-overload]
+                *(column.label(name) for name, column in group_columns.items()),
+                func.count().label("invocations"),
+                func.count()
+                .filter(col(LLMUsageRecord.failed))
+                .label("failed_invocations"),
+                func.sum(LLMUsageRecord.model_calls).label("model_calls"),
+                func.sum(LLMUsageRecord.prompt_tokens).label("prompt_tokens"),
+                func.sum(LLMUsageRecord.completion_tokens).label("completion_tokens"),
+                func.sum(LLMUsageRecord.cached_tokens).label("cached_tokens"),
+                func.sum(LLMUsageRecord.estimated_cost).label("estimated_cost"),
+                func.avg(LLMUsageRecord.latency_seconds).label("latency_mean_seconds"),
+            )
+            .where(*filters)
+            .group_by(*group_columns.values())
+            .order_by(func.sum(LLMUsageRecord.estimated_cost).desc())
+            .limit(payload.limit)
+        )
+
+        return [
+            LLMUsageAggregate.model_validate(row._mapping)
+            for row in session.execute(query)
+        ]
+
+
+Index(
+    "ix_llm_usage_recorded_at",
+    col(LLMUsageRecord.recorded_at),
+)
+# Serves an owner's own usage, the query every non-admin request makes
+Index(
+    "ix_llm_usage_owner_id_recorded_at",
+    col(LLMUsageRecord.owner_id),
+    col(LLMUsageRecord.recorded_at),
+)
+Index(
+    "ix_llm_usage_request_id",
+    col(LLMUsageRecord.request_id),
+)
+
+
+def _group_column(session: Session, group_by: LLMUsageGroupBy) -> Any:
+    if group_by == "day":
+        if session.get_bind().dialect.name == "postgresql":
+            return func.date_trunc("day", col(LLMUsageRecord.recorded_at))
+        return func.date(col(LLMUsageRecord.recorded_at))
+
+    return col(getattr(LLMUsageRecord, group_by))
@@ -0,0 +1,62 @@
+import uuid
+from typing import Annotated
+
+from common.exceptions import AgentsPlayNotFoundError
+from common.owners import get_owner_id
+from common.schemas import OKResponse
+from database.database import Databaseable, get_database
+from fastapi import APIRouter, Depends, Query
+from sqlmodel import Session
+
+from usage.admin import is_usage_admin
+from usage.meter import LLMUsageMeterStats, get_llm_usage_meter
+from usage.models import LLMUsageRecord
+from usage.schemas import LLMUsageAggregateResponse, LLMUsageQueryPayload
+
+usage_router = APIRouter(prefix="/usage")
+
+
+@usage_router.get("/llm")
+def llm_usage(
+    payload: Annotated[LLMUsageQueryPayload, Query()],
+    database: Annotated[Databaseable, Depends(get_database)],
+    owner_id: Annotated[uuid.UUID, Depends(get_owner_id)],
+    is_admin: Annotated[bool, Depends(is_usage_admin)],
+) -> LLMUsageAggregateResponse:
+    """
+    Token usage and estimated cost of the agent invocations, summed per the
+    requested groups, e.g. `?group_by=day&group_by=node`, costliest first.
+    Only the caller's own usage, unless the admin token is given, then any
+    owner's or, without an `owner_id`, everyone's.
+    """
+    if not is_admin:
+        if payload.owner_id not in (None, owner_id):
+            raise AgentsPlayNotFoundError
+
+        payload = payload.model_copy(update={"owner_id": owner_id})
+
+    with Session(database.reader_engine("usage", owner_id)) as session:
+        aggregates = LLMUsageRecord.aggregate(session=session, payload=payload)
+
+    return LLMUsageAggregateResponse(detail="OK", data=aggregates)
+
+
+class LLMUsageMeterStatsResponse(OKResponse):
+    enabled: bool
+    data: LLMUsageMeterStats | None
+
+
+@usage_router.get("/llm/meter")
+async def llm_usage_meter_stats(
+    is_admin: Annotated[bool, Depends(is_usage_admin)],
+) -> LLMUsageMeterStatsResponse:
+    if not is_admin:
+        raise AgentsPlayNotFoundError
+
+    llm_usage_meter = get_llm_usage_meter()
+    if llm_usage_meter is None:
+        return LLMUsageMeterStatsResponse(detail="OK", enabled=False, data=None)
+
+    return LLMUsageMeterStatsResponse(
+        detail="OK", enabled=True, data=llm_usage_meter.stats()
+    )
@@ -0,0 +1,38 @@
+import uuid
+from datetime import date, datetime
+from typing import Literal
+
+from common.schemas import OKResponse
+from pydantic import BaseModel, Field
+
+LLMUsageGroupBy = Literal["day", "model", "node", "node_path", "agent", "owner_id"]
+
+
+class LLMUsageQueryPayload(BaseModel):
+    group_by: list[LLMUsageGroupBy] = Field(default=["day", "model", "node"])
+    since: datetime | None = None
+    until: datetime | None = None
+    owner_id: uuid.UUID | None = None
+    limit: int = Field(default=1000, ge=1, le=10_000)
+
+
+class LLMUsageAggregate(BaseModel):
+    # Only the grouped by columns are set
+    day: date | None = None
+    model: str | None = None
+    node: str | None = None
+    node_path: str | None = None
+    agent: str | None = None
+    owner_id: uuid.UUID | None = None
+    invocations: int
+    failed_invocations: int
+    model_calls: int
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int
+    estimated_cost: float
+    latency_mean_seconds: float
+
+
+class LLMUsageAggregateResponse(OKResponse):
+    data: list[LLMUsageAggregate]